@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Connects the signal handlers that keep the dispatch availability index up to date
+        # and delete a user's messages from their shard and their archive files
+        from . import archive
+        from . import dispatch
+        from . import shards
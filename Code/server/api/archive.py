@@ -0,0 +1,201 @@
+# Standard Library
+from datetime import timedelta
+from functools import lru_cache
+import gzip
+import json
+import os
+import shutil
+
+# Django
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Max
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+# Local
+from . import shards
+from .models import Message, MessageArchive, User
+from .pagination import keyset_page
+from .serializers import MessageSerializer
+
+
+def cutoff(now=None):
+    return (now or timezone.now()) - timedelta(days=settings.CHAT_ARCHIVE_AFTER_DAYS)
+
+
+def segment_path(owner_id, first_id, last_id):
+    return f'{owner_id}/{first_id:012d}-{last_id:012d}.jsonl.gz'
+
+
+@receiver(post_delete, sender=User)
+def delete_archive_files(sender, instance, **kwargs):
+    # The stubs go with the user through the foreign key. The files go once that has committed.
+    owner_dir = settings.CHAT_ARCHIVE_DIR / str(instance.id)
+    transaction.on_commit(lambda: shutil.rmtree(owner_dir, ignore_errors=True))
+
+
+def write_segment(using, owner_id, messages):
+    """
+    Writes a run of a user's messages, oldest first, to a new archive file. Then leaves a MessageArchive
+    stub for the file and deletes the messages from api_message in the database they were in.
+
+    Archive files are never changed once written. The file is complete on disk before the messages
+    are deleted, so a crash part way through leaves the messages in place to be archived again.
+    The stub is in the main database, so for messages on a shard it is saved first, and saved
+    again rather than duplicated if they are archived again.
+    """
+    first_id, last_id = messages[0].id, messages[-1].id
+    path = segment_path(owner_id, first_id, last_id)
+    full_path = settings.CHAT_ARCHIVE_DIR / path
+    full_path.parent.mkdir(parents=True, exist_ok=True)
+    partial_path = full_path.with_name(full_path.name + '.partial')
+    with open(partial_path, 'wb') as file:
+        with gzip.open(file, 'wt', encoding='utf-8') as lines:
+            for message in MessageSerializer(messages, many=True).data:
+                lines.write(json.dumps(message) + '\n')
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(partial_path, full_path)
+    # The inner transaction, the stub's, commits first
+    with transaction.atomic(using=using), transaction.atomic():
+        MessageArchive.objects.update_or_create(
+            owner_id=owner_id, first_message_id=first_id,
+            defaults={'last_message_id': last_id, 'message_count': len(messages), 'path': path},
+        )
+        Message.objects.using(using).filter(owner_id=owner_id, id__gte=first_id, id__lte=last_id).delete()
+
+
+def archive_user(using, owner_id, last_id):
+    """
+    Archives a user's messages in a database up to and including last_id, CHAT_ARCHIVE_SEGMENT_SIZE to a file.
+    Returns how many messages were archived.
+    """
+    archived = 0
+    while True:
+        messages = list(
+            Message.objects.using(using).filter(owner_id=owner_id, id__lte=last_id)
+            .order_by('id')[:settings.CHAT_ARCHIVE_SEGMENT_SIZE]
+        )
+        if not messages:
+            return archived
+        write_segment(using, owner_id, messages)
+        archived += len(messages)
+
+
+def archive_old_messages(now=None):
+    """
+    Moves every message older than CHAT_ARCHIVE_AFTER_DAYS out of api_message, in the main database
+    and every shard, into archive files.
+
+    Each user's messages are archived up to their newest old one, so a user's archived messages
+    are always older than the ones left in the database and paging can move from one to the other by id.
+
+    Returns:
+        (how many users had messages archived, how many messages were archived)
+    """
+    users = archived = 0
+    for using in shards.databases():
+        boundaries = list(
+            Message.objects.using(using).filter(date_time_created__lt=cutoff(now))
+            .values('owner_id').annotate(last_id=Max('id'))
+            .values_list('owner_id', 'last_id')
+        )
+        users += len(boundaries)
+        archived += sum(archive_user(using, owner_id, last_id) for owner_id, last_id in boundaries)
+    return users, archived
+
+
+def compact(using=DEFAULT_DB_ALIAS):
+    """
+    Merges the full-text index's segments and rebuilds the database file without the space the
+    archived messages left behind. VACUUM rewrites the whole file and holds the write lock while it does.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute("INSERT INTO api_message_fts(api_message_fts) VALUES ('optimize')")
+        cursor.execute('VACUUM')
+
+
+@lru_cache(maxsize=settings.CHAT_ARCHIVE_CACHED_SEGMENTS)
+def load_segment(full_path):
+    """
+    Returns the messages in an archive file, oldest first, as serialized by MessageSerializer.
+    Archive files never change, so they are cached. The messages must not be modified.
+    """
+    with gzip.open(full_path, 'rt', encoding='utf-8') as lines:
+        return tuple(json.loads(line) for line in lines)
+
+
+def segment_messages(segment):
+    return load_segment(str(settings.CHAT_ARCHIVE_DIR / segment.path))
+
+
+def read_before(owner_id, before_id, limit):
+    """
+    Reads a user's newest archived messages older than before_id, or their newest archived
+    messages if before_id is None, newest first.
+
+    Returns:
+        (up to limit messages, whether there are older ones)
+    """
+    segments = MessageArchive.objects.filter(owner_id=owner_id).order_by('-last_message_id')
+    if before_id is not None:
+        segments = segments.filter(first_message_id__lt=before_id)
+    if limit == 0:
+        # The stubs are enough to tell, without opening a file
+        return [], segments.exists()
+    messages = []
+    # Every file holds at least one message, so limit + 1 files are always enough
+    for segment in segments[:limit + 1]:
+        messages.extend(
+            message for message in reversed(segment_messages(segment))
+            if before_id is None or message['id'] < before_id
+        )
+        if len(messages) > limit:
+            break
+    return messages[:limit], len(messages) > limit
+
+
+def read_after(owner_id, after_id, limit):
+    """
+    Reads up to limit of a user's oldest archived messages newer than after_id, oldest first.
+    """
+    segments = MessageArchive.objects.filter(owner_id=owner_id, last_message_id__gt=after_id).order_by('last_message_id')
+    messages = []
+    for segment in segments[:limit]:
+        messages.extend(message for message in segment_messages(segment) if message['id'] > after_id)
+        if len(messages) >= limit:
+            break
+    return messages[:limit]
+
+
+def read_page(owner, limit, before_id=None, after_id=None):
+    """
+    keyset_page over a user's whole chat history. Pages are read from api_message until they
+    run past its oldest message, and then from the archive files.
+
+    Returns:
+        (serialized messages newest first, next_cursor), with the same meaning as keyset_page.
+    """
+    owner_id = owner.id
+    recent = shards.messages_of(owner)
+    if after_id is not None:
+        # The oldest newer messages, archived ones first
+        messages = read_after(owner_id, after_id, limit + 1)
+        if len(messages) <= limit:
+            rows = recent.filter(id__gt=after_id).order_by('id')[:limit + 1 - len(messages)]
+            messages.extend(MessageSerializer(rows, many=True).data)
+        next_cursor = messages[limit - 1]['id'] if len(messages) > limit else None
+        messages = messages[:limit]
+        messages.reverse()
+        return messages, next_cursor
+    rows, next_cursor = keyset_page(recent, limit, before_id)
+    messages = list(MessageSerializer(rows, many=True).data)
+    if next_cursor is None:
+        # Paged past the messages still in the database
+        older, has_more = read_before(owner_id, rows[-1].id if rows else before_id, limit - len(messages))
+        messages.extend(older)
+        if has_more:
+            next_cursor = messages[-1]['id']
+    return messages, next_cursor
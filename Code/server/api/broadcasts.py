@@ -0,0 +1,366 @@
+# Standard Library
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import logging
+import threading
+
+# Django
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+# Miscellaneous Utils
+from sendgrid.helpers.mail import Mail
+
+# Local
+from . import config
+from . import messaging
+from .models import Broadcast, Cupid, Dater
+from .spatial import haversine_distance, parse_location
+
+logger = logging.getLogger(__name__)
+
+ROLES = {'dater': Dater, 'cupid': Cupid}
+CHANNELS = ('preferred', 'email', 'text')
+
+
+class Recipient:
+    __slots__ = ('role', 'user_id', 'email', 'phone_number', 'channel')
+
+    def __init__(self, role, user_id, email, phone_number, channel):
+        self.role = role
+        self.user_id = user_id
+        self.email = email
+        self.phone_number = phone_number
+        self.channel = channel
+
+
+def validate_filters(filters):
+    """
+    Checks a broadcast's recipient filter. Every key is optional:
+        role (str): 'dater' or 'cupid'. Both when left out.
+        suspended (bool): Only suspended, or only not suspended, users.
+        region (dict): latitude, longitude and radius_miles of a circle the user's location must be in.
+        channel (str): 'preferred' (the default), 'email' or 'text'. Cupids have no preference and get emails.
+
+    Returns:
+        An error message, or None if the filter is valid.
+    """
+    if not isinstance(filters, dict):
+        return 'filters must be an object'
+    if filters.get('role') is not None and filters['role'] not in ROLES:
+        return f'role must be one of {", ".join(ROLES)}'
+    if filters.get('suspended') is not None and not isinstance(filters['suspended'], bool):
+        return 'suspended must be true or false'
+    if filters.get('channel', 'preferred') not in CHANNELS:
+        return f'channel must be one of {", ".join(CHANNELS)}'
+    region = filters.get('region')
+    if region is not None:
+        try:
+            float(region['latitude']), float(region['longitude']), float(region['radius_miles'])
+        except (KeyError, TypeError, ValueError):
+            return 'region needs a numeric latitude, longitude and radius_miles'
+    return None
+
+
+def in_region(location, region):
+    coordinates = parse_location(location)
+    if coordinates is None:
+        return False
+    distance = haversine_distance(
+        coordinates[0], coordinates[1], float(region['latitude']), float(region['longitude'])
+    )
+    return distance <= float(region['radius_miles'])
+
+
+def recipients(filters, after_role='', after_user_id=0):
+    """
+    Streams the users a broadcast goes to from the database, BROADCAST_CHUNK_SIZE rows at a time.
+    They come by role, then by user id, so a resumed broadcast can start after the last
+    recipient it got through.
+    """
+    roles = [filters['role']] if filters.get('role') else list(ROLES)
+    if after_role in roles:
+        roles = roles[roles.index(after_role):]
+    channel = filters.get('channel', 'preferred')
+    region = filters.get('region')
+    for role in roles:
+        model = ROLES[role]
+        profiles = model.objects.order_by('user_id')
+        if role == after_role:
+            profiles = profiles.filter(user_id__gt=after_user_id)
+        if filters.get('suspended') is not None:
+            profiles = profiles.filter(is_suspended=filters['suspended'])
+        fields = ['user_id', 'user__email', 'user__phone_number', 'location']
+        if model is Dater:
+            fields.append('communication_preference')
+        for row in profiles.values_list(*fields).iterator(chunk_size=settings.BROADCAST_CHUNK_SIZE):
+            if region is not None and not in_region(row[3], region):
+                continue
+            if channel != 'preferred':
+                chosen = channel
+            elif model is Dater and row[4] == Dater.Communication.TEXT:
+                chosen = 'text'
+            else:
+                chosen = 'email'
+            yield Recipient(role, row[0], row[1], row[2], chosen)
+
+
+def send_email_batch(emails, message):
+    """
+    Sends one SendGrid request with a personalization per address, so recipients don't see each other.
+    """
+    mail = Mail(
+        from_email=config.get_secrets().twilio_sender_email,
+        to_emails=emails,
+        subject='Notification from Cupid Code',
+        html_content=message,
+        is_multiple=True,
+    )
+    return messaging.send_mail(mail)
+
+
+class LeaseLost(Exception):
+    """
+    Another sender claimed the broadcast after this one's lease ran out.
+    """
+
+
+class BroadcastSender:
+    """
+    Sends one claimed broadcast. Emails go out in batches of BROADCAST_EMAIL_BATCH_SIZE
+    recipients per SendGrid request. Texts are sent BROADCAST_SMS_CONCURRENCY at a time, and
+    reading recipients waits while that many texts are in flight.
+
+    Every BROADCAST_EMAIL_BATCH_SIZE recipients the sender waits for its texts, saves its
+    progress and the last recipient it got through, and renews its lease. A broadcast resumed
+    after its sender died starts after that recipient, so nobody before it gets the message twice.
+
+    While TWILIO_VERIFIED_NUMBERS_ONLY is on, every text would go to the one reserve number, so
+    the broadcast sends it a single test text instead of one per text recipient.
+    """
+
+    def __init__(self, broadcast):
+        self.broadcast = broadcast
+        self.counts = {
+            'recipient_count': broadcast.recipient_count,
+            'emails_sent': broadcast.emails_sent,
+            'texts_sent': broadcast.texts_sent,
+            'failed_count': broadcast.failed_count,
+        }
+        self.last_error = broadcast.last_error
+        self.sent_through = (broadcast.sent_through_role, broadcast.sent_through_user_id)
+        self.texted = broadcast.texts_sent > 0
+        self._lock = threading.Lock()
+        self._in_flight = threading.BoundedSemaphore(settings.BROADCAST_SMS_CONCURRENCY)
+
+    def count(self, key, amount=1):
+        with self._lock:
+            self.counts[key] += amount
+
+    def fail(self, amount, error):
+        with self._lock:
+            self.counts['failed_count'] += amount
+            self.last_error = str(error)
+
+    def save_progress(self):
+        """
+        Saves the counts and the last recipient got through, and renews the lease.
+        Raises LeaseLost if another sender has claimed the broadcast since.
+        """
+        with self._lock:
+            counts = dict(self.counts)
+            last_error = self.last_error
+        saved = Broadcast.objects.filter(
+            id=self.broadcast.id, status=Broadcast.Status.SENDING, attempts=self.broadcast.attempts,
+        ).update(
+            last_error=last_error, sent_through_role=self.sent_through[0], sent_through_user_id=self.sent_through[1],
+            lease_expires_at=timezone.now() + timedelta(seconds=settings.BROADCAST_LEASE_SECONDS), **counts,
+        )
+        if not saved:
+            raise LeaseLost(f'Broadcast {self.broadcast.id} was claimed by another sender')
+
+    def flush_emails(self, emails):
+        if not emails:
+            return
+        try:
+            send_email_batch(emails, self.broadcast.message)
+            self.count('emails_sent', len(emails))
+        except Exception as e:
+            self.fail(len(emails), e)
+
+    def wait_for_texts(self):
+        for _ in range(settings.BROADCAST_SMS_CONCURRENCY):
+            self._in_flight.acquire()
+        for _ in range(settings.BROADCAST_SMS_CONCURRENCY):
+            self._in_flight.release()
+
+    def checkpoint(self, emails, recipient):
+        self.flush_emails(emails)
+        self.wait_for_texts()
+        if recipient is not None:
+            self.sent_through = (recipient.role, recipient.user_id)
+        self.save_progress()
+
+    def send_text(self, phone_number):
+        try:
+            messaging.send_text_message(self.broadcast.message, messaging.phone_number_for(phone_number))
+            self.count('texts_sent')
+        except Exception as e:
+            self.fail(1, e)
+        finally:
+            self._in_flight.release()
+
+    def run(self):
+        emails = []
+        since_checkpoint = 0
+        recipient = None
+        test_text_only = settings.TWILIO_VERIFIED_NUMBERS_ONLY
+        with ThreadPoolExecutor(max_workers=settings.BROADCAST_SMS_CONCURRENCY) as texts:
+            for recipient in recipients(self.broadcast.filters, *self.sent_through):
+                self.count('recipient_count')
+                since_checkpoint += 1
+                if recipient.channel == 'text':
+                    if not (test_text_only and self.texted):
+                        self.texted = True
+                        self._in_flight.acquire()
+                        texts.submit(self.send_text, recipient.phone_number)
+                else:
+                    emails.append(recipient.email)
+                if since_checkpoint >= settings.BROADCAST_EMAIL_BATCH_SIZE:
+                    self.checkpoint(emails, recipient)
+                    emails = []
+                    since_checkpoint = 0
+            self.checkpoint(emails, recipient)
+
+
+def claimable():
+    """
+    The broadcasts waiting for a sender: pending ones, and sending ones whose sender stopped
+    renewing its lease.
+    """
+    return Broadcast.objects.filter(
+        Q(status=Broadcast.Status.PENDING)
+        | Q(status=Broadcast.Status.SENDING, lease_expires_at__lte=timezone.now())
+    )
+
+
+def claim(broadcast_id):
+    """
+    Takes a broadcast for this sender, leased for BROADCAST_LEASE_SECONDS.
+
+    Returns:
+        The claimed Broadcast, or None if it isn't waiting for a sender.
+    """
+    claimed = claimable().filter(id=broadcast_id).update(
+        status=Broadcast.Status.SENDING, attempts=F('attempts') + 1,
+        lease_expires_at=timezone.now() + timedelta(seconds=settings.BROADCAST_LEASE_SECONDS),
+    )
+    if not claimed:
+        return None
+    return Broadcast.objects.get(id=broadcast_id)
+
+
+def run(broadcast_id):
+    """
+    Sends a broadcast that is pending, or resumes one whose sender died. Marks it done when every
+    recipient was tried, or failed if reading the recipients broke off.
+    """
+    broadcast = claim(broadcast_id)
+    if broadcast is None:
+        return
+    held = Broadcast.objects.filter(id=broadcast_id, status=Broadcast.Status.SENDING, attempts=broadcast.attempts)
+    try:
+        BroadcastSender(broadcast).run()
+        held.update(status=Broadcast.Status.DONE, lease_expires_at=None, date_time_completed=timezone.now())
+    except LeaseLost:
+        logger.warning('Broadcast %s was claimed again before it finished sending', broadcast_id)
+    except Exception as e:
+        held.update(
+            status=Broadcast.Status.FAILED, last_error=str(e), lease_expires_at=None, date_time_completed=timezone.now()
+        )
+
+
+def run_in_background(broadcast_id):
+    def target():
+        try:
+            run(broadcast_id)
+        finally:
+            connection.close()
+    threading.Thread(target=target, name=f'broadcast-{broadcast_id}', daemon=True).start()
+
+
+def resume():
+    """
+    Starts a sender for every broadcast waiting for one: pending broadcasts whose sender never
+    started, and sending ones whose sender died with the process.
+
+    Returns:
+        The ids of the broadcasts started.
+    """
+    broadcast_ids = list(claimable().order_by('id').values_list('id', flat=True))
+    for broadcast_id in broadcast_ids:
+        run_in_background(broadcast_id)
+    return broadcast_ids
+
+
+class BroadcastRecovery:
+    """
+    Looks for broadcasts to resume when the process starts, and every `interval` seconds after, on
+    a background thread. Leases taken by the last process run out a while after it stopped.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name='broadcast-recovery', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        try:
+            while True:
+                try:
+                    resume()
+                except Exception:
+                    logger.exception('Resuming broadcasts failed')
+                    connection.close()
+                if self._stop.wait(self.interval):
+                    return
+        finally:
+            connection.close()
+
+
+recovery = BroadcastRecovery(settings.BROADCAST_RECOVERY_SECONDS)
+
+
+def start_recovery():
+    recovery.start()
+    return recovery
+
+
+def start(manager, message, filters):
+    """
+    Saves a broadcast and starts sending it once the current transaction commits. If the process
+    stops first, the broadcast stays pending and the next recovery check sends it.
+    """
+    broadcast = Broadcast.objects.create(manager=manager, message=message, filters=filters)
+    transaction.on_commit(lambda: run_in_background(broadcast.id))
+    return broadcast
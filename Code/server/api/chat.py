@@ -0,0 +1,258 @@
+# Standard Library
+import atexit
+import html
+import logging
+import threading
+
+# Django
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+
+# Local
+from . import shards
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+TRANSACTION = 'transaction'
+WRITE_BEHIND = 'write_behind'
+
+# Control characters can't be typed into a chat, so they safely mark matches until the
+# snippet is escaped and they are swapped for <mark> tags
+MATCH_START = '\x02'
+MATCH_END = '\x03'
+SNIPPET_WORDS = 16
+SEARCH_SQL = f'''
+    SELECT message.id, message.text, message.from_ai,
+           snippet(api_message_fts, 0, '{MATCH_START}', '{MATCH_END}', '...', {SNIPPET_WORDS})
+    FROM api_message_fts JOIN api_message AS message ON message.id = api_message_fts.rowid
+    WHERE api_message_fts MATCH %s
+    ORDER BY bm25(api_message_fts, 1.0, 0.0)
+    LIMIT %s
+'''
+
+
+def turn_messages(user_id, message, reply):
+    return [
+        Message(owner_id=user_id, text=message, from_ai=False),
+        Message(owner_id=user_id, text=reply, from_ai=True),
+    ]
+
+
+def save_turn(user, message, reply):
+    """
+    Stores a user's message and the AI's reply with one insert in one transaction on the user's database.
+    """
+    return shards.save_messages(shards.database_for(user), turn_messages(user.id, message, reply))
+
+
+class WriteBehindBuffer:
+    """
+    Holds chat messages from every request in memory and writes them with one insert every
+    interval seconds, or sooner once max_batch messages are waiting. A burst of chats then takes
+    SQLite's write lock a few times instead of once per chat. Each database's messages are written
+    in their own transaction.
+
+    A batch that fails because the database is busy is kept for the next try. A batch that fails
+    for any other reason is written one message at a time, and the messages that still fail are
+    logged and dropped. Once max_size messages are waiting the buffer takes no more, so a database
+    that stays busy can't make it grow without bound.
+
+    Messages still in the buffer are lost if the process is killed, and a user may not see their
+    newest messages in the history until the next flush.
+    """
+
+    def __init__(self, interval, max_batch, max_size=None):
+        self.interval = interval
+        self.max_batch = max_batch
+        self.max_size = max_size
+        self._pending = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._registered = False
+
+    def __len__(self):
+        with self._lock:
+            return self._size
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def add(self, messages, using=DEFAULT_DB_ALIAS):
+        """
+        Queues messages for the next flush. Returns False, queueing nothing, if the buffer is full.
+        """
+        with self._lock:
+            if self.max_size is not None and self._size + len(messages) > self.max_size:
+                return False
+            self._pending.setdefault(using, []).extend(messages)
+            self._size += len(messages)
+            full = self._size >= self.max_batch
+        if full:
+            self._wake.set()
+        return True
+
+    def requeue(self, batches):
+        with self._lock:
+            for using, batch in batches:
+                # Back in front of anything added since, so each user's messages stay in order
+                self._pending.setdefault(using, [])[:0] = batch
+                self._size += len(batch)
+
+    def save_one_by_one(self, using, batch):
+        """
+        Writes a batch that failed one message at a time and drops the messages that can't be
+        written. Returns how many were written.
+        """
+        written = 0
+        for index, message in enumerate(batch):
+            try:
+                shards.save_messages(using, [message])
+            except OperationalError:
+                self.requeue([(using, batch[index:])])
+                raise
+            except Exception:
+                logger.exception('Dropped a chat message for user %s that could not be saved', message.owner_id)
+                continue
+            written += 1
+        return written
+
+    def flush(self):
+        """
+        Writes everything waiting in the buffer. Returns how many messages were written.
+        """
+        with self._lock:
+            batches, self._pending, self._size = list(self._pending.items()), {}, 0
+        written = 0
+        for index, (using, batch) in enumerate(batches):
+            try:
+                shards.save_messages(using, batch, batch_size=self.max_batch)
+            except OperationalError:
+                # Busy or unavailable, so everything not written yet waits for the next try
+                self.requeue(batches[index:])
+                raise
+            except Exception:
+                logger.exception('Writing %s buffered chat messages to %s failed', len(batch), using)
+                try:
+                    written += self.save_one_by_one(using, batch)
+                except OperationalError:
+                    self.requeue(batches[index + 1:])
+                    raise
+                continue
+            written += len(batch)
+        return written
+
+    def start(self):
+        with self._lock:
+            if self.running and not self._stop.is_set():
+                return
+            stopping = self._thread
+        if stopping is not None:
+            # Let a thread that was told to stop finish, so only one thread writes the buffer
+            stopping.join()
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name='chat-write-behind', daemon=True)
+            self._thread.start()
+            register = not self._registered
+            self._registered = True
+        if register:
+            atexit.register(self.stop)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        try:
+            while not self._stop.is_set():
+                self._wake.wait(self.interval)
+                self._wake.clear()
+                self.flush_logged()
+            self.flush_logged()
+        finally:
+            connections.close_all()
+
+    def flush_logged(self):
+        try:
+            self.flush()
+        except Exception:
+            # flush kept the messages for the next try
+            logger.exception('Writing buffered chat messages failed')
+            connections.close_all()
+
+
+buffer = WriteBehindBuffer(
+    settings.CHAT_WRITE_BEHIND_SECONDS, settings.CHAT_WRITE_BEHIND_MAX_BATCH, settings.CHAT_WRITE_BEHIND_MAX_SIZE,
+)
+
+
+def record_turn(user, message, reply):
+    """
+    Persists a user's message and the AI's reply. With CHAT_PERSISTENCE set to 'transaction'
+    they are written before this returns. With 'write_behind' they are written with the next
+    batch from the buffer, or straight away if the buffer is full.
+
+    Returns:
+        The two Message objects. Buffered ones have no ids.
+    """
+    if settings.CHAT_PERSISTENCE == WRITE_BEHIND:
+        messages = turn_messages(user.id, message, reply)
+        buffer.start()
+        if buffer.add(messages, shards.database_for(user)):
+            return messages
+    return save_turn(user, message, reply)
+
+
+def match_expression(owner_id, query):
+    """
+    Builds an FTS5 query for the messages of one user that contain every word of `query`.
+
+    Each word is quoted, so FTS5 operators and punctuation in the query are searched for as
+    plain text. A word ending in * matches every word that starts with it.
+
+    Returns:
+        The expression, or None if the query has no words.
+    """
+    terms = []
+    for word in query.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*').replace('"', '""')
+        if word:
+            terms.append(f'"{word}"*' if prefix else f'"{word}"')
+    if not terms:
+        return None
+    return f'owner_id:"{int(owner_id)}" AND text:({" ".join(terms)})'
+
+
+def highlight(snippet):
+    return html.escape(snippet).replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>')
+
+
+def search(owner, query, limit):
+    """
+    Searches one user's chat messages through the api_message_fts full-text index of the database
+    holding them, best match first.
+
+    Returns:
+        A list of {'id', 'text', 'from_ai', 'snippet'}. The snippet is HTML: the text around the
+        matches, escaped, with each match wrapped in <mark>.
+    """
+    expression = match_expression(owner.id, query)
+    if expression is None:
+        return []
+    with connections[shards.database_for(owner)].cursor() as cursor:
+        cursor.execute(SEARCH_SQL, [expression, limit])
+        rows = cursor.fetchall()
+    return [
+        {'id': message_id, 'text': text, 'from_ai': bool(from_ai), 'snippet': highlight(snippet)}
+        for message_id, text, from_ai, snippet in rows
+    ]
@@ -0,0 +1,109 @@
+# Standard Library
+from dataclasses import dataclass, fields
+import os
+import threading
+import time
+
+# Django
+from django.conf import settings
+
+
+@dataclass(frozen=True)
+class Secrets:
+    """
+    The API keys and account details the server uses to talk to other services.
+
+    SECRET_SOURCES says where each field lives in the secrets file and which environment
+    variable overrides it. A field is None if it is in neither place.
+    """
+    yelp_api_key: str = None
+    twilio_account_sid: str = None
+    twilio_auth_token: str = None
+    grid_api_key: str = None
+    twilio_reserve_phone_number: str = None
+    twilio_sender_phone_number: str = None
+    twilio_sender_email: str = None
+
+
+# (line, word) of each value in the secrets file, and the environment variable that overrides it
+SECRET_SOURCES = {
+    'yelp_api_key': (0, 2, 'YELP_API_KEY'),
+    'twilio_account_sid': (1, 2, 'TWILIO_ACCOUNT_SID'),
+    'twilio_auth_token': (1, 4, 'TWILIO_AUTH_TOKEN'),
+    'grid_api_key': (2, 2, 'GRID_API_KEY'),
+    'twilio_reserve_phone_number': (4, 1, 'TWILIO_RESERVE_PHONE_NUMBER'),
+    'twilio_sender_phone_number': (5, 1, 'TWILIO_SENDER_PHONE_NUMBER'),
+    'twilio_sender_email': (5, 1, 'TWILIO_SENDER_EMAIL'),
+}
+
+
+def parse_secrets(lines, environ):
+    """
+    Builds Secrets from the lines of the secrets file, letting environment variables win.
+    """
+    values = {}
+    for field in fields(Secrets):
+        line, word, variable = SECRET_SOURCES[field.name]
+        value = environ.get(variable)
+        if value is None:
+            try:
+                value = lines[line].split(" ")[word].strip()
+            except IndexError:
+                value = None
+        values[field.name] = value
+    return Secrets(**values)
+
+
+class SecretsRegistry:
+    """
+    Holds the parsed secrets in memory. The file is only read again when its modification
+    time changes, and that is checked at most once every SECRETS_RELOAD_CHECK_SECONDS.
+    """
+
+    def __init__(self, path, check_interval):
+        self.path = path
+        self.check_interval = check_interval
+        self._secrets = None
+        self._mtime = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        if self._secrets is not None and now - self._checked_at < self.check_interval:
+            return self._secrets
+        with self._lock:
+            if self._secrets is not None and now - self._checked_at < self.check_interval:
+                return self._secrets
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if self._secrets is None or mtime != self._mtime:
+                self._secrets = self.load()
+                self._mtime = mtime
+            self._checked_at = now
+            return self._secrets
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as file:
+                lines = file.readlines()
+        except FileNotFoundError:
+            lines = []
+        return parse_secrets(lines, os.environ)
+
+    def reset(self):
+        """
+        Forgets the parsed secrets, so the next access reads the file again.
+        """
+        with self._lock:
+            self._secrets = None
+            self._mtime = None
+
+
+secrets = SecretsRegistry(settings.SECRETS_FILE, settings.SECRETS_RELOAD_CHECK_SECONDS)
+
+
+def get_secrets():
+    return secrets.get()
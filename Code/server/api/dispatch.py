@@ -0,0 +1,179 @@
+# Standard Library
+from collections import Counter
+import threading
+
+# Django
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+# Local
+from .models import Cupid, GigOffer
+from .spatial import SpatialGrid, haversine_distance, parse_location
+
+
+class AvailableCupid:
+    """
+    What the index needs to know about a cupid to match them against a gig.
+    """
+    __slots__ = ('cupid_id', 'latitude', 'longitude', 'gig_range', 'rating')
+
+    def __init__(self, cupid_id, latitude, longitude, gig_range, rating):
+        self.cupid_id = cupid_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.gig_range = gig_range
+        self.rating = rating
+
+
+def is_available(cupid):
+    return cupid.accepting_gigs and cupid.status == Cupid.Status.AVAILABLE and not cupid.is_suspended
+
+
+def cupid_rating(cupid):
+    if cupid.rating_count == 0:
+        return 0
+    return cupid.rating_sum / cupid.rating_count
+
+
+class AvailabilityIndex:
+    """
+    In-memory index of the cupids that can currently be offered gigs, bucketed by location.
+
+    The index is loaded from the database the first time it is used and then kept up to date
+    from Cupid saves and deletes, so matching a gig never has to query the cupid table.
+    """
+
+    def __init__(self, cell_size_degrees):
+        self.grid = SpatialGrid(cell_size_degrees)
+        self._ranges = Counter()
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        self.ensure_loaded()
+        return len(self.grid)
+
+    @property
+    def max_range(self):
+        return max(self._ranges) if self._ranges else 0
+
+    def ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            available = Cupid.objects.filter(
+                accepting_gigs=True, status=Cupid.Status.AVAILABLE, is_suspended=False
+            ).only('user_id', 'accepting_gigs', 'status', 'is_suspended', 'location', 'gig_range',
+                   'rating_sum', 'rating_count')
+            for cupid in available.iterator():
+                self._add(cupid)
+            self._loaded = True
+
+    def update(self, cupid):
+        """
+        Adds, moves or removes a cupid depending on whether they can currently take gigs.
+        """
+        with self._lock:
+            if not self._loaded:
+                # The next load reads the current state from the database
+                return
+            self.remove(cupid.user_id)
+            if is_available(cupid):
+                self._add(cupid)
+
+    def remove(self, cupid_id):
+        with self._lock:
+            entry = self.grid.remove(cupid_id)
+            if entry is not None:
+                self._ranges[entry.gig_range] -= 1
+                if self._ranges[entry.gig_range] <= 0:
+                    del self._ranges[entry.gig_range]
+
+    def clear(self):
+        with self._lock:
+            self.grid = SpatialGrid(self.grid.cell_size)
+            self._ranges.clear()
+            self._loaded = False
+
+    def _add(self, cupid):
+        coordinates = parse_location(cupid.location)
+        if coordinates is None:
+            return
+        latitude, longitude = coordinates
+        entry = AvailableCupid(cupid.user_id, latitude, longitude, cupid.gig_range, cupid_rating(cupid))
+        self.grid.add(cupid.user_id, latitude, longitude, entry)
+        self._ranges[entry.gig_range] += 1
+
+    def match(self, latitude, longitude, range_multiplier=1.0, exclude=()):
+        """
+        Returns the cupids whose gig range covers the point, best first, as (AvailableCupid, distance) pairs.
+
+        Candidates are ranked by distance minus DISPATCH_RATING_WEIGHT miles per rating star, so a
+        well rated cupid can beat a slightly closer one.
+
+        Args:
+            range_multiplier (float): Stretches every cupid's gig range, to reach cupids further away.
+            exclude: Ids of cupids to leave out.
+        """
+        self.ensure_loaded()
+        weight = settings.DISPATCH_RATING_WEIGHT
+        matches = []
+        for entry in self.grid.near(latitude, longitude, self.max_range * range_multiplier):
+            if entry.cupid_id in exclude:
+                continue
+            distance = haversine_distance(latitude, longitude, entry.latitude, entry.longitude)
+            if distance <= entry.gig_range * range_multiplier:
+                matches.append((distance - weight * entry.rating, entry.cupid_id, entry, distance))
+        matches.sort(key=lambda match: (match[0], match[1]))
+        return [(entry, distance) for _, _, entry, distance in matches]
+
+
+availability_index = AvailabilityIndex(settings.DISPATCH_CELL_SIZE_DEGREES)
+
+
+def gig_coordinates(gig):
+    quest = gig.quest
+    if quest.pickup_latitude is None or quest.pickup_longitude is None:
+        return None
+    return quest.pickup_latitude, quest.pickup_longitude
+
+
+def offers_for(gig, range_multiplier=1.0, exclude=(), first_rank=0):
+    """
+    Returns unsaved GigOffers for the best available cupids for a gig, ranked from first_rank.
+    """
+    coordinates = gig_coordinates(gig)
+    if coordinates is None:
+        return []
+    matches = availability_index.match(*coordinates, range_multiplier, exclude)[:settings.DISPATCH_MAX_OFFERS]
+    return [
+        GigOffer(gig=gig, cupid_id=entry.cupid_id, rank=rank, distance=distance)
+        for rank, (entry, distance) in enumerate(matches, start=first_rank)
+    ]
+
+
+def dispatch_gig(gig):
+    """
+    Matches a newly saved gig against the available cupids and stores the ordered offer list.
+
+    Returns:
+        The created GigOffer objects, best first. Empty if the pickup location is unknown
+        or nobody is in range.
+    """
+    return GigOffer.objects.bulk_create(offers_for(gig))
+
+
+@receiver(post_save, sender=Cupid)
+def update_availability(sender, instance, **kwargs):
+    # Applied once the save commits, so a transaction that is rolled back or retried leaves the index alone
+    transaction.on_commit(lambda: availability_index.update(instance))
+
+
+@receiver(post_delete, sender=Cupid)
+def remove_availability(sender, instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: availability_index.remove(user_id))
@@ -0,0 +1,166 @@
+# Standard Library
+from collections import Counter
+from datetime import timedelta
+import logging
+import threading
+
+# Django
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+# Local
+from .models import GigActivity, GigEvent, GigEventOffset
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_CONSUMER = 'gig_activity'
+
+
+def record(gig, event_type, **data):
+    """
+    Appends a gig state change to the event log. Call it inside the transaction that makes
+    the change, so the change and its event are committed together or not at all.
+    """
+    transaction.on_commit(start_projector)
+    return GigEvent.objects.create(**event_fields(gig, event_type, data))
+
+
+def record_many(gigs, event_type):
+    """
+    Appends the same kind of change for several gigs in one insert.
+    """
+    transaction.on_commit(start_projector)
+    return GigEvent.objects.bulk_create([GigEvent(**event_fields(gig, event_type, {})) for gig in gigs])
+
+
+def event_fields(gig, event_type, data):
+    return {
+        'gig_id': gig.id, 'dater_id': gig.dater_id, 'cupid_id': gig.cupid_id, 'type': event_type,
+        'status': gig.status, 'data': data,
+    }
+
+
+def read(after=0, limit=None):
+    """
+    Returns up to `limit` events with an offset greater than `after`, oldest first.
+
+    SQLite has a single writer, so events are committed in offset order and a reader never
+    sees a later event before an earlier one.
+    """
+    limit = limit or settings.GIG_EVENT_BATCH_SIZE
+    return list(GigEvent.objects.filter(id__gt=after).order_by('id')[:limit])
+
+
+def consume(consumer, handler, limit=None):
+    """
+    Hands the consumer's next batch of events to handler(events) and moves its offset past them.
+
+    The handler runs in the same transaction as the offset update, so database work it does
+    is applied exactly once even if the process dies part way.
+
+    Returns:
+        How many events were handled.
+    """
+    with transaction.atomic():
+        offset, _ = GigEventOffset.objects.select_for_update().get_or_create(consumer=consumer)
+        events = read(offset.offset, limit)
+        if events:
+            handler(events)
+            offset.offset = events[-1].id
+            offset.save(update_fields=['offset'])
+    return len(events)
+
+
+def catch_up(consumer, handler, limit=None):
+    """
+    Consumes until the consumer has handled every event. Returns how many events were handled.
+    """
+    limit = limit or settings.GIG_EVENT_BATCH_SIZE
+    handled = 0
+    while True:
+        count = consume(consumer, handler, limit)
+        handled += count
+        if count < limit:
+            # A short batch means the consumer has reached the end of the log
+            return handled
+
+
+def reset(consumer, offset=0):
+    """
+    Moves a consumer back to an offset so it replays the events after it.
+    """
+    GigEventOffset.objects.update_or_create(consumer=consumer, defaults={'offset': offset})
+
+
+def count_activity(events):
+    counts = Counter(
+        (event.date_time.replace(minute=0, second=0, microsecond=0), event.type) for event in events
+    )
+    for (hour, event_type), count in counts.items():
+        updated = GigActivity.objects.filter(hour=hour, type=event_type).update(count=F('count') + count)
+        if not updated:
+            GigActivity.objects.create(hour=hour, type=event_type, count=count)
+
+
+def recent_activity(hours=24):
+    """
+    Returns how many gigs were created, claimed, dropped, completed and cancelled in the last
+    `hours` hours. Only reads the hourly counts, which the projector keeps up to date.
+    """
+    since = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=hours - 1)
+    totals = dict(
+        GigActivity.objects.filter(hour__gte=since).values_list('type').annotate(total=Sum('count'))
+    )
+    return {event_type: totals.get(event_type, 0) for event_type in GigEvent.Type.values}
+
+
+class ActivityProjector:
+    """
+    Counts new gig events into the hourly GigActivity rows every `interval` seconds on a
+    background thread, so reading the counts never has to write.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run, name='gig-activity', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                try:
+                    catch_up(ACTIVITY_CONSUMER, count_activity)
+                except Exception:
+                    logger.exception('Counting gig activity failed')
+                    connection.close()
+        finally:
+            connection.close()
+
+
+projector = ActivityProjector(settings.GIG_ACTIVITY_CATCH_UP_SECONDS)
+
+
+def start_projector():
+    if settings.GIG_ACTIVITY_IN_PROCESS:
+        projector.start()
+    return projector
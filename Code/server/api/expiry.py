@@ -0,0 +1,275 @@
+# Standard Library
+from collections import defaultdict
+from datetime import timedelta
+import heapq
+import logging
+import threading
+import time
+
+# Django
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+# Local
+from . import dispatch
+from . import events
+from . import gigfeed
+from .models import Gig, GigEvent, GigOffer
+from .retry import retry_on_locked
+
+logger = logging.getLogger(__name__)
+
+EXPIRE = 'expire'
+REOFFER = 'reoffer'
+WIDEN = 'widen'
+POLICIES = (EXPIRE, REOFFER, WIDEN)
+
+
+def deadline(now=None):
+    return (now or timezone.now()) + timedelta(seconds=settings.GIG_EXPIRY_SECONDS)
+
+
+def expire(gigs):
+    """
+    Marks gigs expired in one update and lets the cupids watching the feed know.
+    """
+    Gig.objects.filter(id__in=[gig.id for gig in gigs]).update(status=Gig.Status.EXPIRED, expires_at=None)
+    for gig in gigs:
+        gig.status = Gig.Status.EXPIRED
+        gig.expires_at = None
+        gigfeed.publish_gig(gigfeed.EXPIRED, gig)
+    events.record_many(gigs, GigEvent.Type.EXPIRED)
+
+
+def redispatch(gigs, now):
+    """
+    Offers gigs to the next best cupids they have not been offered to yet and gives them a new deadline.
+    Under the widen policy every round multiplies the cupids' ranges by GIG_EXPIRY_RANGE_MULTIPLIER again.
+    """
+    offered = defaultdict(set)
+    for gig_id, cupid_id in GigOffer.objects.filter(gig__in=gigs).values_list('gig_id', 'cupid_id'):
+        offered[gig_id].add(cupid_id)
+    new_deadline = deadline(now)
+    offers = []
+    for gig in gigs:
+        gig.redispatch_count += 1
+        gig.expires_at = new_deadline
+        multiplier = 1.0
+        if settings.GIG_EXPIRY_POLICY == WIDEN:
+            multiplier = settings.GIG_EXPIRY_RANGE_MULTIPLIER ** gig.redispatch_count
+        offers.extend(dispatch.offers_for(gig, multiplier, offered[gig.id], first_rank=len(offered[gig.id])))
+    GigOffer.objects.bulk_create(offers)
+    Gig.objects.filter(id__in=[gig.id for gig in gigs]).update(
+        redispatch_count=F('redispatch_count') + 1, expires_at=new_deadline,
+    )
+    events.record_many(gigs, GigEvent.Type.REOFFERED)
+
+
+@retry_on_locked
+def process(gig_ids, now=None):
+    """
+    Applies GIG_EXPIRY_POLICY to the gigs that are still unclaimed past their deadline.
+    Gigs that have been claimed or given a later deadline since are left alone.
+
+    Returns:
+        (expired gigs, re-offered gigs)
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        due = list(
+            Gig.objects.select_for_update()
+            .filter(id__in=gig_ids, status=Gig.Status.UNCLAIMED, expires_at__lte=now)
+            .select_related('quest')
+        )
+        if settings.GIG_EXPIRY_POLICY == EXPIRE:
+            expiring, reoffering = due, []
+        else:
+            expiring = [gig for gig in due if gig.redispatch_count >= settings.GIG_EXPIRY_MAX_REDISPATCHES]
+            reoffering = [gig for gig in due if gig.redispatch_count < settings.GIG_EXPIRY_MAX_REDISPATCHES]
+        if expiring:
+            expire(expiring)
+        if reoffering:
+            redispatch(reoffering, now)
+    return expiring, reoffering
+
+
+class ExpiryScheduler:
+    """
+    A timer heap of the deadlines of unclaimed gigs. A background thread sleeps until the earliest
+    deadline and then processes every gig that is due, GIG_EXPIRY_BATCH_SIZE at a time, so stuck
+    gigs are found without sweeping the gig table.
+
+    Claimed and cancelled gigs are forgotten, so the heap only holds gigs that are still waiting.
+    A scheduler running outside the web process doesn't hear about new gigs, so it reloads the
+    deadlines from the database every reload_seconds instead.
+    """
+
+    def __init__(self, batch_size, reload_seconds=None):
+        self.batch_size = batch_size
+        self.reload_seconds = reload_seconds
+        self._heap = []
+        self._deadlines = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stop = False
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def add(self, gig_id, expires_at):
+        timestamp = expires_at.timestamp()
+        with self._condition:
+            if self._deadlines.get(gig_id) == timestamp:
+                return
+            self._deadlines[gig_id] = timestamp
+            heapq.heappush(self._heap, (timestamp, gig_id))
+            if self._heap[0] == (timestamp, gig_id):
+                # Sooner than anything the thread is waiting for
+                self._condition.notify()
+
+    def discard(self, gig_id):
+        # The heap entry is skipped when it comes up
+        with self._condition:
+            self._deadlines.pop(gig_id, None)
+
+    def load(self):
+        """
+        Adds every unclaimed gig with a deadline from the database.
+        """
+        waiting = Gig.objects.filter(status=Gig.Status.UNCLAIMED, expires_at__isnull=False)
+        for gig_id, expires_at in waiting.values_list('id', 'expires_at').iterator():
+            self.add(gig_id, expires_at)
+
+    def next_deadline(self):
+        with self._condition:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def _drop_stale(self):
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def pop_due(self, now):
+        """
+        Removes and returns the ids of up to batch_size gigs whose deadline is at or before now.
+        """
+        timestamp = now.timestamp()
+        due = []
+        with self._condition:
+            self._drop_stale()
+            while self._heap and self._heap[0][0] <= timestamp and len(due) < self.batch_size:
+                _, gig_id = heapq.heappop(self._heap)
+                del self._deadlines[gig_id]
+                due.append(gig_id)
+                self._drop_stale()
+        return due
+
+    def run_once(self, now=None):
+        """
+        Processes one batch of due gigs and puts the re-offered ones back with their new deadlines.
+        Returns how many gigs were due.
+        """
+        now = now or timezone.now()
+        due = self.pop_due(now)
+        if due:
+            _, reoffered = process(due, now)
+            for gig in reoffered:
+                self.add(gig.id, gig.expires_at)
+        return len(due)
+
+    def start(self):
+        with self._condition:
+            if self.running and not self._stop:
+                return
+            stopping = self._thread
+        if stopping is not None:
+            # Let a thread that was told to stop finish, so only one thread processes the heap
+            stopping.join()
+        with self._condition:
+            if self.running:
+                return
+            self._stop = False
+            self._thread = threading.Thread(target=self.run, name='gig-expiry', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        with self._condition:
+            self._stop = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def error_backoff(self, failures):
+        """
+        Returns how long to wait after `failures` errors in a row before trying again.
+        """
+        delay = settings.GIG_EXPIRY_RETRY_SECONDS * 2 ** (failures - 1)
+        return min(delay, settings.GIG_EXPIRY_RELOAD_SECONDS)
+
+    def run(self):
+        try:
+            loaded_at = None
+            failures = 0
+            while not self._stop:
+                try:
+                    if loaded_at is None or (
+                        self.reload_seconds is not None and time.monotonic() - loaded_at >= self.reload_seconds
+                    ):
+                        self.load()
+                        loaded_at = time.monotonic()
+                    if self.run_once() == self.batch_size:
+                        # There may be more due straight away
+                        failures = 0
+                        continue
+                    failures = 0
+                    with self._condition:
+                        if self._stop:
+                            break
+                        next_deadline = self.next_deadline()
+                        timeout = None if next_deadline is None else max(next_deadline - timezone.now().timestamp(), 0)
+                        if self.reload_seconds is not None:
+                            timeout = self.reload_seconds if timeout is None else min(timeout, self.reload_seconds)
+                        self._condition.wait(timeout)
+                except Exception:
+                    failures += 1
+                    logger.exception('Processing expired gigs failed')
+                    connection.close()
+                    # The batch that failed has left the heap, so the deadlines are read again
+                    loaded_at = None
+                    with self._condition:
+                        if not self._stop:
+                            self._condition.wait(self.error_backoff(failures))
+        finally:
+            connection.close()
+
+
+scheduler = ExpiryScheduler(settings.GIG_EXPIRY_BATCH_SIZE)
+
+
+def schedule(gig, now=None):
+    """
+    Gives an unclaimed gig a new deadline. The scheduler picks it up once the current transaction commits.
+    """
+    gig.expires_at = deadline(now)
+    Gig.objects.filter(id=gig.id).update(expires_at=gig.expires_at)
+    gig_id, expires_at = gig.id, gig.expires_at
+    transaction.on_commit(lambda: start_scheduler().add(gig_id, expires_at))
+
+
+def forget(gig_id):
+    """
+    Stops tracking a gig that has been claimed or cancelled, once the current transaction commits.
+    """
+    transaction.on_commit(lambda: scheduler.discard(gig_id))
+
+
+def start_scheduler():
+    if settings.GIG_EXPIRY_IN_PROCESS:
+        scheduler.start()
+    return scheduler
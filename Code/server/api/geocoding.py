@@ -0,0 +1,147 @@
+# Standard Library
+from collections import OrderedDict
+import logging
+import threading
+
+# Django
+from django.conf import settings
+
+# Miscellaneous Utils
+from geopy.exc import GeopyError
+from geopy.geocoders import Nominatim
+
+# Local
+from .models import GeocodedAddress
+
+logger = logging.getLogger(__name__)
+
+NOT_FOUND = (None, None)
+
+
+class LRUCache:
+    """
+    A small thread-safe least-recently-used cache.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+memory_cache = LRUCache(settings.GEOCODE_MEMORY_CACHE_SIZE)
+_geolocator = None
+
+
+def get_geolocator():
+    """
+    Returns the process-wide Nominatim geocoder.
+    """
+    global _geolocator
+    if _geolocator is None:
+        _geolocator = Nominatim(user_agent="geoapiExercises")
+    return _geolocator
+
+
+def normalize_address(address):
+    """
+    Returns the cache key for an address: lower case, single spaced, no space before commas.
+    """
+    return " ".join(str(address).split()).replace(" ,", ",").strip(" ,.").lower()
+
+
+def lookup_address(address):
+    """
+    Asks the remote geocoder for an address. Returns (latitude, longitude), or (None, None) if
+    the address could not be found or the geocoder could not be reached.
+    """
+    try:
+        location = get_geolocator().geocode(address)
+    except GeopyError:
+        logger.warning('Could not geocode %r', address, exc_info=True)
+        return NOT_FOUND
+    if location:
+        return location.latitude, location.longitude
+    return NOT_FOUND
+
+
+def geocode(address):
+    """
+    Returns the (latitude, longitude) of an address, or (None, None) if it could not be found.
+
+    Looks in the in-process cache, then the GeocodedAddress table, and only then asks the
+    remote geocoder. Only addresses that were found are cached, so one that wasn't, or that
+    failed while the geocoder was down, is looked up again next time.
+    """
+    key = normalize_address(address)
+    coordinates = memory_cache.get(key)
+    if coordinates is not None:
+        return coordinates
+    cached = GeocodedAddress.objects.filter(address=key).first()
+    if cached is not None:
+        coordinates = cached.coordinates
+    else:
+        coordinates = lookup_address(address)
+        if coordinates == NOT_FOUND:
+            return coordinates
+        GeocodedAddress.objects.get_or_create(
+            address=key, defaults={'latitude': coordinates[0], 'longitude': coordinates[1]}
+        )
+    memory_cache.put(key, coordinates)
+    return coordinates
+
+
+def geocode_many(addresses):
+    """
+    Geocodes a batch of addresses. Addresses that normalize to the same key are only looked up
+    once, the database is checked with a single query, and only the remaining addresses go to
+    the remote geocoder. As in geocode, only addresses that were found are cached.
+
+    Returns:
+        A dict mapping each given address to (latitude, longitude), or (None, None) if it could not be found.
+    """
+    keys = {address: normalize_address(address) for address in addresses}
+    found = {}
+    missing = {}
+    for address, key in keys.items():
+        coordinates = memory_cache.get(key)
+        if coordinates is not None:
+            found[key] = coordinates
+        else:
+            missing.setdefault(key, address)
+    if missing:
+        for cached in GeocodedAddress.objects.filter(address__in=list(missing)):
+            found[cached.address] = cached.coordinates
+            memory_cache.put(cached.address, cached.coordinates)
+            del missing[cached.address]
+    new_rows = []
+    for key, address in missing.items():
+        coordinates = lookup_address(address)
+        found[key] = coordinates
+        if coordinates == NOT_FOUND:
+            continue
+        memory_cache.put(key, coordinates)
+        new_rows.append(GeocodedAddress(address=key, latitude=coordinates[0], longitude=coordinates[1]))
+    GeocodedAddress.objects.bulk_create(new_rows, ignore_conflicts=True)
+    return {address: found[key] for address, key in keys.items()}
@@ -0,0 +1,207 @@
+# Standard Library
+import asyncio
+from collections import Counter
+import itertools
+import json
+import queue
+import threading
+import time
+
+# Django
+from django.conf import settings
+from django.db import transaction
+
+# Local
+from .serializers import GigSerializer
+from .spatial import SpatialGrid, haversine_distance
+
+CREATED = 'gig.created'
+CLAIMED = 'gig.claimed'
+DROPPED = 'gig.dropped'
+CANCELLED = 'gig.cancelled'
+EXPIRED = 'gig.expired'
+
+
+class Subscription:
+    """
+    One open feed connection: where the cupid is, how far they will travel, and the queue
+    the connection's thread reads its events from.
+    """
+
+    def __init__(self, subscription_id, latitude, longitude, gig_range):
+        self.id = subscription_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.gig_range = gig_range
+        self.queue = queue.Queue(maxsize=settings.GIG_FEED_QUEUE_SIZE)
+        self.overflowed = False
+
+    def deliver(self, event):
+        # Runs on the publishing thread
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # A reader this far behind is closed and has to reconnect
+            self.overflowed = True
+
+
+class AsyncSubscription(Subscription):
+    """
+    A feed connection read by a coroutine under ASGI. An asyncio queue can only be used from
+    its event loop's thread, so events are handed to the loop to enqueue.
+    """
+
+    def __init__(self, subscription_id, latitude, longitude, gig_range, loop):
+        super().__init__(subscription_id, latitude, longitude, gig_range)
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=settings.GIG_FEED_QUEUE_SIZE)
+
+    def deliver(self, event):
+        # Runs on the publishing thread
+        try:
+            self.loop.call_soon_threadsafe(self._deliver, event)
+        except RuntimeError:
+            # The loop has shut down, and the connection with it
+            pass
+
+    def _deliver(self, event):
+        # Runs on the event loop
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class SubscriptionIndex:
+    """
+    The open feed connections bucketed by location, so an event is only handed to the
+    subscribers whose range covers the gig instead of being checked against every connection.
+    """
+
+    def __init__(self, cell_size_degrees):
+        self.grid = SpatialGrid(cell_size_degrees)
+        self._ranges = Counter()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.grid)
+
+    def subscribe(self, latitude, longitude, gig_range, loop=None):
+        """
+        Opens a subscription. Pass the event loop that will read it to get an AsyncSubscription.
+        """
+        with self._lock:
+            if loop is None:
+                subscription = Subscription(next(self._ids), latitude, longitude, gig_range)
+            else:
+                subscription = AsyncSubscription(next(self._ids), latitude, longitude, gig_range, loop)
+            self.grid.add(subscription.id, latitude, longitude, subscription)
+            self._ranges[gig_range] += 1
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if self.grid.remove(subscription.id) is not None:
+                self._ranges[subscription.gig_range] -= 1
+                if self._ranges[subscription.gig_range] <= 0:
+                    del self._ranges[subscription.gig_range]
+
+    def subscribers_near(self, latitude, longitude):
+        with self._lock:
+            max_range = max(self._ranges) if self._ranges else 0
+        return [
+            subscription for subscription in self.grid.near(latitude, longitude, max_range)
+            if haversine_distance(latitude, longitude, subscription.latitude, subscription.longitude)
+            <= subscription.gig_range
+        ]
+
+    def publish(self, event, latitude, longitude):
+        """
+        Hands an event to every subscriber in range. Safe to call from any thread.
+        Returns how many subscribers it went to.
+        """
+        subscribers = self.subscribers_near(latitude, longitude)
+        for subscription in subscribers:
+            subscription.deliver(event)
+        return len(subscribers)
+
+
+subscriptions = SubscriptionIndex(settings.GIG_FEED_CELL_SIZE_DEGREES)
+
+
+def format_event(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event['gig'], default=str)}\n\n"
+
+
+def publish_gig(event_type, gig):
+    """
+    Pushes a gig event to the cupids in range once the current transaction commits, so a
+    change that is rolled back never reaches them. The gig is serialized straight away, as it
+    is now: a cancelled gig has been deleted, and has no id, by the time the transaction commits.
+    Gigs without pickup coordinates can't be placed, so they are not pushed.
+    """
+    quest = gig.quest
+    if quest.pickup_latitude is None or quest.pickup_longitude is None:
+        return
+    event = {'type': event_type, 'gig': GigSerializer(gig).data}
+    transaction.on_commit(lambda: subscriptions.publish(event, quest.pickup_latitude, quest.pickup_longitude))
+
+
+def event_stream(latitude, longitude, gig_range):
+    """
+    Subscribes to the gigs within gig_range miles of a point and yields them as server-sent
+    events until the client disconnects, falls too far behind, or has been connected for
+    GIG_FEED_MAX_SECONDS. Sends a comment every GIG_FEED_HEARTBEAT_SECONDS so proxies keep
+    the connection open, and so a closed connection is noticed.
+
+    This is the WSGI version. The server writes each event out as it is yielded, and holds one
+    of its threads for as long as the stream is open. Closing after GIG_FEED_MAX_SECONDS gives
+    the thread back; EventSource reconnects on its own. Under ASGI use async_event_stream, which
+    Django can send from as events arrive instead of collecting a sync generator to the end.
+    """
+    closes_at = time.monotonic() + settings.GIG_FEED_MAX_SECONDS
+    # Subscribing on the first read means a response that is never sent leaves nothing behind
+    subscription = subscriptions.subscribe(latitude, longitude, gig_range)
+    try:
+        yield f'retry: {settings.GIG_FEED_RETRY_MILLISECONDS}\n: connected\n\n'
+        while not subscription.overflowed:
+            remaining = closes_at - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                event = subscription.queue.get(timeout=min(settings.GIG_FEED_HEARTBEAT_SECONDS, remaining))
+            except queue.Empty:
+                yield ': ping\n\n'
+                continue
+            yield format_event(event)
+    finally:
+        subscriptions.unsubscribe(subscription)
+
+
+async def async_event_stream(latitude, longitude, gig_range):
+    """
+    The same stream as event_stream for an ASGI server. It waits on the event loop instead of
+    holding a thread, and is closed by a cancellation when the client disconnects.
+    """
+    closes_at = time.monotonic() + settings.GIG_FEED_MAX_SECONDS
+    subscription = subscriptions.subscribe(latitude, longitude, gig_range, asyncio.get_running_loop())
+    try:
+        yield f'retry: {settings.GIG_FEED_RETRY_MILLISECONDS}\n: connected\n\n'
+        while not subscription.overflowed:
+            remaining = closes_at - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(),
+                                               timeout=min(settings.GIG_FEED_HEARTBEAT_SECONDS, remaining))
+            except asyncio.TimeoutError:
+                yield ': ping\n\n'
+                continue
+            yield format_event(event)
+    finally:
+        subscriptions.unsubscribe(subscription)
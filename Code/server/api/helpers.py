@@ -1,12 +1,16 @@
 # Standard Library
-from math import radians, sin, cos, sqrt, atan2
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 import base64
+import logging
+import time
 import wave
 import os
 
 # Django
+from django.conf import settings
 from django.contrib.auth import login
 from django.contrib.sessions.models import Session
+from django.db import transaction
 from django.utils import timezone
 from django.core.exceptions import PermissionDenied
 from django.shortcuts import get_object_or_404, get_list_or_404
@@ -16,21 +20,30 @@ from rest_framework.response import Response
 from rest_framework import status
 
 # Miscellaneous Utils
-from geopy.geocoders import Nominatim
 import geoip2.database
-from yelpapi import YelpAPI
+import geoip2.errors
+import maxminddb
 from transformers import GPT2Tokenizer, GPT2LMHeadModel
 from operator import contains
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
-from twilio.rest import Client
 import speech_recognition as sr
 
 # Local
-from .models import User, Dater, Cupid, Date
+from .models import User, Dater, Cupid, Date, Gig, GigEvent, Quest
+from .spatial import haversine_distance, parse_location, bounding_box
+from . import config
+from . import dispatch
+from . import events
+from . import expiry
+from . import geocoding
+from . import gigfeed
+from . import messaging
+from . import places
+from .retry import retry_on_locked
 from .serializers import UserSerializer, DaterSerializer, CupidSerializer, QuestSerializer, GigSerializer, \
     DateSerializer
 
+logger = logging.getLogger(__name__)
+
 
 def initialize_serializer(user):
     if user.role == User.Role.DATER:
@@ -124,7 +137,7 @@ def save_calendar(request):
     try:
         data = request.data
         # TODO: Either us or the frontend needs to determine a planned location, then save the geo coords
-        data['location'] = get_location_string(request.META['REMOTE_ADDR'])
+        data['location'] = get_request_location(request)
         data['dater'] = request.user.id
         serializer = DateSerializer(data=data)
         return save_serializer(serializer)
@@ -135,7 +148,7 @@ def save_calendar(request):
 def get_calendar(pk, request):
     try:
         dater = authenticated_dater(pk, request.user)
-        dates = get_list_or_404(Date, dater=dater)
+        dates = get_list_or_404(Date.objects.filter(dater=dater).order_by('date_time'))
         serializer = DateSerializer(dates, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
     except Dater.DoesNotExist:
@@ -143,9 +156,86 @@ def get_calendar(pk, request):
 
 
 def update_user_location(user, addr):
-    user.location = get_location_string(addr)
-    if user.location is not None:
-        user.save()
+    save_profile_location(user, get_location_string(addr))
+
+
+def save_profile_location(user, location):
+    """
+    Stores a location on the user's dater or cupid profile. Only the location column is written,
+    and nothing is written if the location is unknown or has not changed.
+
+    Returns:
+        True if the profile was updated.
+    """
+    if location is None:
+        return False
+    if user.role == User.Role.DATER:
+        model = Dater
+    elif user.role == User.Role.CUPID:
+        model = Cupid
+    else:
+        return False
+    updated = model.objects.filter(user_id=user.id).exclude(location=location).update(location=location)
+    if updated and model is Cupid:
+        # update() skips the save signals, so tell the dispatch index about the move directly
+        dispatch.availability_index.update(Cupid.objects.get(user_id=user.id))
+    return bool(updated)
+
+
+LOCATION_SESSION_KEY = '_location'
+LOCATION_CHECKED_AT_SESSION_KEY = '_location_checked_at'
+LOCATION_SAVED_FOR_SESSION_KEY = '_location_saved_for'
+
+
+def refresh_session_location(request):
+    """
+    Geolocates the request at most once every LOCATION_REFRESH_SECONDS per session, and keeps the
+    signed in user's profile location up to date.
+
+    Returns:
+        The session's location string, or None if it is not known.
+    """
+    session = request.session
+    if session.session_key is None:
+        # Don't start a session just to remember where a cookieless or BasicAuth client is
+        return locate_request(request)
+    location = session.get(LOCATION_SESSION_KEY)
+    checked_at = session.get(LOCATION_CHECKED_AT_SESSION_KEY)
+    now = time.time()
+    if checked_at is None or now - checked_at >= settings.LOCATION_REFRESH_SECONDS:
+        session[LOCATION_CHECKED_AT_SESSION_KEY] = now
+        new_location = get_location_string(request.META.get('REMOTE_ADDR'))
+        if new_location is not None and new_location != location:
+            location = new_location
+            session[LOCATION_SESSION_KEY] = location
+            session.pop(LOCATION_SAVED_FOR_SESSION_KEY, None)
+    user = request.user
+    if location is not None and user.is_authenticated and session.get(LOCATION_SAVED_FOR_SESSION_KEY) != user.id:
+        save_profile_location(user, location)
+        session[LOCATION_SAVED_FOR_SESSION_KEY] = user.id
+    return location
+
+
+def locate_request(request):
+    """
+    Geolocates a request without a session, and stores the location on the signed in user's profile.
+
+    Returns:
+        The request's location string, or None if it is not known.
+    """
+    location = get_location_string(request.META.get('REMOTE_ADDR'))
+    if request.user.is_authenticated:
+        save_profile_location(request.user, location)
+    return location
+
+
+def get_request_location(request):
+    """
+    Returns the location string for a request, reusing the session's recent geolocation.
+    """
+    if hasattr(request, 'location'):
+        return request.location
+    return refresh_session_location(request)
 
 
 def get_location_string(ip_address):
@@ -162,18 +252,20 @@ def get_location_string(ip_address):
 def get_location_from_address(address):
     """
     Returns the location of an address.
+    Lookups are cached, so each distinct address only reaches the geocoder once.
     """
-    # Initialize Nominatim geocoder
-    geolocator = Nominatim(user_agent="geoapiExercises")
-    # Getting location details
-    location = geolocator.geocode(address)
-    if location:
-        # Extracting latitude and longitude
-        latitude = location.latitude
-        longitude = location.longitude
-        return latitude, longitude
-    else:
-        return None, None
+    return geocoding.geocode(address)
+
+
+def get_pickup_coordinates(pickup_location):
+    """
+    Returns the (latitude, longitude) of a quest's pickup location, which is either a
+    "latitude longitude" string or an address. Returns (None, None) if it can't be found.
+    """
+    coordinates = parse_location(pickup_location)
+    if coordinates is not None:
+        return coordinates
+    return geocoding.geocode(pickup_location)
 
 
 def get_location_from_ip_address(ip_address):
@@ -185,14 +277,18 @@ def get_location_from_ip_address(ip_address):
     if ip_address == "127.0.0.1" or ip_address == "localhost":
         return "430909.36611535 4621007.2874155"
     geoip_database_path = "api/geodata/GeoLite2-City_20240227/GeoLite2-City.mmdb"
-    with geoip2.database.Reader(geoip_database_path) as reader:
-        try:
+    try:
+        with geoip2.database.Reader(geoip_database_path) as reader:
             response = reader.city(ip_address)
             latitude = response.location.latitude
             longitude = response.location.longitude
             return latitude, longitude
-        except geoip2.errors.AddressNotFoundError:
-            return None, None
+    except geoip2.errors.AddressNotFoundError:
+        return None, None
+    except (OSError, ValueError, maxminddb.InvalidDatabaseError):
+        # No usable GeoIP database, or not an IP address the reader understands
+        logger.warning('Could not look up the location of %s', ip_address, exc_info=True)
+        return None, None
 
 
 def locations_are_near(location1, location2, max_distance_miles):
@@ -209,21 +305,26 @@ def locations_are_near(location1, location2, max_distance_miles):
     )
 
 
-def haversine_distance(lat1, lon1, lat2, lon2):
-    # Radius of the Earth in miles
-    r = 3958.8  # miles
-
-    # Convert latitude and longitude from degrees to radians
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-
-    # Haversine formula
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    distance = r * c
-
-    return distance
+def gigs_near(gigs, location, max_distance_miles):
+    """
+    Returns the gigs whose stored pickup coordinates are within max_distance_miles of a
+    "latitude longitude" location. The database narrows the gigs down to a bounding box first.
+    """
+    coordinates = parse_location(location)
+    if coordinates is None:
+        return []
+    latitude, longitude = coordinates
+    min_latitude, max_latitude, min_longitude, max_longitude = bounding_box(latitude, longitude, max_distance_miles)
+    candidates = gigs.filter(
+        quest__pickup_latitude__range=(min_latitude, max_latitude),
+        quest__pickup_longitude__range=(min_longitude, max_longitude),
+    )
+    return [
+        gig for gig in candidates
+        if within_distance(
+            gig.quest.pickup_latitude, gig.quest.pickup_longitude, latitude, longitude, max_distance_miles
+        )
+    ]
 
 
 def within_distance(lat1, lon1, lat2, lon2, max_distance_miles):
@@ -233,76 +334,60 @@ def within_distance(lat1, lon1, lat2, lon2, max_distance_miles):
 
 def call_yelp_api(pk, search):
     dater = get_object_or_404(Dater, user_id=pk)
-    latitude, longitude = dater.location.split(" ")
-    api_key = get_yelp_api_key()
-    with YelpAPI(api_key, timeout_s=5.0) as yelp_api:
-        try:
-            return yelp_api.search_query(term=search, latitude=latitude, longitude=longitude, limit=10)
-        except YelpAPI.YelpAPIError as e:
-            return None
+    coordinates = parse_location(dater.location)
+    if coordinates is None:
+        return None
+    latitude, longitude = coordinates
+    return places.search(latitude, longitude, search, limit=10)
 
 
 def get_yelp_api_key():
     """
     Returns the Yelp API key.
     """
-    with open('yelp_api_key.txt', 'r') as file:
-        lines = file.readlines()
-        return lines[0].split(" ")[2].strip()
+    return config.get_secrets().yelp_api_key
 
 
 def get_twilio_account_sid():
     """
     Returns the Twilio account SID.
     """
-    with open('yelp_api_key.txt', 'r') as file:
-        lines = file.readlines()
-        return lines[1].split(" ")[2].strip()
+    return config.get_secrets().twilio_account_sid
 
 
 def get_twilio_auth_token():
     """
     Returns the Twilio authentication token.
     """
-    with open('yelp_api_key.txt', 'r') as file:
-        lines = file.readlines()
-        return lines[1].split(" ")[4].strip()
+    return config.get_secrets().twilio_auth_token
 
 
 def get_twilio_authenticated_sender_email():
     """
     Returns the Twilio authenticated sender email.
     """
-    with open('yelp_api_key.txt', 'r') as file:
-        lines = file.readlines()
-        return lines[5].split(" ")[1].strip()
+    return config.get_secrets().twilio_sender_email
 
 
 def get_grid_api_key():
     """
     Returns the Grid API key.
     """
-    with open('yelp_api_key.txt', 'r') as file:
-        lines = file.readlines()
-        return lines[2].split(" ")[2].strip()
+    return config.get_secrets().grid_api_key
 
 
 def get_twilio_authenticated_reserve_phone_number():
     """
     Returns the Twilio authenticated reserve phone number.
     """
-    with open('yelp_api_key.txt', 'r') as file:
-        lines = file.readlines()
-        return lines[4].split(" ")[1].strip()
+    return config.get_secrets().twilio_reserve_phone_number
 
 
 def get_twilio_authenticated_sender_phone_number():
     """
     Returns the Twilio authenticated sender phone number.
     """
-    with open('yelp_api_key.txt', 'r') as file:
-        lines = file.readlines()
-        return lines[5].split(" ")[1].strip()
+    return config.get_secrets().twilio_sender_phone_number
 
 
 def process_ai_response(dater, response):
@@ -315,6 +400,26 @@ def process_ai_response(dater, response):
         )
 
 
+@retry_on_locked
+@transaction.atomic
+def save_new_gig(dater, quest_fields):
+    """
+    Saves a new gig and its quest, offers it to the best cupids, and tells the feed and the
+    expiry scheduler about it once the transaction commits.
+
+    Returns:
+        (gig, the GigOffers it was offered with, best first)
+    """
+    quest = Quest.objects.create(**quest_fields)
+    gig = Gig.objects.create(dater=dater, quest=quest, status=Gig.Status.UNCLAIMED, dropped_count=0,
+                             accepted_count=0)
+    events.record(gig, GigEvent.Type.CREATED)
+    expiry.schedule(gig)
+    offers = dispatch.dispatch_gig(gig)
+    gigfeed.publish_gig(gigfeed.CREATED, gig)
+    return gig, offers
+
+
 def create_new_gig(dater, response):
     requested_items = 'NA'
     for line in response.split('\n'):
@@ -328,64 +433,61 @@ def create_new_gig(dater, response):
             },
             status=status.HTTP_200_OK,
         )
-    locations = call_yelp_api(dater.location, requested_items)
+    locations = call_yelp_api(dater.user_id, requested_items)
+    if not locations or not locations.get('businesses'):
+        return Response(
+            {'error': 'gig creation failed. no pickup location found', 'gig_created': False},
+            status=status.HTTP_200_OK,
+        )
+    business = locations['businesses'][0]
     quest_data = {
         'budget': dater.budget,
         'items_requested': requested_items,
-        'pickup_location': locations[0]['address'],
+        'pickup_location': ', '.join(business['location']['display_address']),
+        # The search already knows where the business is, so there is nothing to geocode
+        'pickup_latitude': business['coordinates']['latitude'],
+        'pickup_longitude': business['coordinates']['longitude'],
     }
-    serializer = QuestSerializer(data=quest_data)
-    if serializer.is_valid():
-        serializer.save()
-    else:
-        return Response(
-            {'error': 'gig creation failed. could not serialize quest.'},
-            status=status.HTTP_400_BAD_REQUEST,
-        )
-    gig_data = {'dater': dater, 'quest': serializer.data}
-    serializer = GigSerializer(data=gig_data)
-    if serializer.is_valid():
-        serializer.save()
-        return Response(
-            {'message': 'gig was created', 'gig_created': True},
-            status=status.HTTP_200_OK,
-        )
-    else:
-        return Response(
-            {'error': 'gig creation failed. could not serialize.'},
-            status=status.HTTP_400_BAD_REQUEST,
-        )
+    with transaction.atomic():
+        serializer = QuestSerializer(data=quest_data)
+        if serializer.is_valid():
+            serializer.save()
+        else:
+            return Response(
+                {'error': 'gig creation failed. could not serialize quest.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        gig_data = {'dater': dater, 'quest': serializer.data}
+        serializer = GigSerializer(data=gig_data)
+        if serializer.is_valid():
+            serializer.save()
+            events.record(serializer.instance, GigEvent.Type.CREATED)
+            expiry.schedule(serializer.instance)
+            dispatch.dispatch_gig(serializer.instance)
+            gigfeed.publish_gig(gigfeed.CREATED, serializer.instance)
+            return Response(
+                {'message': 'gig was created', 'gig_created': True},
+                status=status.HTTP_200_OK,
+            )
+        else:
+            return Response(
+                {'error': 'gig creation failed. could not serialize.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
 
 def send_text(account_sid, auth_token, message):
-    # We are hard-coding the number since only verified numbers can be used
-    to_phone_number = get_twilio_authenticated_reserve_phone_number()
-    from_phone_number = get_twilio_authenticated_sender_phone_number()
-    client = Client(account_sid, auth_token)
-    message = client.messages.create(
-        from_=from_phone_number,
-        body=message,
-        to=to_phone_number
-    )
-    return Response(message.sid, status=status.HTTP_200_OK)
+    # The pooled Twilio client reads the account SID and auth token from the secrets registry
+    sid = messaging.send_text_message(message)
+    return Response(sid, status=status.HTTP_200_OK)
 
 
 def send_email(dater, message):
-    dater_email = dater.email
-    from_email = get_twilio_authenticated_sender_email()
-    mail = Mail(
-        from_email=from_email,
-        to_emails=dater_email,
-        subject='Notification from Cupid Code',
-        html_content=message,
-    )
     try:
-        grid_api_key = get_grid_api_key()
-        sg = SendGridAPIClient(grid_api_key)
-        response = sg.send(mail)
+        message_id = messaging.send_email_message(dater.user.email, message)
     except Exception as e:
-        return Response({'error': e}, status=status.HTTP_400_BAD_REQUEST)
-    return Response(response, status=status.HTTP_200_OK)
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(message_id, status=status.HTTP_200_OK)
 
 
 def get_message_from_audio(audio_data, dater):
@@ -440,6 +542,70 @@ def get_response_from_yelp_api(pk, request, search):
     return Response(status=status.HTTP_400_BAD_REQUEST)
 
 
+EXPLORE_CATEGORIES = ('stores', 'activities', 'events', 'attractions', 'restaurants')
+explore_executor = ThreadPoolExecutor(max_workers=settings.GEO_EXPLORE_MAX_WORKERS, thread_name_prefix='explore')
+
+
+def explore_categories(latitude, longitude, categories):
+    """
+    Runs the places search for every category at the same time, so the wait is the slowest
+    category rather than the sum of all of them.
+
+    Each category gets its own deadline from GEO_EXPLORE_TIMEOUT_SECONDS, measured from when
+    the searches started. A category that misses its deadline is cancelled if it is still
+    waiting for a thread, so stale searches don't hold up other requests on the shared pool.
+    One that already started finishes in the background and, with Yelp, its results land in
+    the cache for the next request.
+
+    Returns:
+        (results, errors): results maps category to the search response, errors maps category
+        to why it has no results.
+    """
+    timeouts = settings.GEO_EXPLORE_TIMEOUT_SECONDS
+    started = time.monotonic()
+    futures = {
+        category: explore_executor.submit(places.search, latitude, longitude, category, 10)
+        for category in categories
+    }
+    results = {}
+    errors = {}
+    for category in sorted(futures, key=lambda name: timeouts[name]):
+        remaining = started + timeouts[category] - time.monotonic()
+        try:
+            response = futures[category].result(timeout=max(remaining, 0))
+        except TimeoutError:
+            futures[category].cancel()
+            errors[category] = 'timed out'
+            continue
+        except Exception as e:
+            errors[category] = str(e)
+            continue
+        if response is None:
+            errors[category] = 'unavailable'
+        else:
+            results[category] = response
+    return results, errors
+
+
+def get_explore_response(pk, request):
+    if pk != request.user.id:
+        return Response(status=status.HTTP_403_FORBIDDEN)
+    requested = request.GET.get('categories')
+    categories = [c.strip() for c in requested.split(',') if c.strip()] if requested else EXPLORE_CATEGORIES
+    categories = list(dict.fromkeys(categories))
+    unknown = [category for category in categories if category not in EXPLORE_CATEGORIES]
+    if unknown or not categories:
+        return Response({'error': f'unknown categories: {unknown}'}, status=status.HTTP_400_BAD_REQUEST)
+    dater = get_object_or_404(Dater, user_id=pk)
+    coordinates = parse_location(dater.location)
+    if coordinates is None:
+        return Response({'error': 'dater location unknown'}, status=status.HTTP_400_BAD_REQUEST)
+    results, errors = explore_categories(*coordinates, categories)
+    if not results:
+        return Response({'results': results, 'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'results': results, 'errors': errors}, status=status.HTTP_200_OK)
+
+
 def get_sessions(role):
     active_sessions = Session.objects.filter(expire_date__gte=timezone.now())
     if active_sessions is None:
@@ -0,0 +1,23 @@
+# Django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Local
+from api import archive, shards
+
+
+class Command(BaseCommand):
+    help = (f'Moves chat messages older than CHAT_ARCHIVE_AFTER_DAYS ({settings.CHAT_ARCHIVE_AFTER_DAYS}) '
+            f'into per-user archive files under CHAT_ARCHIVE_DIR.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--compact', action='store_true',
+                            help='Vacuum the databases afterwards to give the space back. Blocks writes while it runs.')
+
+    def handle(self, *args, **options):
+        users, messages = archive.archive_old_messages()
+        self.stdout.write(f'Archived {messages} messages from {users} users to {settings.CHAT_ARCHIVE_DIR}.')
+        if options['compact']:
+            for using in shards.databases():
+                archive.compact(using)
+                self.stdout.write(f'Compacted {using}.')
@@ -0,0 +1,41 @@
+# Django
+from django.core.management.base import BaseCommand
+
+# Local
+from api import geocoding
+from api.models import Quest
+from api.spatial import parse_location
+
+
+class Command(BaseCommand):
+    help = 'Fills in pickup_latitude/pickup_longitude for quests created before they were stored.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        quests = Quest.objects.filter(pickup_latitude__isnull=True).only('id', 'pickup_location').order_by('id')
+        updated = 0
+        missing = 0
+        last_id = 0
+        while True:
+            batch = list(quests.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            addresses = [quest.pickup_location for quest in batch if parse_location(quest.pickup_location) is None]
+            geocoded = geocoding.geocode_many(addresses)
+            changed = []
+            for quest in batch:
+                coordinates = parse_location(quest.pickup_location) or geocoded[quest.pickup_location]
+                if coordinates[0] is None:
+                    missing += 1
+                    continue
+                quest.pickup_latitude, quest.pickup_longitude = coordinates
+                changed.append(quest)
+            Quest.objects.bulk_update(changed, ['pickup_latitude', 'pickup_longitude'])
+            updated += len(changed)
+        # Misses aren't cached, so running the command again retries them, for instance after the geocoder was down
+        self.stdout.write(f'Updated {updated} quests, {missing} pickup locations could not be found. '
+                          'Run the command again to retry them.')
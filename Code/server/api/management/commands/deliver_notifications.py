@@ -0,0 +1,28 @@
+# Standard Library
+import time
+
+# Django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Local
+from api import notifications
+
+
+class Command(BaseCommand):
+    help = 'Runs notification delivery workers in the foreground until interrupted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.NOTIFY_WORKERS)
+
+    def handle(self, *args, **options):
+        workers = notifications.DeliveryWorkers(
+            options['workers'], settings.NOTIFY_POLL_SECONDS, settings.NOTIFY_CHANNEL_CONCURRENCY,
+        )
+        workers.start()
+        self.stdout.write(f'Delivering notifications with {options["workers"]} workers. Press Ctrl+C to stop.')
+        try:
+            while workers.running:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            workers.stop(timeout=settings.NOTIFY_SENDING_TIMEOUT_SECONDS)
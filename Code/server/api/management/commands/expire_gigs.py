@@ -0,0 +1,23 @@
+# Standard Library
+import time
+
+# Django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Local
+from api import expiry
+
+
+class Command(BaseCommand):
+    help = 'Runs the gig expiry scheduler in the foreground until interrupted.'
+
+    def handle(self, *args, **options):
+        scheduler = expiry.ExpiryScheduler(settings.GIG_EXPIRY_BATCH_SIZE, settings.GIG_EXPIRY_RELOAD_SECONDS)
+        scheduler.start()
+        self.stdout.write(f'Applying the {settings.GIG_EXPIRY_POLICY!r} expiry policy. Press Ctrl+C to stop.')
+        try:
+            while scheduler.running:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            scheduler.stop()
@@ -0,0 +1,38 @@
+# Django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Local
+from api import shards
+from api.models import User
+
+
+class Command(BaseCommand):
+    help = ('Moves users\' chat messages out of the main database and between the CHAT_SHARDS shards '
+            'until each shard holds about the same number of messages.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='List the moves without making them.')
+        parser.add_argument('--user', type=int, help='Move only this user, to --shard.')
+        parser.add_argument('--shard', type=int, help='The shard to move --user to.')
+
+    def handle(self, *args, **options):
+        if not settings.CHAT_SHARDS:
+            raise CommandError('CHAT_SHARDS is 0, so there are no shards to move messages to.')
+        if options['user'] is not None:
+            if options['shard'] is None or not 0 <= options['shard'] < settings.CHAT_SHARDS:
+                raise CommandError(f'--user needs a --shard from 0 to {settings.CHAT_SHARDS - 1}.')
+            try:
+                user = User.objects.get(id=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f'There is no user {options["user"]}.')
+            moved = 0 if options['dry_run'] else shards.move_user(user, options['shard'])
+            self.stdout.write(f'Moved {moved} messages of user {user.id} to {shards.alias(options["shard"])}.')
+            return
+        moves = shards.rebalance(dry_run=options['dry_run'])
+        for user_id, source, target in moves:
+            self.stdout.write(f'User {user_id}: {source} -> {target}')
+        if options['dry_run']:
+            return
+        assigned = shards.assign_shards()
+        self.stdout.write(f'Moved {len(moves)} users and gave {assigned} users without messages a shard.')
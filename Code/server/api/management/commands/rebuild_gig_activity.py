@@ -0,0 +1,38 @@
+# Standard Library
+import time
+
+# Django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+# Local
+from api import events
+from api.models import GigActivity
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the hourly gig activity counts by replaying the gig event log from the start.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--follow', action='store_true',
+            help='Keep counting new gig events in the foreground until interrupted.',
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            GigActivity.objects.all().delete()
+            events.reset(events.ACTIVITY_CONSUMER)
+            replayed = events.catch_up(events.ACTIVITY_CONSUMER, events.count_activity)
+        self.stdout.write(f'Replayed {replayed} gig events.')
+        if not options['follow']:
+            return
+        projector = events.ActivityProjector(settings.GIG_ACTIVITY_CATCH_UP_SECONDS)
+        projector.start()
+        self.stdout.write('Counting new gig events. Press Ctrl+C to stop.')
+        try:
+            while projector.running:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            projector.stop()
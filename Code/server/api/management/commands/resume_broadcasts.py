@@ -0,0 +1,16 @@
+# Django
+from django.core.management.base import BaseCommand
+
+# Local
+from api import broadcasts
+
+
+class Command(BaseCommand):
+    help = ('Sends the broadcasts left pending, and resumes those whose sender stopped partway, '
+            'in the foreground.')
+
+    def handle(self, *args, **options):
+        broadcast_ids = list(broadcasts.claimable().order_by('id').values_list('id', flat=True))
+        for broadcast_id in broadcast_ids:
+            broadcasts.run(broadcast_id)
+        self.stdout.write(f'Sent {len(broadcast_ids)} broadcasts.')
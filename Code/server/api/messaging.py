@@ -0,0 +1,135 @@
+# Standard Library
+import threading
+
+# Django
+from django.conf import settings
+
+# Miscellaneous Utils
+from requests import Session
+from requests.adapters import HTTPAdapter
+from sendgrid.helpers.mail import Mail
+from twilio.http.http_client import TwilioHttpClient
+from twilio.rest import Client
+
+# Local
+from . import config
+
+
+def pooled_session(pool_size):
+    """
+    Returns a requests Session that keeps up to pool_size connections per host open for reuse.
+    """
+    session = Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class ProviderClients:
+    """
+    Twilio and SendGrid clients shared by everything in the process that sends messages.
+
+    Building a client for every message meant a new connection and TLS handshake for every
+    message. These clients keep their connections alive between messages instead. The Twilio
+    client is rebuilt if the Twilio credentials change.
+    """
+
+    def __init__(self, timeout, pool_size):
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._twilio = None
+        self._twilio_credentials = None
+        self._sendgrid = None
+        self._lock = threading.Lock()
+
+    def twilio(self):
+        secrets = config.get_secrets()
+        credentials = (secrets.twilio_account_sid, secrets.twilio_auth_token)
+        with self._lock:
+            if self._twilio is None or credentials != self._twilio_credentials:
+                http_client = TwilioHttpClient(pool_connections=True, timeout=self.timeout)
+                http_client.session = pooled_session(self.pool_size)
+                client = Client(*credentials, http_client=http_client)
+                client.api.base_url = settings.TWILIO_API_BASE_URL
+                self._twilio = client
+                self._twilio_credentials = credentials
+            return self._twilio
+
+    def sendgrid(self):
+        with self._lock:
+            if self._sendgrid is None:
+                self._sendgrid = pooled_session(self.pool_size)
+            return self._sendgrid
+
+    def close(self):
+        with self._lock:
+            if self._twilio is not None:
+                self._twilio.http_client.session.close()
+            if self._sendgrid is not None:
+                self._sendgrid.close()
+            self._twilio = None
+            self._sendgrid = None
+
+
+clients = ProviderClients(settings.MESSAGING_TIMEOUT_SECONDS, settings.MESSAGING_POOL_SIZE)
+
+
+def phone_number_for(user_phone_number):
+    """
+    Returns a stored 10 digit US phone number in the E.164 form Twilio expects.
+    """
+    return f'+1{user_phone_number}'
+
+
+def send_text_message(message, to_phone_number=None):
+    """
+    Sends a text through Twilio. Texts go to the reserve phone number unless a number is
+    given and TWILIO_VERIFIED_NUMBERS_ONLY is off.
+
+    Returns:
+        The Twilio message SID. Raises if Twilio did not accept the message.
+    """
+    secrets = config.get_secrets()
+    if to_phone_number is None or settings.TWILIO_VERIFIED_NUMBERS_ONLY:
+        # We are hard-coding the number since only verified numbers can be used
+        to_phone_number = secrets.twilio_reserve_phone_number
+    sent = clients.twilio().messages.create(
+        from_=secrets.twilio_sender_phone_number,
+        body=message,
+        to=to_phone_number,
+    )
+    return sent.sid
+
+
+def send_mail(mail):
+    """
+    Posts a SendGrid Mail to the v3 mail send API over the pooled session.
+
+    Returns:
+        SendGrid's message id. Raises if SendGrid did not accept the mail.
+    """
+    response = clients.sendgrid().post(
+        f'{settings.SENDGRID_API_HOST}/v3/mail/send',
+        json=mail.get(),
+        headers={'Authorization': f'Bearer {config.get_secrets().grid_api_key}'},
+        timeout=clients.timeout,
+    )
+    response.raise_for_status()
+    return response.headers.get('X-Message-Id', '')
+
+
+def send_email_message(to_email, message):
+    """
+    Sends an email through SendGrid.
+
+    Returns:
+        SendGrid's message id. Raises if SendGrid did not accept the message.
+    """
+    mail = Mail(
+        from_email=config.get_secrets().twilio_sender_email,
+        to_emails=to_email,
+        subject='Notification from Cupid Code',
+        html_content=message,
+    )
+    return send_mail(mail)
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_alter_dater_profile_picture'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GigOffer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.IntegerField()),
+                ('distance', models.FloatField()),
+                ('date_time_of_offer', models.DateTimeField(auto_now_add=True)),
+                ('cupid', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.cupid')),
+                ('gig', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='offers', to='api.gig')),
+            ],
+        ),
+    ]
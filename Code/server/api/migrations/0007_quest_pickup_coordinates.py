@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:39
+
+from django.db import migrations, models
+
+
+def fill_coordinate_pickups(apps, schema_editor):
+    # Pickup locations that are already "latitude longitude" need no geocoding, the rest
+    # are left to the backfill_pickup_coordinates command
+    Quest = apps.get_model('api', 'Quest')
+    quests = []
+    for quest in Quest.objects.filter(pickup_latitude__isnull=True):
+        parts = quest.pickup_location.split(' ')
+        if len(parts) != 2:
+            continue
+        try:
+            quest.pickup_latitude, quest.pickup_longitude = float(parts[0].strip(',')), float(parts[1])
+        except ValueError:
+            continue
+        quests.append(quest)
+    Quest.objects.bulk_update(quests, ['pickup_latitude', 'pickup_longitude'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_geocodedaddress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quest',
+            name='pickup_latitude',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='quest',
+            name='pickup_longitude',
+            field=models.FloatField(null=True),
+        ),
+        migrations.RunPython(fill_coordinate_pickups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_notification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Broadcast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message', models.TextField()),
+                ('filters', models.JSONField(default=dict)),
+                ('status', models.TextField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('done', 'Done'), ('failed', 'Failed')], default='pending')),
+                ('recipient_count', models.IntegerField(default=0)),
+                ('emails_sent', models.IntegerField(default=0)),
+                ('texts_sent', models.IntegerField(default=0)),
+                ('failed_count', models.IntegerField(default=0)),
+                ('last_error', models.TextField(default='')),
+                ('date_time_created', models.DateTimeField(auto_now_add=True)),
+                ('date_time_completed', models.DateTimeField(null=True)),
+                ('manager', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
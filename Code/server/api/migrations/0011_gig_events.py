@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_notification_merged_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GigEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gig_id', models.BigIntegerField()),
+                ('dater_id', models.BigIntegerField(null=True)),
+                ('cupid_id', models.BigIntegerField(null=True)),
+                ('type', models.TextField(choices=[('created', 'Created'), ('claimed', 'Claimed'), ('dropped', 'Dropped'), ('completed', 'Completed'), ('cancelled', 'Cancelled')])),
+                ('status', models.IntegerField(choices=[(0, 'Unclaimed'), (1, 'Claimed'), (2, 'Complete')])),
+                ('data', models.JSONField(default=dict)),
+                ('date_time', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GigEventOffset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('consumer', models.TextField(unique=True)),
+                ('offset', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GigActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('type', models.TextField(choices=[('created', 'Created'), ('claimed', 'Claimed'), ('dropped', 'Dropped'), ('completed', 'Completed'), ('cancelled', 'Cancelled')])),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('hour', 'type')},
+            },
+        ),
+    ]
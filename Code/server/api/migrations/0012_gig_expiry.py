@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:06
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def give_waiting_gigs_a_deadline(apps, schema_editor):
+    # Gigs already waiting get the default 30 minutes from now rather than expiring the moment the scheduler starts
+    Gig = apps.get_model('api', 'Gig')
+    Gig.objects.filter(status=0).update(expires_at=timezone.now() + timedelta(minutes=30))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_gig_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gig',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='gig',
+            name='redispatch_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='gig',
+            name='status',
+            field=models.IntegerField(choices=[(0, 'Unclaimed'), (1, 'Claimed'), (2, 'Complete'), (3, 'Expired')]),
+        ),
+        migrations.AlterField(
+            model_name='gigactivity',
+            name='type',
+            field=models.TextField(choices=[('created', 'Created'), ('claimed', 'Claimed'), ('dropped', 'Dropped'), ('completed', 'Completed'), ('cancelled', 'Cancelled'), ('reoffered', 'Reoffered'), ('expired', 'Expired')]),
+        ),
+        migrations.AlterField(
+            model_name='gigevent',
+            name='status',
+            field=models.IntegerField(choices=[(0, 'Unclaimed'), (1, 'Claimed'), (2, 'Complete'), (3, 'Expired')]),
+        ),
+        migrations.AlterField(
+            model_name='gigevent',
+            name='type',
+            field=models.TextField(choices=[('created', 'Created'), ('claimed', 'Claimed'), ('dropped', 'Dropped'), ('completed', 'Completed'), ('cancelled', 'Cancelled'), ('reoffered', 'Reoffered'), ('expired', 'Expired')]),
+        ),
+        migrations.RunPython(give_waiting_gigs_a_deadline, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_gig_expiry'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='date',
+            name='dater',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='api.dater'),
+        ),
+        migrations.AlterField(
+            model_name='feedback',
+            name='target',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='target', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='gig',
+            name='cupid',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='api.cupid'),
+        ),
+        migrations.AlterField(
+            model_name='gig',
+            name='dater',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='api.dater'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='owner',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='date',
+            index=models.Index(fields=['dater', 'date_time'], name='date_dater_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feedback',
+            index=models.Index(fields=['target', 'date_time'], name='feedback_target_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gig',
+            index=models.Index(fields=['status', 'date_time_of_request'], name='gig_status_requested_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gig',
+            index=models.Index(fields=['cupid', 'status'], name='gig_cupid_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gig',
+            index=models.Index(fields=['dater', '-date_time_of_request', '-id'], name='gig_dater_newest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='gig',
+            index=models.Index(fields=['date_time_of_request'], name='gig_requested_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['owner', '-id'], name='message_owner_newest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='quest',
+            index=models.Index(fields=['pickup_latitude', 'pickup_longitude'], name='quest_pickup_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['email'], name='user_email_idx'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+from django.db import migrations
+
+# An external content FTS5 index over Message.text. The owner's id is indexed as a column too, so a
+# search scoped to one user is answered by the full-text index alone. The triggers keep it in step
+# with every insert, update and delete on api_message.
+CREATE_INDEX = [
+    """
+    CREATE VIRTUAL TABLE api_message_fts USING fts5(
+        text, owner_id, content='api_message', content_rowid='id', tokenize='porter unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER api_message_fts_insert AFTER INSERT ON api_message BEGIN
+        INSERT INTO api_message_fts(rowid, text, owner_id) VALUES (new.id, new.text, new.owner_id);
+    END
+    """,
+    """
+    CREATE TRIGGER api_message_fts_delete AFTER DELETE ON api_message BEGIN
+        INSERT INTO api_message_fts(api_message_fts, rowid, text, owner_id)
+        VALUES ('delete', old.id, old.text, old.owner_id);
+    END
+    """,
+    """
+    CREATE TRIGGER api_message_fts_update AFTER UPDATE OF text, owner_id ON api_message BEGIN
+        INSERT INTO api_message_fts(api_message_fts, rowid, text, owner_id)
+        VALUES ('delete', old.id, old.text, old.owner_id);
+        INSERT INTO api_message_fts(rowid, text, owner_id) VALUES (new.id, new.text, new.owner_id);
+    END
+    """,
+    # Index the messages that already exist
+    "INSERT INTO api_message_fts(api_message_fts) VALUES ('rebuild')",
+]
+
+DROP_INDEX = [
+    'DROP TRIGGER api_message_fts_update',
+    'DROP TRIGGER api_message_fts_delete',
+    'DROP TRIGGER api_message_fts_insert',
+    'DROP TABLE api_message_fts',
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_query_indexes'),
+    ]
+
+    operations = [
+        # The hint lets the shard router create the index in every database holding messages
+        migrations.RunSQL(CREATE_INDEX, DROP_INDEX, hints={'model_name': 'message'}),
+    ]
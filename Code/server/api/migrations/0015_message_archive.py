@@ -0,0 +1,57 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:22
+
+from importlib import import_module
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+# SQLite adds the column by copying api_message into a new table, which drops the full-text
+# index triggers from 0014 along with the old table. Removing it again doesn't always copy the table.
+message_search = import_module('api.migrations.0014_message_search')
+FTS_TRIGGERS = [sql.replace('CREATE TRIGGER', 'CREATE TRIGGER IF NOT EXISTS') for sql in message_search.CREATE_INDEX[1:4]]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_message_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_message_id', models.BigIntegerField()),
+                ('last_message_id', models.BigIntegerField()),
+                ('message_count', models.IntegerField()),
+                ('path', models.TextField()),
+                ('date_time_archived', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        # Put the triggers back after a copy, in either direction
+        migrations.RunSQL(migrations.RunSQL.noop, FTS_TRIGGERS, hints={'model_name': 'message'}),
+        # Existing messages count as created now, so they are archived CHAT_ARCHIVE_AFTER_DAYS from the upgrade
+        migrations.AddField(
+            model_name='message',
+            name='date_time_created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunSQL(FTS_TRIGGERS, migrations.RunSQL.noop, hints={'model_name': 'message'}),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['date_time_created'], name='message_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='messagearchive',
+            name='owner',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='messagearchive',
+            index=models.Index(fields=['owner', '-last_message_id'], name='message_archive_owner_idx'),
+        ),
+    ]
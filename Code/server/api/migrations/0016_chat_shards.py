@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 07:30
+
+from importlib import import_module
+
+import api.models
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Dropping the foreign key constraint copies api_message too
+FTS_TRIGGERS = import_module('api.migrations.0015_message_archive').FTS_TRIGGERS
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_message_archive'),
+    ]
+
+    operations = [
+        # Existing users' messages are in the main database, so only new users get a shard
+        migrations.AddField(
+            model_name='user',
+            name='chat_shard',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='chat_shard',
+            field=models.IntegerField(default=api.models.pick_chat_shard, null=True),
+        ),
+        migrations.RunSQL(migrations.RunSQL.noop, FTS_TRIGGERS, hints={'model_name': 'message'}),
+        migrations.AlterField(
+            model_name='message',
+            name='owner',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunSQL(FTS_TRIGGERS, migrations.RunSQL.noop, hints={'model_name': 'message'}),
+    ]
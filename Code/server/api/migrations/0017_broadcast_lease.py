@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_chat_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='broadcast',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='broadcast',
+            name='lease_expires_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='broadcast',
+            name='sent_through_role',
+            field=models.TextField(default=''),
+        ),
+        migrations.AddField(
+            model_name='broadcast',
+            name='sent_through_user_id',
+            field=models.IntegerField(default=0),
+        ),
+    ]
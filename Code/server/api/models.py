@@ -1,7 +1,16 @@
+import random
+
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractUser
 
 
+def pick_chat_shard():
+    # Even on average. The rebalance_chat_shards command evens out the rest.
+    return random.randrange(settings.CHAT_SHARDS) if settings.CHAT_SHARDS else None
+
+
 class User(AbstractUser):
     class Role(models.TextChoices):
         DATER = 'dater'
@@ -10,6 +19,13 @@ class User(AbstractUser):
 
     role = models.CharField(choices=Role.choices, max_length=7)
     phone_number = models.CharField(max_length=10, unique=True)
+    # Which chat_<n> database holds the user's chat messages (see api/shards.py).
+    # None keeps them in the main database.
+    chat_shard = models.IntegerField(null=True, default=pick_chat_shard)
+
+    class Meta(AbstractUser.Meta):
+        # Signing in looks users up by email
+        indexes = [models.Index(fields=['email'], name='user_email_idx')]
 
 
 class Dater(models.Model):
@@ -72,15 +88,51 @@ class Cupid(models.Model):
 
 
 class Message(models.Model):
-    owner = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Indexed by the composite index below. Not a database constraint, since messages on a shard
+    # are in a different database from their owner. api/shards.py deletes them with the user.
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False, db_constraint=False)
     text = models.TextField()
     from_ai = models.BooleanField()
+    date_time_created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # A user's messages newest first
+            models.Index(fields=['owner', '-id'], name='message_owner_newest_idx'),
+            # The messages old enough to archive
+            models.Index(fields=['date_time_created'], name='message_created_idx'),
+        ]
+
+
+class MessageArchive(models.Model):
+    """
+    The stub left behind for a run of a user's archived chat messages. The messages themselves are
+    in a gzipped JSON lines file under CHAT_ARCHIVE_DIR (see api/archive.py).
+    """
+    # Indexed by the composite index below
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
+    first_message_id = models.BigIntegerField()
+    last_message_id = models.BigIntegerField()
+    message_count = models.IntegerField()
+    # Relative to CHAT_ARCHIVE_DIR
+    path = models.TextField()
+    date_time_archived = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['owner', '-last_message_id'], name='message_archive_owner_idx')]
 
 
 class Quest(models.Model):
     budget = models.DecimalField(max_digits=10, decimal_places=2)
     items_requested = models.TextField()
     pickup_location = models.TextField()
+    # Geocoded from pickup_location when the quest is created
+    pickup_latitude = models.FloatField(null=True)
+    pickup_longitude = models.FloatField(null=True)
+
+    class Meta:
+        # The bounding box search for gigs near a cupid
+        indexes = [models.Index(fields=['pickup_latitude', 'pickup_longitude'], name='quest_pickup_idx')]
 
 
 class Gig(models.Model):
@@ -88,9 +140,11 @@ class Gig(models.Model):
         UNCLAIMED = 0
         CLAIMED = 1
         COMPLETE = 2
+        EXPIRED = 3
 
-    dater = models.ForeignKey(Dater, on_delete=models.CASCADE)
-    cupid = models.ForeignKey(Cupid, on_delete=models.CASCADE, null=True)
+    # Both indexed by the composite indexes below
+    dater = models.ForeignKey(Dater, on_delete=models.CASCADE, db_index=False)
+    cupid = models.ForeignKey(Cupid, on_delete=models.CASCADE, null=True, db_index=False)
     status = models.IntegerField(choices=Status.choices)
     date_time_of_request = models.DateTimeField(auto_now_add=True)
     date_time_of_claim = models.DateTimeField(null=True)
@@ -98,6 +152,30 @@ class Gig(models.Model):
     quest = models.OneToOneField(Quest, on_delete=models.CASCADE)
     dropped_count = models.IntegerField()
     accepted_count = models.IntegerField()
+    # When the expiry policy next acts on the gig if nobody has claimed it. Null once claimed.
+    expires_at = models.DateTimeField(null=True, db_index=True)
+    # How many times the gig has been offered to more cupids after going unclaimed
+    redispatch_count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Open gigs for cupids, oldest first
+            models.Index(fields=['status', 'date_time_of_request'], name='gig_status_requested_idx'),
+            # A cupid's gigs by status
+            models.Index(fields=['cupid', 'status'], name='gig_cupid_status_idx'),
+            # A dater's gigs newest first, in the order their pages are read
+            models.Index(fields=['dater', '-date_time_of_request', '-id'], name='gig_dater_newest_idx'),
+            # The manager's gigs per hour
+            models.Index(fields=['date_time_of_request'], name='gig_requested_idx'),
+        ]
+
+
+class GigOffer(models.Model):
+    gig = models.ForeignKey(Gig, on_delete=models.CASCADE, related_name='offers')
+    cupid = models.ForeignKey(Cupid, on_delete=models.CASCADE)
+    rank = models.IntegerField()
+    distance = models.FloatField()
+    date_time_of_offer = models.DateTimeField(auto_now_add=True)
 
 
 class Date(models.Model):
@@ -107,22 +185,32 @@ class Date(models.Model):
         PAST = 'past'
         CANCELED = 'canceled'
 
-    dater = models.ForeignKey(Dater, on_delete=models.CASCADE)
+    # Indexed by the composite index below
+    dater = models.ForeignKey(Dater, on_delete=models.CASCADE, db_index=False)
     date_time = models.DateTimeField()
     location = models.TextField()
     description = models.TextField()
     status = models.TextField(choices=Status.choices)
     budget = models.DecimalField(max_digits=10, decimal_places=2)
 
+    class Meta:
+        # A dater's calendar in date order
+        indexes = [models.Index(fields=['dater', 'date_time'], name='date_dater_time_idx')]
+
 
 class Feedback(models.Model):
     owner = models.ForeignKey(User, null=True, on_delete=models.SET_NULL, related_name='owner')
-    target = models.ForeignKey(User, on_delete=models.CASCADE, related_name='target')
+    # Indexed by the composite index below
+    target = models.ForeignKey(User, on_delete=models.CASCADE, related_name='target', db_index=False)
     gig = models.ForeignKey(Gig, on_delete=models.CASCADE)
     message = models.TextField()
     star_rating = models.IntegerField()
     date_time = models.DateTimeField()
 
+    class Meta:
+        # A user's ratings in the order they were given
+        indexes = [models.Index(fields=['target', 'date_time'], name='feedback_target_time_idx')]
+
 
 class PaymentCard(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -136,3 +224,117 @@ class BankAccount(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     routing_number = models.TextField()
     account_number = models.TextField()
+
+
+class GeocodedAddress(models.Model):
+    address = models.TextField(unique=True)
+    latitude = models.FloatField(null=True)
+    longitude = models.FloatField(null=True)
+    date_time_of_lookup = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def coordinates(self):
+        return self.latitude, self.longitude
+
+
+class Notification(models.Model):
+    class Channel(models.IntegerChoices):
+        # Same values as Dater.Communication
+        EMAIL = 0
+        TEXT = 1
+
+    class Status(models.TextChoices):
+        PENDING = 'pending'
+        SENDING = 'sending'
+        SENT = 'sent'
+        FAILED = 'failed'
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    channel = models.IntegerField(choices=Channel.choices)
+    message = models.TextField()
+    status = models.TextField(choices=Status.choices, default=Status.PENDING)
+    attempts = models.IntegerField(default=0)
+    # When a pending notification may next be tried, or when a sending one's lease runs out
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(default='')
+    # Twilio message SID or SendGrid message id
+    provider_id = models.TextField(default='')
+    # How many later notifications were merged into this one
+    merged_count = models.IntegerField(default=0)
+    date_time_created = models.DateTimeField(auto_now_add=True)
+    date_time_sent = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+
+class Broadcast(models.Model):
+    class Status(models.TextChoices):
+        PENDING = 'pending'
+        SENDING = 'sending'
+        DONE = 'done'
+        FAILED = 'failed'
+
+    manager = models.ForeignKey(User, null=True, on_delete=models.SET_NULL)
+    message = models.TextField()
+    # The recipient filter: role, suspended, region and channel (see api/broadcasts.py)
+    filters = models.JSONField(default=dict)
+    status = models.TextField(choices=Status.choices, default=Status.PENDING)
+    recipient_count = models.IntegerField(default=0)
+    emails_sent = models.IntegerField(default=0)
+    texts_sent = models.IntegerField(default=0)
+    failed_count = models.IntegerField(default=0)
+    last_error = models.TextField(default='')
+    date_time_created = models.DateTimeField(auto_now_add=True)
+    date_time_completed = models.DateTimeField(null=True)
+    # Every claim adds an attempt, so the attempt count identifies the sender holding the lease
+    attempts = models.IntegerField(default=0)
+    # A sending broadcast whose lease has run out lost its sender, and is resumed by another
+    lease_expires_at = models.DateTimeField(null=True)
+    # The last recipient everyone up to has been sent to. A resumed broadcast carries on after them.
+    sent_through_role = models.TextField(default='')
+    sent_through_user_id = models.IntegerField(default=0)
+
+
+class GigEvent(models.Model):
+    """
+    Append-only history of gig state changes. The id is the event's offset in the log.
+    """
+    class Type(models.TextChoices):
+        CREATED = 'created'
+        CLAIMED = 'claimed'
+        DROPPED = 'dropped'
+        COMPLETED = 'completed'
+        CANCELLED = 'cancelled'
+        REOFFERED = 'reoffered'
+        EXPIRED = 'expired'
+
+    # Not foreign keys, so the history outlives cancelled gigs and deleted users
+    gig_id = models.BigIntegerField()
+    dater_id = models.BigIntegerField(null=True)
+    cupid_id = models.BigIntegerField(null=True)
+    type = models.TextField(choices=Type.choices)
+    # The gig's status after the change
+    status = models.IntegerField(choices=Gig.Status.choices)
+    data = models.JSONField(default=dict)
+    date_time = models.DateTimeField(auto_now_add=True)
+
+
+class GigEventOffset(models.Model):
+    """
+    How far through the gig event log a named consumer has got.
+    """
+    consumer = models.TextField(unique=True)
+    offset = models.BigIntegerField(default=0)
+
+
+class GigActivity(models.Model):
+    """
+    Gig events per hour and type, kept up to date from the event log.
+    """
+    hour = models.DateTimeField()
+    type = models.TextField(choices=GigEvent.Type.choices)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('hour', 'type')
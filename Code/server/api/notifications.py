@@ -0,0 +1,337 @@
+# Standard Library
+from collections import Counter
+from datetime import timedelta
+import logging
+import threading
+import time
+
+# Django
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Concat
+from django.utils import timezone
+
+# Local
+from . import messaging
+from .models import Notification
+
+logger = logging.getLogger(__name__)
+
+
+def send(notification):
+    if notification.channel == Notification.Channel.EMAIL:
+        return messaging.send_email_message(notification.user.email, notification.message)
+    return messaging.send_text_message(notification.message, messaging.phone_number_for(notification.user.phone_number))
+
+
+def backoff(attempts):
+    """
+    Returns how long to wait before trying a notification again after `attempts` failed tries.
+    """
+    delay = settings.NOTIFY_BACKOFF_BASE_SECONDS * 2 ** (attempts - 1)
+    return timedelta(seconds=min(delay, settings.NOTIFY_BACKOFF_MAX_SECONDS))
+
+
+def deliver(notification):
+    """
+    Sends a claimed notification and records the outcome. Failed sends are retried with
+    exponential backoff until NOTIFY_MAX_ATTEMPTS is reached.
+
+    The outcome is only recorded while the claim is still this worker's. If the lease ran out
+    and another worker claimed the notification again, that worker's outcome stands.
+
+    Returns:
+        True if the outcome was recorded.
+    """
+    try:
+        provider_id = send(notification)
+    except Exception as e:
+        notification.last_error = str(e)
+        if notification.attempts >= settings.NOTIFY_MAX_ATTEMPTS:
+            notification.status = Notification.Status.FAILED
+        else:
+            notification.status = Notification.Status.PENDING
+            notification.next_attempt_at = timezone.now() + backoff(notification.attempts)
+    else:
+        notification.status = Notification.Status.SENT
+        notification.provider_id = provider_id or ''
+        notification.last_error = ''
+        notification.date_time_sent = timezone.now()
+    # Every claim adds an attempt, so the attempt count identifies the lease holder
+    recorded = Notification.objects.filter(
+        id=notification.id, status=Notification.Status.SENDING, attempts=notification.attempts,
+    ).update(
+        status=notification.status, provider_id=notification.provider_id, last_error=notification.last_error,
+        next_attempt_at=notification.next_attempt_at, date_time_sent=notification.date_time_sent,
+    )
+    if not recorded:
+        logger.warning('Notification %s was claimed again before its send finished', notification.id)
+    return bool(recorded)
+
+
+def claim_next(channels):
+    """
+    Takes the next due notification on one of the channels, so no other worker sends it.
+
+    A claimed notification is leased for NOTIFY_SENDING_TIMEOUT_SECONDS. If its worker dies
+    before recording the outcome, the notification becomes due again once the lease runs out.
+
+    Returns:
+        The claimed Notification, or None if nothing is due.
+    """
+    if not channels:
+        return None
+    now = timezone.now()
+    due = Notification.objects.filter(
+        Q(status=Notification.Status.PENDING) | Q(status=Notification.Status.SENDING),
+        channel__in=channels,
+        next_attempt_at__lte=now,
+    )
+    lease = now + timedelta(seconds=settings.NOTIFY_SENDING_TIMEOUT_SECONDS)
+    for notification_id in due.order_by('next_attempt_at', 'id').values_list('id', flat=True)[:10]:
+        claimed = due.filter(id=notification_id).update(
+            status=Notification.Status.SENDING, attempts=F('attempts') + 1, next_attempt_at=lease,
+        )
+        if claimed:
+            return Notification.objects.select_related('user').get(id=notification_id)
+    return None
+
+
+class DeliveryWorkers:
+    """
+    Background threads that drain the notification outbox.
+
+    Each channel has its own concurrency limit (NOTIFY_CHANNEL_CONCURRENCY), so a slow email
+    provider can't hold up texts. A worker only claims notifications for channels with a free slot.
+    """
+
+    def __init__(self, count, poll_interval, channel_concurrency):
+        self.count = count
+        self.poll_interval = poll_interval
+        self.limits = {
+            channel: threading.BoundedSemaphore(channel_concurrency[channel.name.lower()])
+            for channel in Notification.Channel
+        }
+        self._threads = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self):
+        """
+        Starts the workers, replacing any that have died.
+        """
+        with self._lock:
+            self._stop.clear()
+            alive = [thread for thread in self._threads if thread.is_alive()]
+            names = {thread.name for thread in alive}
+            started = [
+                threading.Thread(target=self.run, name=name, daemon=True)
+                for name in (f'notification-worker-{number}' for number in range(self.count))
+                if name not in names
+            ]
+            self._threads = alive + started
+            for thread in started:
+                thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def wake(self):
+        self._wake.set()
+
+    def run(self):
+        try:
+            while not self._stop.is_set():
+                try:
+                    worked = self.work_once()
+                except Exception:
+                    # Most likely "database is locked". Whatever was claimed becomes due again
+                    # when its lease runs out, so wait a moment and carry on.
+                    logger.exception('Notification worker failed')
+                    connection.close()
+                    self._stop.wait(self.poll_interval)
+                    continue
+                if not worked:
+                    self._wake.wait(self.poll_interval)
+                    self._wake.clear()
+        finally:
+            connection.close()
+
+    def work_once(self):
+        """
+        Claims and delivers one notification. Returns False if there was nothing to do.
+        """
+        free = [channel for channel, limit in self.limits.items() if limit.acquire(blocking=False)]
+        held = free
+        try:
+            notification = claim_next(free)
+            if notification is None:
+                return False
+            # Only the claimed notification's channel stays taken while it is sent
+            held = [notification.channel]
+            for channel in free:
+                if channel != notification.channel:
+                    self.limits[channel].release()
+            deliver(notification)
+            return True
+        finally:
+            for channel in held:
+                self.limits[channel].release()
+
+
+workers = DeliveryWorkers(
+    settings.NOTIFY_WORKERS, settings.NOTIFY_POLL_SECONDS, settings.NOTIFY_CHANNEL_CONCURRENCY,
+)
+
+
+class TokenBucket:
+    __slots__ = ('tokens', 'updated_at')
+
+    def __init__(self, capacity, now):
+        self.tokens = capacity
+        self.updated_at = now
+
+
+class RateLimiter:
+    """
+    In-process token buckets. Each key gets `capacity` tokens, refilled evenly over `per_seconds`.
+    """
+
+    def __init__(self, capacity, per_seconds):
+        self.capacity = capacity
+        self.rate = capacity / per_seconds
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _refill(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.capacity, now)
+        bucket.tokens = min(self.capacity, bucket.tokens + (now - bucket.updated_at) * self.rate)
+        bucket.updated_at = now
+        return bucket
+
+    def available(self, key, now):
+        with self._lock:
+            return self._refill(key, now).tokens >= 1
+
+    def take(self, key, now):
+        with self._lock:
+            self._refill(key, now).tokens -= 1
+            if len(self._buckets) > 10000:
+                self.prune(now)
+
+    def prune(self, now):
+        # Buckets that have refilled completely behave the same as new ones
+        full = [key for key, bucket in self._buckets.items()
+                if bucket.tokens + (now - bucket.updated_at) * self.rate >= self.capacity]
+        for key in full:
+            del self._buckets[key]
+
+
+def build_rate_limiters(limits):
+    return {name: RateLimiter(limit['capacity'], limit['per_seconds']) for name, limit in limits.items()}
+
+
+rate_limiters = build_rate_limiters(settings.NOTIFY_RATE_LIMITS)
+rate_limit_lock = threading.Lock()
+stats = Counter()
+stats_lock = threading.Lock()
+
+
+def count(name):
+    with stats_lock:
+        stats[name] += 1
+
+
+def get_stats():
+    """
+    Returns how many notifications this process has queued, merged into a pending digest,
+    and suppressed by the rate limits since it started.
+    """
+    with stats_lock:
+        return {name: stats[name] for name in ('queued', 'merged', 'suppressed')}
+
+
+def allow(user_id, channel):
+    """
+    Takes a token from the user's bucket and the user's bucket for the channel.
+    Returns False, taking nothing, if either is empty.
+    """
+    now = time.monotonic()
+    keys = [(rate_limiters['user'], user_id), (rate_limiters[Notification.Channel(channel).name.lower()], user_id)]
+    with rate_limit_lock:
+        if not all(limiter.available(key, now) for limiter, key in keys):
+            return False
+        for limiter, key in keys:
+            limiter.take(key, now)
+    return True
+
+
+def separator(channel):
+    return '<br>' if channel == Notification.Channel.EMAIL else '\n'
+
+
+def merge_into_pending(user, channel, message):
+    """
+    Appends a message to the user's newest notification on the channel if it is still waiting
+    out its coalescing window. Returns the notification, or None if there was nothing to merge into.
+    """
+    window_start = timezone.now() - timedelta(seconds=settings.NOTIFY_COALESCE_WINDOW_SECONDS)
+    pending = Notification.objects.filter(
+        user=user, channel=channel, status=Notification.Status.PENDING, attempts=0,
+        date_time_created__gte=window_start,
+    ).order_by('-id').values_list('id', flat=True).first()
+    if pending is None:
+        return None
+    merged = Notification.objects.filter(id=pending, status=Notification.Status.PENDING, attempts=0).update(
+        message=Concat(F('message'), Value(separator(channel)), Value(message)),
+        merged_count=F('merged_count') + 1,
+    )
+    if not merged:
+        # A worker claimed it in the meantime
+        return None
+    return Notification.objects.get(id=pending)
+
+
+def enqueue(user, channel, message):
+    """
+    Adds a notification to the outbox. It is handed to the workers once the current
+    transaction commits, so the caller never waits on Twilio or SendGrid.
+
+    New notifications wait NOTIFY_COALESCE_WINDOW_SECONDS before they are sent. Anything else
+    for the same user and channel in that time is merged into them as one digest. New
+    notifications past the NOTIFY_RATE_LIMITS are dropped.
+
+    Returns:
+        The new or merged-into Notification, or None if it was suppressed by a rate limit.
+    """
+    merged = merge_into_pending(user, channel, message)
+    if merged is not None:
+        count('merged')
+        return merged
+    if not allow(user.id, channel):
+        count('suppressed')
+        return None
+    notification = Notification.objects.create(
+        user=user, channel=channel, message=message,
+        next_attempt_at=timezone.now() + timedelta(seconds=settings.NOTIFY_COALESCE_WINDOW_SECONDS),
+    )
+    count('queued')
+    transaction.on_commit(wake_workers)
+    return notification
+
+
+def wake_workers():
+    if settings.NOTIFY_WORKERS_IN_PROCESS:
+        workers.start()
+    workers.wake()
@@ -0,0 +1,56 @@
+# Rest Framework
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+
+
+class DaterGigCursorPagination(CursorPagination):
+    """
+    Pages a dater's gigs newest first. Cursors stay stable while new gigs are created.
+    """
+    ordering = ('-date_time_of_request', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class GigLimitOffsetPagination(LimitOffsetPagination):
+    """
+    Only pages when the request asks for it with ?limit=, so existing callers still get a plain list.
+    """
+    max_limit = 100
+
+
+def ordering_from(request, allowed, default):
+    """
+    Returns the ?ordering= query parameter if it names an allowed field (optionally prefixed
+    with '-'), otherwise the default.
+    """
+    ordering = request.query_params.get('ordering', default)
+    if ordering.lstrip('-') not in allowed:
+        return default
+    return ordering
+
+
+def keyset_page(queryset, limit, before_id=None, after_id=None):
+    """
+    Reads one page of a queryset by id, newest first, in a single query.
+
+    With before_id the page holds the newest rows older than it. With after_id it holds the
+    oldest rows newer than it, still listed newest first. Without either it holds the newest rows.
+
+    Returns:
+        (rows, next_cursor). Pass next_cursor back as the same parameter to read the following page.
+        It is None when there are no more rows in that direction.
+    """
+    if after_id is not None:
+        rows = list(queryset.filter(id__gt=after_id).order_by('id')[:limit + 1])
+    else:
+        if before_id is not None:
+            queryset = queryset.filter(id__lt=before_id)
+        rows = list(queryset.order_by('-id')[:limit + 1])
+    # The extra row only says whether another page follows
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = rows[-1].id if has_more else None
+    if after_id is not None:
+        rows.reverse()
+    return rows, next_cursor
@@ -0,0 +1,301 @@
+# Standard Library
+from contextlib import contextmanager
+from queue import LifoQueue, Empty, Full
+import csv
+import re
+import sqlite3
+import threading
+import time
+
+# Django
+from django.conf import settings
+from django.core.cache import caches
+
+# Miscellaneous Utils
+import requests
+from yelpapi import YelpAPI
+
+# Local
+from . import helpers
+from .spatial import SpatialGrid, haversine_distance
+
+METERS_PER_MILE = 1609.344
+
+
+class YelpClientPool:
+    """
+    Keeps YelpAPI clients around between requests so their HTTP sessions (and the
+    connections inside them) are reused instead of being opened for every search.
+    """
+
+    def __init__(self, size, timeout_s):
+        self.timeout_s = timeout_s
+        self._clients = LifoQueue(maxsize=size)
+        self._api_key = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def client(self):
+        api_key = helpers.get_yelp_api_key()
+        with self._lock:
+            if api_key != self._api_key:
+                # The key changed, so the pooled clients are stale
+                self.close()
+                self._api_key = api_key
+        try:
+            yelp_api = self._clients.get_nowait()
+        except Empty:
+            yelp_api = YelpAPI(api_key, timeout_s=self.timeout_s)
+        try:
+            yield yelp_api
+        finally:
+            try:
+                self._clients.put_nowait(yelp_api)
+            except Full:
+                yelp_api.close()
+
+    def close(self):
+        while True:
+            try:
+                self._clients.get_nowait().close()
+            except Empty:
+                return
+
+
+client_pool = YelpClientPool(settings.YELP_CLIENT_POOL_SIZE, settings.YELP_TIMEOUT_SECONDS)
+_refreshing = set()
+_refreshing_lock = threading.Lock()
+
+
+def geo_cell(latitude, longitude):
+    """
+    Rounds a location to the centre of its cache cell, so nearby daters share results.
+    """
+    decimals = settings.YELP_CACHE_CELL_DECIMALS
+    return round(float(latitude), decimals), round(float(longitude), decimals)
+
+
+def cache_key(cell, term, limit):
+    return f'yelp:{cell[0]}:{cell[1]}:{limit}:{term.strip().lower()}'
+
+
+def fetch_from_yelp(cell, term, limit):
+    """
+    Runs a live Yelp search for a cache cell. Returns None if Yelp could not answer.
+    """
+    latitude, longitude = cell
+    with client_pool.client() as yelp_api:
+        try:
+            return yelp_api.search_query(term=term, latitude=latitude, longitude=longitude, limit=limit)
+        except (YelpAPI.YelpAPIError, requests.RequestException):
+            return None
+
+
+def store(key, response):
+    cache = caches[settings.YELP_CACHE_ALIAS]
+    timeout = settings.YELP_CACHE_TTL_SECONDS + settings.YELP_CACHE_STALE_SECONDS
+    cache.set(key, (time.time(), response), timeout)
+
+
+def refresh(key, cell, term, limit):
+    try:
+        response = fetch_from_yelp(cell, term, limit)
+        if response is not None:
+            store(key, response)
+    finally:
+        with _refreshing_lock:
+            _refreshing.discard(key)
+
+
+def refresh_in_background(key, cell, term, limit):
+    with _refreshing_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+    threading.Thread(target=refresh, args=(key, cell, term, limit), daemon=True).start()
+
+
+def search_yelp(latitude, longitude, term, limit=10):
+    """
+    Returns Yelp's search results for a term near a location, using the cache where possible.
+
+    Results are fresh for YELP_CACHE_TTL_SECONDS. For YELP_CACHE_STALE_SECONDS after that the
+    cached results are still returned, and a background search refreshes them.
+
+    Returns:
+        The Yelp search response, or None if there is nothing cached and Yelp could not answer.
+    """
+    cell = geo_cell(latitude, longitude)
+    key = cache_key(cell, term, limit)
+    cached = caches[settings.YELP_CACHE_ALIAS].get(key)
+    if cached is not None:
+        fetched_at, response = cached
+        if time.time() - fetched_at > settings.YELP_CACHE_TTL_SECONDS:
+            refresh_in_background(key, cell, term, limit)
+        return response
+    response = fetch_from_yelp(cell, term, limit)
+    if response is not None:
+        store(key, response)
+    return response
+
+
+class PlacesProvider:
+    """
+    Something that can find places near a location, such as Yelp or the local POI index.
+    Results have the same shape as Yelp's business search.
+    """
+
+    def search(self, latitude, longitude, term, limit=10):
+        """
+        Returns {'businesses': [...], 'total': int} for places matching the term near the location,
+        closest first, or None if the provider could not answer.
+        """
+        raise NotImplementedError
+
+
+class YelpPlacesProvider(PlacesProvider):
+    """
+    Searches Yelp, going through the result cache.
+    """
+
+    def search(self, latitude, longitude, term, limit=10):
+        return search_yelp(latitude, longitude, term, limit)
+
+
+def search_tokens(text):
+    """
+    Splits text into lower case words with simple plurals removed, so "Flowers" matches "flower"
+    and "activities" matches "activity".
+    """
+    tokens = set()
+    for word in re.findall(r'[a-z0-9]+', text.lower()):
+        if word.endswith('ies') and len(word) > 4:
+            word = word[:-3] + 'y'
+        elif word.endswith('s') and not word.endswith('ss') and len(word) > 3:
+            word = word[:-1]
+        tokens.add(word)
+    return tokens
+
+
+class LocalPlace:
+    __slots__ = ('business', 'latitude', 'longitude', 'tokens')
+
+    def __init__(self, row):
+        self.latitude = float(row['latitude'])
+        self.longitude = float(row['longitude'])
+        aliases = [alias.strip() for alias in (row.get('categories') or '').split(';') if alias.strip()]
+        address = row.get('address') or ''
+        city = row.get('city') or ''
+        state = row.get('state') or ''
+        zip_code = row.get('zip_code') or ''
+        self.business = {
+            'id': str(row.get('id') or ''),
+            'name': row['name'],
+            'rating': float(row['rating']) if row.get('rating') else None,
+            'phone': row.get('phone') or '',
+            'url': row.get('url') or '',
+            'categories': [{'alias': alias, 'title': alias.replace('_', ' ').title()} for alias in aliases],
+            'coordinates': {'latitude': self.latitude, 'longitude': self.longitude},
+            'location': {
+                'address1': address,
+                'city': city,
+                'state': state,
+                'zip_code': zip_code,
+                'display_address': [line for line in (address, f'{city}, {state} {zip_code}'.strip(' ,')) if line],
+            },
+        }
+        self.tokens = search_tokens(' '.join([row['name']] + aliases))
+
+
+class LocalPlacesProvider(PlacesProvider):
+    """
+    Answers searches from a points of interest file held in memory, with no network calls.
+
+    The file is either a CSV or a SQLite database with a `places` table. Both have the columns
+    id, name, latitude, longitude, categories (aliases separated by ';'), address, city, state,
+    zip_code, phone, rating and url. Only name, latitude and longitude are required.
+
+    A place matches a search when every word of the term appears in its name or categories.
+    """
+
+    def __init__(self, rows, radius_miles, cell_size_degrees):
+        self.radius_miles = radius_miles
+        self.grid = SpatialGrid(cell_size_degrees)
+        for key, row in enumerate(rows):
+            place = LocalPlace(row)
+            self.grid.add(key, place.latitude, place.longitude, place)
+
+    def __len__(self):
+        return len(self.grid)
+
+    @classmethod
+    def from_file(cls, path, radius_miles, cell_size_degrees):
+        path = str(path)
+        if path.endswith('.csv'):
+            with open(path, newline='') as file:
+                return cls(csv.DictReader(file), radius_miles, cell_size_degrees)
+        connection = sqlite3.connect(path)
+        connection.row_factory = sqlite3.Row
+        try:
+            rows = [dict(row) for row in connection.execute('SELECT * FROM places')]
+        finally:
+            connection.close()
+        return cls(rows, radius_miles, cell_size_degrees)
+
+    def search(self, latitude, longitude, term, limit=10):
+        latitude = float(latitude)
+        longitude = float(longitude)
+        wanted = search_tokens(term)
+        matches = []
+        for place in self.grid.near(latitude, longitude, self.radius_miles):
+            if not wanted <= place.tokens:
+                continue
+            distance = haversine_distance(latitude, longitude, place.latitude, place.longitude)
+            if distance <= self.radius_miles:
+                matches.append((distance, place))
+        matches.sort(key=lambda match: match[0])
+        businesses = []
+        for distance, place in matches[:limit]:
+            business = dict(place.business)
+            business['distance'] = distance * METERS_PER_MILE
+            businesses.append(business)
+        return {
+            'businesses': businesses,
+            'total': len(matches),
+            'region': {'center': {'latitude': latitude, 'longitude': longitude}},
+        }
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_provider():
+    """
+    Returns the places provider chosen by the PLACES_PROVIDER setting ('yelp' or 'local').
+    """
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                if settings.PLACES_PROVIDER == 'local':
+                    _provider = LocalPlacesProvider.from_file(
+                        settings.PLACES_LOCAL_PATH, settings.PLACES_LOCAL_RADIUS_MILES,
+                        settings.PLACES_LOCAL_CELL_SIZE_DEGREES,
+                    )
+                else:
+                    _provider = YelpPlacesProvider()
+    return _provider
+
+
+def reset_provider():
+    """
+    Forgets the current provider, so the next search picks it again from settings.
+    """
+    global _provider
+    with _provider_lock:
+        _provider = None
+
+
+def search(latitude, longitude, term, limit=10):
+    return get_provider().search(latitude, longitude, term, limit)
@@ -0,0 +1,47 @@
+# Standard Library
+import functools
+import random
+import time
+
+# Django
+from django.conf import settings
+from django.db import OperationalError, connections
+
+
+def is_locked(error):
+    return 'database is locked' in str(error) or 'database table is locked' in str(error)
+
+
+def backoff(attempt):
+    """
+    Returns how long to wait before running a locked-out transaction again after `attempt` tries,
+    with jitter so the transactions that collided don't all try again at the same moment.
+    """
+    delay = min(settings.SQLITE_LOCKED_BACKOFF_BASE_SECONDS * 2 ** (attempt - 1), settings.SQLITE_LOCKED_BACKOFF_MAX_SECONDS)
+    return random.uniform(delay / 2, delay)
+
+
+def in_transaction():
+    return any(connection.in_atomic_block for connection in connections.all(initialized_only=True))
+
+
+def retry_on_locked(func):
+    """
+    Runs a write transaction again, up to SQLITE_LOCKED_RETRIES times with backoff, when SQLite
+    still finds the database locked after the connection's busy timeout.
+
+    Goes outside transaction.atomic, so every try is a new transaction. A lock error inside
+    someone else's transaction is passed on for that transaction to retry.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                attempt += 1
+                if not is_locked(e) or attempt > settings.SQLITE_LOCKED_RETRIES or in_transaction():
+                    raise
+            time.sleep(backoff(attempt))
+    return wrapper
@@ -1,12 +1,15 @@
 from rest_framework import serializers
 from django.contrib.auth.hashers import make_password
-from .models import Dater, Cupid, User, Message, Gig, Quest, Date, Feedback, PaymentCard, BankAccount
+from .models import Dater, Cupid, User, Message, Gig, Quest, Date, Feedback, PaymentCard, BankAccount, Notification, \
+    Broadcast, GigEvent
 
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = '__all__'
+        # Only the shard commands move a user's chat history, so clients can't point it elsewhere
+        read_only_fields = ['chat_shard']
 
     def create(self, validated_data):
         user = User(**validated_data)
@@ -65,6 +68,36 @@ class GigSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class CupidGigSerializer(GigSerializer):
+    """
+    A gig as a cupid sees it: `dater` is the dater's name and `dater_id` their id.
+    The queryset must be annotated with `dater_name`.
+    """
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data['dater_id'] = data['dater']
+        data['dater'] = instance.dater_name
+        return data
+
+
+class DaterGigSerializer(GigSerializer):
+    """
+    A gig as a dater sees it: `cupid` is the cupid's name ('' while unclaimed) and `cupid_id` their id.
+    The queryset should select_related('cupid__user').
+    """
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if instance.cupid is None:
+            data['cupid'] = ''  # Leave blank for frontend code
+        else:
+            user = instance.cupid.user
+            data['cupid'] = f'{user.first_name} {user.last_name}'
+            data['cupid_id'] = user.id
+        return data
+
+
 class DateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Date
@@ -88,3 +121,21 @@ class BankAccountSerializer(serializers.ModelSerializer):
     class Meta:
         model = BankAccount
         fields = '__all__'
+
+
+class NotificationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Notification
+        fields = '__all__'
+
+
+class BroadcastSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Broadcast
+        fields = '__all__'
+
+
+class GigEventSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = GigEvent
+        fields = '__all__'
@@ -0,0 +1,264 @@
+# Standard Library
+import time
+
+# Django
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Count, F
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+# Local
+from .models import Message, User
+from .retry import retry_on_locked
+
+# A user's messages keep their ids when they move to another shard, so no two databases may ever
+# make the same id. Ids made on a shard are at least ID_BASE, above anything the main database
+# handed out, and equal to the shard's number modulo ID_STRIDE, the most shards there can be.
+ID_BASE = 2 ** 40
+ID_STRIDE = 64
+COPY_BATCH_SIZE = 500
+
+
+def alias(shard):
+    return f'chat_{shard}'
+
+
+def shard_number(using):
+    return int(using.removeprefix('chat_'))
+
+
+def databases():
+    """
+    Every database chat messages can be in: the main one, then the shards.
+    """
+    return [DEFAULT_DB_ALIAS] + [alias(shard) for shard in range(settings.CHAT_SHARDS)]
+
+
+def database_for(user):
+    return DEFAULT_DB_ALIAS if user.chat_shard is None else alias(user.chat_shard)
+
+
+def messages_of(user):
+    return Message.objects.using(database_for(user)).filter(owner_id=user.id)
+
+
+class MessageShardRouter:
+    """
+    Keeps the shards to chat messages. Which shard a query goes to depends on the owner, which
+    Django doesn't pass to routers, so queries for messages pick it with .using(database_for(user)).
+    """
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # A message on a shard still belongs to a user in the main database
+        if {obj1._meta.model_name, obj2._meta.model_name} == {'message', 'user'}:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == DEFAULT_DB_ALIAS:
+            return None
+        return app_label == 'api' and model_name == 'message'
+
+
+def high_water_mark(using):
+    """
+    Returns the highest message id a database has ever held. SQLite keeps it in sqlite_sequence for
+    AUTOINCREMENT tables and never lowers it, so ids of messages that moved away or were archived
+    aren't handed out again.
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [Message._meta.db_table])
+        row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def allocate_ids(using, count):
+    """
+    Returns `count` new message ids for a shard, in order.
+
+    Must be called in a transaction on the shard. Its connections take the write lock when the
+    transaction begins (transaction_mode IMMEDIATE), so no other writer can take the same ids.
+    """
+    first = max(high_water_mark(using) + 1, ID_BASE)
+    first += (shard_number(using) - first) % ID_STRIDE
+    return range(first, first + count * ID_STRIDE, ID_STRIDE)
+
+
+@retry_on_locked
+def save_messages(using, messages, batch_size=None):
+    """
+    Inserts messages into one database in one transaction. Messages going to a shard get their ids here.
+    """
+    with transaction.atomic(using=using):
+        if using != DEFAULT_DB_ALIAS:
+            for message, message_id in zip(messages, allocate_ids(using, len(messages))):
+                message.id = message_id
+        return Message.objects.using(using).bulk_create(messages, batch_size=batch_size)
+
+
+@receiver(post_delete, sender=User)
+def delete_sharded_messages(sender, instance, **kwargs):
+    # Messages in the main database go with the user through the foreign key
+    if instance.chat_shard is not None:
+        messages_of(instance).delete()
+
+
+def copy_messages(user_id, source, target, after_id):
+    """
+    Copies a user's messages newer than after_id from one database to another, keeping their ids.
+
+    Returns:
+        (how many were copied, the newest id copied, or after_id if there were none)
+    """
+    copied = 0
+    while True:
+        batch = list(
+            Message.objects.using(source).filter(owner_id=user_id, id__gt=after_id).order_by('id')[:COPY_BATCH_SIZE]
+        )
+        if not batch:
+            return copied, after_id
+        with transaction.atomic(using=target):
+            Message.objects.using(target).bulk_create(batch)
+        copied += len(batch)
+        after_id = batch[-1].id
+
+
+def discard_copies(copies):
+    """
+    Deletes what a move that failed had copied. The users still read from their old databases,
+    so anything of theirs in the target databases is a copy.
+    """
+    for user, _, target, _ in copies:
+        Message.objects.using(target).filter(owner_id=user.id).delete()
+
+
+def move_users(moves):
+    """
+    Moves users' messages to other shards and points the users at them.
+
+    Requests that looked a user up before the move can still write to the old database, so the
+    messages are copied, the users are switched, and after CHAT_SHARD_MOVE_GRACE_SECONDS anything
+    new in the old databases is copied too before they are cleared. A chat still being written after
+    that is left behind in the old database.
+
+    If copying fails or the users can't be switched, the copies are deleted and every user stays where they were.
+
+    Args:
+        moves: [(user, shard)]
+    Returns:
+        How many messages were moved.
+    """
+    copies = []
+    moved = 0
+    try:
+        for user, shard in moves:
+            source, target = database_for(user), alias(shard)
+            if source == target:
+                continue
+            # Listed before copying, so a copy that fails part way is deleted too
+            copies.append((user, source, target, 0))
+            count, newest = copy_messages(user.id, source, target, after_id=0)
+            copies[-1] = (user, source, target, newest)
+            moved += count
+        with transaction.atomic():
+            for user, _, target, _ in copies:
+                User.objects.filter(id=user.id).update(chat_shard=shard_number(target))
+    except Exception:
+        discard_copies(copies)
+        raise
+    for user, _, target, _ in copies:
+        user.chat_shard = shard_number(target)
+    if copies:
+        time.sleep(settings.CHAT_SHARD_MOVE_GRACE_SECONDS)
+    for user, source, target, newest in copies:
+        count, newest = copy_messages(user.id, source, target, after_id=newest)
+        Message.objects.using(source).filter(owner_id=user.id, id__lte=newest).delete()
+        moved += count
+    return moved
+
+
+def move_user(user, shard):
+    return move_users([(user, shard)])
+
+
+def message_counts(messages):
+    return dict(messages.values_list('owner_id').annotate(count=Count('id')))
+
+
+def plan_moves(loads):
+    """
+    Works out which users to move to even out the number of messages on each shard.
+
+    Moves the user from the fullest shard to the emptiest whose move narrows the gap between them
+    the most, until no move narrows it.
+
+    Args:
+        loads: {shard: {user_id: message count}}. Changed to the loads after the moves.
+    Returns:
+        [(user_id, from shard, to shard)], at most one per user.
+    """
+    totals = {shard: sum(users.values()) for shard, users in loads.items()}
+    start = {user_id: shard for shard, users in loads.items() for user_id in users}
+    while len(totals) > 1:
+        fullest = max(totals, key=totals.get)
+        emptiest = min(totals, key=totals.get)
+        gap = totals[fullest] - totals[emptiest]
+        # Moving `count` messages leaves a gap of |gap - 2 * count|
+        candidates = [(abs(gap - 2 * count), user_id) for user_id, count in loads[fullest].items() if 0 < count < gap]
+        if not candidates:
+            break
+        _, user_id = min(candidates)
+        count = loads[emptiest][user_id] = loads[fullest].pop(user_id)
+        totals[fullest] -= count
+        totals[emptiest] += count
+    return [
+        (user_id, start[user_id], shard)
+        for shard, users in loads.items() for user_id in users if start[user_id] != shard
+    ]
+
+
+def rebalance(dry_run=False):
+    """
+    Puts users whose messages are still in the main database onto the emptiest shards, then moves
+    users between shards until each holds about the same number of messages.
+
+    Returns:
+        [(user_id, from database, to database)] for every user moved, or to be moved with dry_run.
+    """
+    if not settings.CHAT_SHARDS:
+        return []
+    loads = {shard: message_counts(Message.objects.using(alias(shard))) for shard in range(settings.CHAT_SHARDS)}
+    totals = {shard: sum(users.values()) for shard, users in loads.items()}
+    moves = []
+    unsharded = message_counts(Message.objects.filter(owner__chat_shard__isnull=True))
+    # Biggest first, so the small ones even out what is left
+    for user_id, count in sorted(unsharded.items(), key=lambda item: -item[1]):
+        emptiest = min(totals, key=totals.get)
+        loads[emptiest][user_id] = count
+        totals[emptiest] += count
+        moves.append((user_id, DEFAULT_DB_ALIAS, emptiest))
+    placed = {user_id: shard for user_id, _, shard in moves}
+    for user_id, source, shard in plan_moves(loads):
+        if user_id in placed:
+            placed[user_id] = shard
+        else:
+            moves.append((user_id, alias(source), shard))
+    moves = [(user_id, source, alias(placed.get(user_id, shard))) for user_id, source, shard in moves]
+    if not dry_run:
+        users = User.objects.in_bulk([user_id for user_id, _, _ in moves])
+        move_users([(users[user_id], shard_number(target)) for user_id, _, target in moves if user_id in users])
+    return moves
+
+
+def assign_shards():
+    """
+    Gives every user still without a shard one, so their future messages go to it. Run after
+    rebalance has moved the ones with messages in the main database.
+
+    Returns:
+        How many users were given a shard.
+    """
+    if not settings.CHAT_SHARDS:
+        return 0
+    return User.objects.filter(chat_shard__isnull=True).update(chat_shard=F('id') % settings.CHAT_SHARDS)
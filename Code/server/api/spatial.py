@@ -0,0 +1,124 @@
+# Standard Library
+from math import radians, sin, cos, sqrt, atan2, floor
+import threading
+
+# Radius of the Earth in miles
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE_LATITUDE = 69.0
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    # Convert latitude and longitude from degrees to radians
+    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
+
+    # Haversine formula
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = sin(dlat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(dlon / 2) ** 2
+    c = 2 * atan2(sqrt(a), sqrt(1 - a))
+    distance = EARTH_RADIUS_MILES * c
+
+    return distance
+
+
+def parse_location(location):
+    """
+    Parses a "latitude longitude" location string (the format stored on daters, cupids and quests).
+    Returns (latitude, longitude) as floats, or None if the string is not a pair of coordinates.
+    """
+    if not location:
+        return None
+    parts = location.split(" ")
+    if len(parts) != 2:
+        return None
+    try:
+        return float(parts[0].strip(',')), float(parts[1])
+    except ValueError:
+        return None
+
+
+def bounding_box(latitude, longitude, radius_miles):
+    """
+    Returns (min_latitude, max_latitude, min_longitude, max_longitude) of a box that holds
+    every point within radius_miles of (latitude, longitude).
+    """
+    lat_span = radius_miles / MILES_PER_DEGREE_LATITUDE
+    lon_span = radius_miles / (MILES_PER_DEGREE_LATITUDE * max(abs(cos(radians(latitude))), 0.01))
+    return latitude - lat_span, latitude + lat_span, longitude - lon_span, longitude + lon_span
+
+
+class SpatialGrid:
+    """
+    Buckets items into fixed-size latitude/longitude cells so that a nearby lookup only
+    has to look at the few cells around a point instead of every item.
+
+    Items are stored by key, so adding a key again moves it.
+    """
+
+    def __init__(self, cell_size_degrees):
+        self.cell_size = cell_size_degrees
+        self._cells = {}
+        self._items = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def cell_for(self, latitude, longitude):
+        return floor(latitude / self.cell_size), floor(longitude / self.cell_size)
+
+    def add(self, key, latitude, longitude, value):
+        cell = self.cell_for(latitude, longitude)
+        with self._lock:
+            self.remove(key)
+            self._cells.setdefault(cell, {})[key] = value
+            self._items[key] = (cell, value)
+
+    def remove(self, key):
+        with self._lock:
+            entry = self._items.pop(key, None)
+            if entry is None:
+                return None
+            cell, value = entry
+            bucket = self._cells[cell]
+            del bucket[key]
+            if not bucket:
+                del self._cells[cell]
+            return value
+
+    def get(self, key):
+        entry = self._items.get(key)
+        return entry[1] if entry is not None else None
+
+    def cells_near(self, latitude, longitude, radius_miles):
+        """
+        Returns the cells that could hold a point within radius_miles of (latitude, longitude).
+        """
+        min_latitude, max_latitude, min_longitude, max_longitude = bounding_box(latitude, longitude, radius_miles)
+        min_row, min_col = self.cell_for(min_latitude, min_longitude)
+        max_row, max_col = self.cell_for(max_latitude, max_longitude)
+        if (max_row - min_row + 1) * (max_col - min_col + 1) > len(self._cells):
+            # Cheaper to walk the occupied cells than every cell in the bounding box
+            return [
+                cell for cell in self._cells
+                if min_row <= cell[0] <= max_row and min_col <= cell[1] <= max_col
+            ]
+        return [
+            (row, col) for row in range(min_row, max_row + 1) for col in range(min_col, max_col + 1)
+        ]
+
+    def near(self, latitude, longitude, radius_miles):
+        """
+        Returns the values stored in the cells around a point. Callers still need to check
+        the exact distance, since a cell can be partly outside the radius.
+        """
+        with self._lock:
+            values = []
+            for cell in self.cells_near(latitude, longitude, radius_miles):
+                bucket = self._cells.get(cell)
+                if bucket:
+                    values.extend(bucket.values())
+            return values
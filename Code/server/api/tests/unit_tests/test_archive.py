@@ -0,0 +1,90 @@
+import tempfile
+from unittest.mock import patch
+from datetime import timedelta
+from pathlib import Path
+from django.conf import settings
+from django.utils import timezone
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate, APITestCase
+from api.models import Message, MessageArchive, User
+from api.views import get_messages
+from api import archive
+from api import chat
+
+
+# Archives the main database's messages. Sharded users are covered in TestChatShards.
+@override_settings(CHAT_SHARDS=0)
+class TestArchiveMessages(APITestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = get_messages
+        self.user = User.objects.create(username='archive_dater', phone_number='5550000540')
+        other = User.objects.create(username='archive_other', phone_number='5550000541')
+        self.ids = [Message.objects.create(owner=self.user, text=f'archived message {number}', from_ai=False).id
+                    for number in range(10)]
+        old = Message.objects.create(owner=other, text='archived elsewhere', from_ai=False)
+        Message.objects.filter(id__in=self.ids[:7] + [old.id]).update(date_time_created=timezone.now() - timedelta(days=100))
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overrides = self.settings(CHAT_ARCHIVE_DIR=Path(directory.name), CHAT_ARCHIVE_AFTER_DAYS=90,
+                                  CHAT_ARCHIVE_SEGMENT_SIZE=3)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def page_ids(self, response):
+        return [message['id'] for message in response.data['messages']]
+
+    def get(self, count, **params):
+        request = self.factory.get('/api/chat/', params)
+        force_authenticate(request, user=self.user)
+        return self.view(request, self.user.id, count)
+
+    def test_good_test(self):
+        assert archive.archive_old_messages() == (2, 8)
+        assert list(Message.objects.filter(owner=self.user).values_list('id', flat=True).order_by('id')) == self.ids[7:]
+        segments = MessageArchive.objects.filter(owner=self.user).order_by('first_message_id')
+        assert [segment.message_count for segment in segments] == [3, 3, 1]
+        assert all((settings.CHAT_ARCHIVE_DIR / segment.path).exists() for segment in segments)
+        # Paging runs from the database on into the archive without a gap
+        pages, cursor = [], None
+        while True:
+            response = self.get(4, **({'before_id': cursor} if cursor else {}))
+            pages.append(self.page_ids(response))
+            cursor = response.data['next_cursor']
+            if cursor is None:
+                break
+        assert pages == [self.ids[:5:-1], self.ids[5:1:-1], self.ids[1::-1]]
+        assert response.data['messages'][-1]['text'] == 'archived message 0'
+        newer = self.get(3, after_id=self.ids[1])
+        assert (self.page_ids(newer), newer.data['next_cursor']) == (self.ids[4:1:-1], self.ids[4])
+        newer = self.get(3, after_id=self.ids[5])
+        assert (self.page_ids(newer), newer.data['next_cursor']) == (self.ids[8:5:-1], self.ids[8])
+        # Archived messages leave the search index
+        assert {result['id'] for result in chat.search(self.user, 'archived', 20)} == set(self.ids[7:])
+
+    def test_nothing_to_archive(self):
+        with self.settings(CHAT_ARCHIVE_AFTER_DAYS=365):
+            assert archive.archive_old_messages() == (0, 0)
+        assert not MessageArchive.objects.filter(owner=self.user).exists()
+        with self.assertNumQueries(2):
+            response = self.get(20)
+        assert (self.page_ids(response), response.data['next_cursor']) == (self.ids[::-1], None)
+
+    def test_full_page(self):
+        archive.archive_old_messages()
+        # The page fills from the database, so the stubs tell whether there is more without reading a file
+        with patch.object(archive, 'load_segment') as load_segment:
+            response = self.get(3)
+        load_segment.assert_not_called()
+        assert (self.page_ids(response), response.data['next_cursor']) == (self.ids[:6:-1], self.ids[7])
+
+    def test_delete_user(self):
+        archive.archive_old_messages()
+        user_id = self.user.id
+        owner_dir = settings.CHAT_ARCHIVE_DIR / str(user_id)
+        assert owner_dir.exists()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        assert not MessageArchive.objects.filter(owner_id=user_id).exists()
+        assert not owner_dir.exists()
+        assert (settings.CHAT_ARCHIVE_DIR / str(User.objects.get(username='archive_other').id)).exists()
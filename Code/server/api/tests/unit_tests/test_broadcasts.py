@@ -0,0 +1,160 @@
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIRequestFactory, force_authenticate, APITestCase
+from api.models import Broadcast, Dater, User
+from api.views import broadcast
+from api import broadcasts
+
+
+class TestBroadcast(APITestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.url = reverse('broadcast')
+        self.view = broadcast
+        self.manager = User.objects.create(username='broadcast_manager', phone_number='5550000400',
+                                           role=User.Role.MANAGER, is_staff=True)
+        for number in range(5):
+            user = User.objects.create(username=f'broadcast_dater{number}', email=f'dater{number}@example.com',
+                                       phone_number=f'555000041{number}')
+            # daters 0-2 want emails, 3-4 want texts, 4 is suspended, all but 0 are in the region
+            Dater.objects.create(user=user, communication_preference=1 if number >= 3 else 0,
+                                 is_suspended=number == 4,
+                                 location='40.0 -100.0' if number == 0 else '10.0 10.0')
+        self.region = {'latitude': 10.01, 'longitude': 10.01, 'radius_miles': 10}
+
+    def post(self, data):
+        request = self.factory.post(self.url, data, format='json')
+        force_authenticate(request, user=self.manager)
+        return self.view(request)
+
+    @patch("api.messaging.send_text_message", return_value='sid')
+    @patch("api.broadcasts.send_email_batch")
+    def test_good_test(self, mock_send_email_batch, mock_send_text):
+        response = self.post({
+            'message': 'hello',
+            'filters': {'role': 'dater', 'suspended': False, 'region': self.region},
+        })
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        broadcasts.run(response.data['id'])
+        sent = Broadcast.objects.get(id=response.data['id'])
+        assert sent.status == Broadcast.Status.DONE
+        assert (sent.recipient_count, sent.emails_sent, sent.texts_sent) == (3, 2, 1)
+        mock_send_email_batch.assert_called_once_with(['dater1@example.com', 'dater2@example.com'], 'hello')
+        mock_send_text.assert_called_once_with('hello', '+15550000413')
+
+    @patch("api.broadcasts.send_email_batch", side_effect=RuntimeError('provider down'))
+    def test_batches(self, mock_send_email_batch):
+        with self.settings(BROADCAST_EMAIL_BATCH_SIZE=2, BROADCAST_CHUNK_SIZE=1):
+            sent = broadcasts.start(self.manager, 'hello', {'channel': 'email', 'region': self.region})
+            broadcasts.run(sent.id)
+        sent.refresh_from_db()
+        assert mock_send_email_batch.call_count == 2
+        assert (sent.recipient_count, sent.emails_sent, sent.failed_count) == (4, 0, 4)
+        assert sent.last_error == 'provider down'
+
+    def test_bad_test(self):
+        assert self.post({'filters': {}}).status_code == status.HTTP_400_BAD_REQUEST
+        assert self.post({'message': 'hi', 'filters': {'role': 'manager'}}).status_code == status.HTTP_400_BAD_REQUEST
+        assert self.post({'message': 'hi', 'filters': {'region': {'latitude': 1}}}).status_code == \
+            status.HTTP_400_BAD_REQUEST
+        assert Broadcast.objects.count() == 0
+
+    @patch("api.messaging.send_text_message", return_value='sid')
+    def test_verified_numbers_only(self, mock_send_text):
+        # every text would reach the one reserve number, so only a single test text goes out
+        with self.settings(TWILIO_VERIFIED_NUMBERS_ONLY=True):
+            sent = broadcasts.start(self.manager, 'hello', {'channel': 'text'})
+            broadcasts.run(sent.id)
+        sent.refresh_from_db()
+        recipient_count = sent.recipient_count
+        assert recipient_count >= 5 and sent.texts_sent == 1
+        mock_send_text.assert_called_once()
+
+        mock_send_text.reset_mock()
+        with self.settings(TWILIO_VERIFIED_NUMBERS_ONLY=False):
+            sent = broadcasts.start(self.manager, 'hello', {'channel': 'text'})
+            broadcasts.run(sent.id)
+        sent.refresh_from_db()
+        assert sent.recipient_count == sent.texts_sent == recipient_count
+        assert mock_send_text.call_count == recipient_count
+
+
+class TestResumeBroadcasts(APITestCase):
+    def setUp(self):
+        self.manager = User.objects.create(username='resume_manager', phone_number='5550000420',
+                                           role=User.Role.MANAGER, is_staff=True)
+        self.daters = []
+        for number in range(4):
+            user = User.objects.create(username=f'resume_dater{number}', email=f'resume{number}@example.com',
+                                       phone_number=f'555000043{number}')
+            Dater.objects.create(user=user)
+            self.daters.append(user)
+
+    def stopped(self, lease_seconds, **fields):
+        # A broadcast whose sender was claimed `lease_seconds` from now and then stopped
+        return Broadcast.objects.create(
+            manager=self.manager, message='hello', filters={'role': 'dater', 'channel': 'email'},
+            status=Broadcast.Status.SENDING,
+            attempts=1, lease_expires_at=timezone.now() + timedelta(seconds=lease_seconds), **fields,
+        )
+
+    @patch("api.broadcasts.send_email_batch")
+    def test_good_test(self, mock_send_email_batch):
+        # The sender died after getting the first two daters their emails
+        sent = self.stopped(-1, recipient_count=2, emails_sent=2, sent_through_role='dater',
+                            sent_through_user_id=self.daters[1].id)
+        # and this one was saved but its sender never started
+        pending = Broadcast.objects.create(manager=self.manager, message='hi', filters={'role': 'dater'})
+        out = StringIO()
+        call_command('resume_broadcasts', stdout=out)
+        assert 'Sent 2 broadcasts' in out.getvalue()
+        assert mock_send_email_batch.call_args_list[0].args == (['resume2@example.com', 'resume3@example.com'], 'hello')
+        assert mock_send_email_batch.call_args_list[1].args[1] == 'hi'
+        sent.refresh_from_db()
+        assert sent.status == Broadcast.Status.DONE and sent.attempts == 2
+        assert (sent.recipient_count, sent.emails_sent) == (4, 4)
+        pending.refresh_from_db()
+        assert pending.status == Broadcast.Status.DONE
+
+    @patch("api.broadcasts.run_in_background")
+    @patch("api.broadcasts.send_email_batch")
+    def test_bad_test(self, mock_send_email_batch, mock_run_in_background):
+        # A sender that is still renewing its lease keeps the broadcast
+        sent = self.stopped(60)
+        assert broadcasts.resume() == []
+        broadcasts.run(sent.id)
+        mock_send_email_batch.assert_not_called()
+        sent.refresh_from_db()
+        assert sent.status == Broadcast.Status.SENDING and sent.attempts == 1
+
+    @patch("api.broadcasts.send_email_batch")
+    def test_lease_lost(self, mock_send_email_batch):
+        sent = Broadcast.objects.create(manager=self.manager, message='hello', filters={'role': 'dater'})
+
+        def claimed_meanwhile(emails, message):
+            # This sender stalled past its lease and another one took over
+            Broadcast.objects.filter(id=sent.id).update(attempts=5)
+
+        mock_send_email_batch.side_effect = claimed_meanwhile
+        with self.settings(BROADCAST_EMAIL_BATCH_SIZE=2), self.assertLogs('api.broadcasts', 'WARNING'):
+            broadcasts.run(sent.id)
+        # The stalled sender stops at its first checkpoint and leaves the outcome to the new one
+        mock_send_email_batch.assert_called_once()
+        sent.refresh_from_db()
+        assert sent.status == Broadcast.Status.SENDING and sent.attempts == 5
+
+    def test_recovery_on_start(self):
+        # A restarted process looks for broadcasts to resume straight away, not after the first interval
+        looked = threading.Event()
+        recovery = broadcasts.BroadcastRecovery(interval=60)
+        with patch("api.broadcasts.resume", side_effect=lambda: looked.set()):
+            recovery.start()
+            assert looked.wait(5)
+            recovery.stop(timeout=5)
+        assert not recovery.running
@@ -0,0 +1,199 @@
+from unittest.mock import patch
+from django.db import OperationalError, connection
+from django.test import override_settings
+from rest_framework import status
+from rest_framework.test import APIRequestFactory, force_authenticate, APITestCase
+from api.models import Message, User
+from api.views import get_messages, search_messages, send_chat_message
+from api import chat
+
+
+# Users' chats stay in the main database here. TestChatShards covers the shards.
+@override_settings(CHAT_SHARDS=0)
+class TestSendChatMessage(APITestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = send_chat_message
+        self.users = [User.objects.create(username=f'chat_dater{number}', phone_number=f'555000051{number}')
+                      for number in range(2)]
+
+    def send(self, user, message):
+        request = self.factory.post('/api/chat/', {'message': message}, format='json')
+        force_authenticate(request, user=user)
+        return self.view(request)
+
+    def chat_log(self, user):
+        return list(Message.objects.filter(owner=user).order_by('id').values_list('text', 'from_ai'))
+
+    @patch('api.helpers.get_ai_response', return_value='Response')
+    def test_good_test(self, mock_get_ai_response):
+        # Both turns in one insert
+        with self.assertNumQueries(3):
+            response = self.send(self.users[0], 'Hello')
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data == {'message': 'Response'}
+        assert self.chat_log(self.users[0]) == [('Hello', False), ('Response', True)]
+
+    @patch('api.helpers.get_ai_response', return_value='Response')
+    def test_write_behind(self, mock_get_ai_response):
+        buffer = chat.WriteBehindBuffer(interval=60, max_batch=500)
+        with self.settings(CHAT_PERSISTENCE=chat.WRITE_BEHIND), patch.object(chat, 'buffer', buffer), \
+                patch.object(buffer, 'start'):
+            with self.assertNumQueries(0):
+                self.send(self.users[0], 'Hello')
+                self.send(self.users[1], 'Hi')
+                self.send(self.users[0], 'Again')
+        assert len(buffer) == 6
+        with self.assertNumQueries(3):
+            assert buffer.flush() == 6
+        assert self.chat_log(self.users[0]) == [('Hello', False), ('Response', True),
+                                                ('Again', False), ('Response', True)]
+        assert self.chat_log(self.users[1]) == [('Hi', False), ('Response', True)]
+
+    @patch('api.helpers.get_ai_response', return_value='Response')
+    def test_bad_test(self, mock_get_ai_response):
+        assert self.send(self.users[0], '').status_code == status.HTTP_400_BAD_REQUEST
+        mock_get_ai_response.assert_not_called()
+        buffer = chat.WriteBehindBuffer(interval=60, max_batch=500)
+        buffer.add([Message(owner=self.users[0], text='Before', from_ai=False),
+                    Message(owner=self.users[0], text=None, from_ai=False),
+                    Message(owner=self.users[0], text='After', from_ai=False)])
+        # A message that can never be written is logged and dropped, and the rest of its batch is written
+        with self.assertLogs('api.chat', 'ERROR') as logs:
+            assert buffer.flush() == 2
+        assert len(buffer) == 0
+        assert any('could not be saved' in message for message in logs.output)
+        assert self.chat_log(self.users[0]) == [('Before', False), ('After', False)]
+
+    def test_write_behind_busy(self):
+        buffer = chat.WriteBehindBuffer(interval=60, max_batch=500, max_size=3)
+        assert buffer.add([Message(owner=self.users[0], text='Hello', from_ai=False)])
+        # A busy database keeps the batch for the next try
+        with patch('api.shards.save_messages', side_effect=OperationalError('database is locked')), \
+                self.assertRaises(OperationalError):
+            buffer.flush()
+        assert len(buffer) == 1
+        assert buffer.add([Message(owner=self.users[0], text='Again', from_ai=False)] * 2)
+        # A full buffer takes no more
+        assert not buffer.add([Message(owner=self.users[0], text='Full', from_ai=False)])
+        assert len(buffer) == 3
+        with patch('api.shards.save_messages', side_effect=OperationalError('database is locked')), \
+                patch.object(chat.connections, 'close_all'), self.assertLogs('api.chat', 'ERROR'):
+            buffer.flush_logged()
+        assert len(buffer) == 3
+
+    @patch('api.helpers.get_ai_response', return_value='Response')
+    def test_write_behind_full(self, mock_get_ai_response):
+        buffer = chat.WriteBehindBuffer(interval=60, max_batch=500, max_size=1)
+        with self.settings(CHAT_PERSISTENCE=chat.WRITE_BEHIND), patch.object(chat, 'buffer', buffer), \
+                patch.object(buffer, 'start'):
+            self.send(self.users[0], 'Hello')
+        # The turn didn't fit, so it was written straight away
+        assert len(buffer) == 0
+        assert self.chat_log(self.users[0]) == [('Hello', False), ('Response', True)]
+
+    def test_restart(self):
+        buffer = chat.WriteBehindBuffer(interval=60, max_batch=500)
+        buffer.start()
+        first = buffer._thread
+        buffer._stop.set()
+        buffer._wake.set()
+        # A buffer that was told to stop can be started again straight away
+        buffer.start()
+        assert not first.is_alive()
+        assert buffer.running
+        buffer.stop(timeout=1)
+        assert not buffer.running
+
+
+@override_settings(CHAT_SHARDS=0)
+class TestGetMessages(APITestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = get_messages
+        self.user = User.objects.create(username='messages_dater', phone_number='5550000500')
+        other = User.objects.create(username='messages_other', phone_number='5550000501')
+        self.ids = [Message.objects.create(owner=self.user, text=f'message {number}', from_ai=number % 2 == 1).id
+                    for number in range(7)]
+        Message.objects.create(owner=other, text='not yours', from_ai=False)
+
+    def get(self, count, pk=None, **params):
+        request = self.factory.get('/api/chat/', params)
+        force_authenticate(request, user=self.user)
+        return self.view(request, self.user.id if pk is None else pk, count)
+
+    def test_good_test(self):
+        with self.assertNumQueries(1):
+            response = self.get(3)
+        assert response.status_code == status.HTTP_200_OK
+        assert [message['id'] for message in response.data['messages']] == self.ids[:3:-1]
+        older = self.get(3, before_id=response.data['next_cursor'])
+        assert [message['id'] for message in older.data['messages']] == self.ids[3:0:-1]
+        last = self.get(3, before_id=older.data['next_cursor'])
+        assert ([message['id'] for message in last.data['messages']], last.data['next_cursor']) == ([self.ids[0]], None)
+        newer = self.get(2, after_id=self.ids[2])
+        assert ([message['id'] for message in newer.data['messages']], newer.data['next_cursor']) == (
+            [self.ids[4], self.ids[3]], self.ids[4])
+
+    def test_page_size_limit(self):
+        with self.settings(CHAT_PAGE_MAX_SIZE=4):
+            assert len(self.get(0).data['messages']) == 4
+            assert len(self.get(50).data['messages']) == 4
+
+    def test_bad_test(self):
+        assert self.get(3, pk=self.user.id + 1).status_code == status.HTTP_403_FORBIDDEN
+        assert self.get(3, before_id='x').status_code == status.HTTP_400_BAD_REQUEST
+        assert self.get(3, before_id=5, after_id=1).status_code == status.HTTP_400_BAD_REQUEST
+
+
+@override_settings(CHAT_SHARDS=0)
+class TestSearchMessages(APITestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = search_messages
+        self.user = User.objects.create(username='search_dater', phone_number='5550000520')
+        self.other = User.objects.create(username='search_other', phone_number='5550000521')
+        self.manager = User.objects.create(username='search_manager', phone_number='5550000522',
+                                           role=User.Role.MANAGER, is_staff=True)
+        texts = ['Bring flowers to your first date', 'Flowers, flowers and more flowers <3',
+                 'Try the new taco place downtown', 'What should I wear?']
+        self.messages = [Message.objects.create(owner=self.user, text=text, from_ai=True) for text in texts]
+        Message.objects.create(owner=self.other, text='flowers for someone else', from_ai=False)
+
+    def search(self, q, user=None, pk=None, **params):
+        request = self.factory.get('/api/chat/search/', {'q': q, **params})
+        force_authenticate(request, user=user or self.user)
+        return self.view(request, self.user.id if pk is None else pk)
+
+    def result_ids(self, response):
+        return [result['id'] for result in response.data['results']]
+
+    def test_good_test(self):
+        response = self.search('flower')
+        assert response.status_code == status.HTTP_200_OK
+        # Stemmed, scoped to the owner, and the message that says it most comes first
+        assert self.result_ids(response) == [self.messages[1].id, self.messages[0].id]
+        assert response.data['results'][1]['snippet'] == 'Bring <mark>flowers</mark> to your first date'
+        assert '&lt;3' in response.data['results'][0]['snippet']
+        assert self.result_ids(self.search('TACO down*')) == [self.messages[2].id]
+        assert self.result_ids(self.search('flowers', limit=1)) == [self.messages[1].id]
+        assert self.result_ids(self.search('taco', user=self.manager)) == [self.messages[2].id]
+
+    def test_index_follows_changes(self):
+        self.messages[3].text = 'Wear the blue flowers shirt'
+        self.messages[3].save()
+        self.messages[0].delete()
+        assert self.result_ids(self.search('flowers')) == [self.messages[1].id, self.messages[3].id]
+        assert self.result_ids(self.search('wear')) == [self.messages[3].id]
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {chat.SEARCH_SQL}', [chat.match_expression(self.user.id, 'flowers'), 10])
+            plan = cursor.fetchall()
+        assert not any(' SCAN api_message ' in f' {row[-1]} ' for row in plan), plan
+
+    def test_bad_test(self):
+        assert self.search('flowers', user=self.other).status_code == status.HTTP_403_FORBIDDEN
+        assert self.search('  ').status_code == status.HTTP_400_BAD_REQUEST
+        assert self.search('flowers', limit='x').status_code == status.HTTP_400_BAD_REQUEST
+        # FTS5 syntax in a query is searched for as text rather than breaking the search
+        assert self.search('flowers" OR owner_id:*').data == {'results': []}
+        assert self.search('NEAR(').data == {'results': []}
@@ -0,0 +1,48 @@
+import os
+import tempfile
+from unittest.mock import patch
+from rest_framework.test import APITestCase
+from api import config
+
+
+class TestSecretsRegistry(APITestCase):
+    def setUp(self):
+        self.file = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False)
+        self.file.write("yelp api_key: yelpkey\n"
+                        "twilio account_sid: sid auth_token: token\n"
+                        "grid api_key: gridkey\n"
+                        "\n"
+                        "reserve: +15550000001\n"
+                        "sender: +15550000002\n")
+        self.file.close()
+        self.registry = config.SecretsRegistry(self.file.name, check_interval=0)
+
+    def tearDown(self):
+        os.remove(self.file.name)
+
+    def test_good_test(self):
+        secrets = self.registry.get()
+        assert secrets.yelp_api_key == 'yelpkey'
+        assert secrets.twilio_account_sid == 'sid'
+        assert secrets.twilio_auth_token == 'token'
+        assert secrets.grid_api_key == 'gridkey'
+        assert secrets.twilio_reserve_phone_number == '+15550000001'
+        assert secrets.twilio_sender_phone_number == '+15550000002'
+        with patch("api.config.open", side_effect=AssertionError("file read again")):
+            assert self.registry.get() is secrets
+
+    def test_reloads_when_the_file_changes(self):
+        assert self.registry.get().yelp_api_key == 'yelpkey'
+        with open(self.file.name, 'w') as file:
+            file.write("yelp api_key: newkey\n")
+        stat = os.stat(self.file.name)
+        os.utime(self.file.name, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        assert self.registry.get().yelp_api_key == 'newkey'
+        assert self.registry.get().grid_api_key is None
+
+    def test_bad_test(self):
+        with patch.dict(os.environ, {'YELP_API_KEY': 'fromenv'}):
+            registry = config.SecretsRegistry(self.file.name + '.missing', check_interval=0)
+            secrets = registry.get()
+        assert secrets.yelp_api_key == 'fromenv'
+        assert secrets.twilio_auth_token is None
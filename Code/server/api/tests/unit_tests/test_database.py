@@ -0,0 +1,72 @@
+import os
+import tempfile
+from unittest.mock import patch
+from django.conf import settings
+from django.db import OperationalError, connection
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from rest_framework.test import APITestCase
+from api import retry
+
+
+class TestDatabaseProfile(APITestCase):
+    def pragmas(self, profile):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        options = {'transaction_mode': 'IMMEDIATE', **settings.SQLITE_PROFILES[profile]}
+        database = DatabaseWrapper({**connection.settings_dict, 'NAME': os.path.join(directory.name, 'profile.sqlite3'),
+                                    'OPTIONS': options}, alias=f'{profile}_profile')
+        try:
+            with database.cursor() as cursor:
+                return {name: cursor.execute(f'PRAGMA {name}').fetchone()[0]
+                        for name in ('journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store', 'busy_timeout')}
+        finally:
+            database.close()
+
+    def test_good_test(self):
+        assert self.pragmas('production') == {
+            'journal_mode': 'wal', 'synchronous': 1, 'cache_size': -65536, 'mmap_size': 268435456,
+            'temp_store': 2, 'busy_timeout': 20000,
+        }
+        assert self.pragmas('development')['journal_mode'] == 'delete'
+
+
+class TestRetryOnLocked(APITestCase):
+    def setUp(self):
+        self.calls = 0
+
+    def flaky(self, failures, error='database is locked'):
+        @retry.retry_on_locked
+        def write():
+            self.calls += 1
+            if self.calls <= failures:
+                raise OperationalError(error)
+            return 'written'
+        return write
+
+    @patch('api.retry.time.sleep')
+    @patch('api.retry.in_transaction', return_value=False)
+    def test_good_test(self, mock_in_transaction, mock_sleep):
+        assert self.flaky(2)() == 'written'
+        assert self.calls == 3
+        delays = [call.args[0] for call in mock_sleep.call_args_list]
+        assert len(delays) == 2 and delays[1] <= settings.SQLITE_LOCKED_BACKOFF_BASE_SECONDS * 2
+        assert all(retry.backoff(attempt) <= settings.SQLITE_LOCKED_BACKOFF_MAX_SECONDS for attempt in range(1, 20))
+
+    @patch('api.retry.time.sleep')
+    @patch('api.retry.in_transaction', return_value=False)
+    def test_bad_test(self, mock_in_transaction, mock_sleep):
+        with self.settings(SQLITE_LOCKED_RETRIES=2), self.assertRaises(OperationalError):
+            self.flaky(5)()
+        assert self.calls == 3
+        self.calls = 0
+        # Only lock errors are retried
+        with self.assertRaises(OperationalError):
+            self.flaky(1, 'no such table: api_gig')()
+        assert self.calls == 1
+
+    def test_inside_transaction(self):
+        # Tests run in a transaction, which a retry can't start over
+        assert retry.in_transaction()
+        with patch('api.retry.time.sleep') as mock_sleep, self.assertRaises(OperationalError):
+            self.flaky(1)()
+        mock_sleep.assert_not_called()
@@ -0,0 +1,96 @@
+from django.db import transaction
+from rest_framework.test import APITestCase
+from api.models import Cupid, Dater, Gig, Quest, User
+from api import dispatch
+from api import spatial
+
+
+class TestAvailabilityIndex(APITestCase):
+    def setUp(self):
+        self.index = dispatch.AvailabilityIndex(0.25)
+        self.index._loaded = True
+
+    def make_cupid(self, user_id, location, rating_sum=0, rating_count=0, gig_range=20):
+        return Cupid(
+            user_id=user_id, location=location, accepting_gigs=True, status=Cupid.Status.AVAILABLE,
+            gig_range=gig_range, rating_sum=rating_sum, rating_count=rating_count,
+        )
+
+    def test_good_test(self):
+        self.index.update(self.make_cupid(1, "41.7370 -111.8338"))
+        self.index.update(self.make_cupid(2, "41.7000 -111.8338"))
+        self.index.update(self.make_cupid(3, "40.7608 -111.8910"))
+        matches = self.index.match(41.7370, -111.8338)
+        assert [entry.cupid_id for entry, distance in matches] == [1, 2]
+
+    def test_rating_breaks_near_ties(self):
+        self.index.update(self.make_cupid(1, "41.7370 -111.8338"))
+        self.index.update(self.make_cupid(2, "41.7400 -111.8338", rating_sum=10, rating_count=2))
+        matches = self.index.match(41.7370, -111.8338)
+        assert [entry.cupid_id for entry, distance in matches] == [2, 1]
+
+    def test_bad_test(self):
+        cupid = self.make_cupid(1, "41.7370 -111.8338")
+        self.index.update(cupid)
+        cupid.accepting_gigs = False
+        self.index.update(cupid)
+        self.index.update(self.make_cupid(2, "not a location"))
+        assert self.index.match(41.7370, -111.8338) == []
+        assert self.index.max_range == 0
+
+
+class TestDispatchGig(APITestCase):
+    def setUp(self):
+        dispatch.availability_index.clear()
+        dater_user = User.objects.create(username='dispatch_dater', email='dispatch_dater@test.com',
+                                         phone_number='5550000000')
+        self.dater = Dater.objects.create(user=dater_user, location='41.7370 -111.8338')
+        for number, location in enumerate(['41.7370 -111.8338', '41.7000 -111.8338', '40.0000 -100.0000']):
+            user = User.objects.create(username=f'dispatch_cupid{number}', email=f'dispatch_cupid{number}@test.com',
+                                       phone_number=f'555000001{number}')
+            Cupid.objects.create(user=user, location=location, accepting_gigs=True,
+                                 status=Cupid.Status.AVAILABLE)
+
+    def tearDown(self):
+        dispatch.availability_index.clear()
+
+    def make_gig(self, pickup_location):
+        coordinates = spatial.parse_location(pickup_location) or (None, None)
+        quest = Quest.objects.create(budget=10, items_requested='Flowers', pickup_location=pickup_location,
+                                     pickup_latitude=coordinates[0], pickup_longitude=coordinates[1])
+        return Gig.objects.create(dater=self.dater, quest=quest, status=Gig.Status.UNCLAIMED,
+                                  dropped_count=0, accepted_count=0)
+
+    def test_good_test(self):
+        gig = self.make_gig('41.7370 -111.8338')
+        offers = dispatch.dispatch_gig(gig)
+        assert [offer.cupid.user.username for offer in offers] == ['dispatch_cupid0', 'dispatch_cupid1']
+        assert list(gig.offers.order_by('rank').values_list('rank', flat=True)) == [0, 1]
+
+    def test_index_follows_cupid_saves(self):
+        dispatch.availability_index.ensure_loaded()
+        cupid = Cupid.objects.get(user__username='dispatch_cupid0')
+        cupid.accepting_gigs = False
+        with self.captureOnCommitCallbacks(execute=True):
+            cupid.save()
+        offers = dispatch.dispatch_gig(self.make_gig('41.7370 -111.8338'))
+        assert [offer.cupid.user.username for offer in offers] == ['dispatch_cupid1']
+
+    def test_index_ignores_rolled_back_saves(self):
+        dispatch.availability_index.ensure_loaded()
+        cupid = Cupid.objects.get(user__username='dispatch_cupid0')
+        cupid.accepting_gigs = False
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    cupid.save()
+                    raise RuntimeError('database is locked')
+            except RuntimeError:
+                pass
+        offers = dispatch.dispatch_gig(self.make_gig('41.7370 -111.8338'))
+        assert [offer.cupid.user.username for offer in offers] == ['dispatch_cupid0', 'dispatch_cupid1']
+
+    def test_bad_test(self):
+        gig = self.make_gig('123 Main Street')
+        assert dispatch.dispatch_gig(gig) == []
+        assert gig.offers.count() == 0
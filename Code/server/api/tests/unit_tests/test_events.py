@@ -0,0 +1,103 @@
+import time
+from unittest.mock import patch
+from rest_framework import status
+from rest_framework.test import APIRequestFactory, force_authenticate, APITestCase
+from api.models import Cupid, Dater, Gig, GigActivity, GigEvent, GigEventOffset, Quest, User
+from api.views import (
+    accept_gig, cancel_gig, complete_gig, drop_gig, get_gig_activity, get_gig_drop_rate, get_gig_events, get_gig_rate,
+)
+from api import events
+
+
+class TestGigEvents(APITestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.manager = User.objects.create(username='events_manager', phone_number='5550000420',
+                                           role=User.Role.MANAGER, is_staff=True)
+        dater_user = User.objects.create(username='events_dater', phone_number='5550000421')
+        self.dater = Dater.objects.create(user=dater_user, location='41.7370 -111.8338')
+        self.dater_user = dater_user
+        self.cupid_user = User.objects.create(username='events_cupid', phone_number='5550000422')
+        Cupid.objects.create(user=self.cupid_user, location='41.7370 -111.8338')
+
+    def call(self, view, user, data=None, url='/api/'):
+        request = self.factory.post(url, data, format='json') if data is not None else self.factory.get(url)
+        force_authenticate(request, user=user)
+        return view(request)
+
+    def new_gig(self):
+        quest = Quest.objects.create(budget=10, items_requested='Flowers', pickup_location='41.7370 -111.8338')
+        gig = Gig.objects.create(dater=self.dater, quest=quest, status=Gig.Status.UNCLAIMED,
+                                 dropped_count=0, accepted_count=0)
+        events.record(gig, GigEvent.Type.CREATED)
+        return gig
+
+    def test_good_test(self):
+        gig = self.new_gig()
+        assert self.call(accept_gig, self.cupid_user, {'gig_id': gig.id}).status_code == status.HTTP_200_OK
+        assert self.call(drop_gig, self.cupid_user, {'gig_id': gig.id}).status_code == status.HTTP_200_OK
+        self.call(accept_gig, self.cupid_user, {'gig_id': gig.id})
+        assert self.call(complete_gig, self.cupid_user, {'gig_id': gig.id}).status_code == status.HTTP_201_CREATED
+        cancelled = self.new_gig()
+        assert self.call(cancel_gig, self.dater_user, {'gig_id': cancelled.id}).status_code == status.HTTP_200_OK
+
+        response = self.call(get_gig_events, self.manager, url='/api/manager/gig_events/?limit=4')
+        assert [event['type'] for event in response.data['events']] == ['created', 'claimed', 'dropped', 'claimed']
+        assert response.data['events'][2]['data'] == {'dropped_by': self.cupid_user.id}
+        response = self.call(get_gig_events, self.manager,
+                             url=f'/api/manager/gig_events/?after={response.data["next_offset"]}')
+        assert [(event['type'], event['gig_id']) for event in response.data['events']] == [
+            ('completed', gig.id), ('created', cancelled.id), ('cancelled', cancelled.id)]
+        assert response.data['events'][0]['data'] == {'reward': 1.0}
+
+        # The dashboard only reads the counts, so nothing shows up until the projector catches up
+        with self.assertNumQueries(1):
+            assert self.call(get_gig_activity, self.manager).data['created'] == 0
+        assert not GigEventOffset.objects.exists()
+        assert events.catch_up(events.ACTIVITY_CONSUMER, events.count_activity) == 7
+        activity = self.call(get_gig_activity, self.manager).data
+        assert activity == {'created': 2, 'claimed': 2, 'dropped': 1, 'completed': 1, 'cancelled': 1,
+                            'reoffered': 0, 'expired': 0}
+        assert self.call(get_gig_rate, self.manager).data == {'gig_rate': 2 / 24}
+        # The drop rate is the summed dropped_count of the gigs requested in the last day
+        assert self.call(get_gig_drop_rate, self.manager).data == {'drop_rate': 1 / 24}
+        # Only the new event is read the second time round
+        self.new_gig()
+        with self.assertNumQueries(6):
+            assert events.catch_up(events.ACTIVITY_CONSUMER, events.count_activity) == 1
+        assert events.recent_activity()['created'] == 3
+
+    def test_projector(self):
+        self.new_gig()
+        projector = events.ActivityProjector(0.01)
+        with patch.object(events, 'catch_up', side_effect=[RuntimeError('database is locked'), 1, 0, 0, 0]) as catch_up, \
+                self.assertLogs('api.events', 'ERROR'):
+            projector.start()
+            # A failed catch up is logged and tried again on the next round
+            for _ in range(100):
+                if catch_up.call_count >= 3:
+                    break
+                time.sleep(0.01)
+            projector.stop(timeout=1)
+        assert catch_up.call_count >= 3
+        assert not projector.running
+        assert not GigActivity.objects.exists()
+
+    def test_bad_test(self):
+        gig = self.new_gig()
+        # A handler that fails leaves the offset where it was, so the events are handed out again
+        def fail(batch):
+            raise RuntimeError('consumer down')
+        with self.assertRaises(RuntimeError):
+            events.consume('test', fail)
+        handled = []
+        assert events.consume('test', handled.extend) == 1
+        assert events.consume('test', handled.extend) == 0
+        assert [event.gig_id for event in handled] == [gig.id]
+        # A claim that conflicts records nothing
+        self.call(accept_gig, self.cupid_user, {'gig_id': gig.id})
+        self.call(accept_gig, self.cupid_user, {'gig_id': gig.id})
+        assert GigEvent.objects.filter(type=GigEvent.Type.CLAIMED).count() == 1
+        response = self.call(get_gig_events, self.manager, url='/api/manager/gig_events/?after=x')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert self.call(get_gig_events, self.dater_user).status_code == status.HTTP_403_FORBIDDEN
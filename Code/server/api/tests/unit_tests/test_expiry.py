@@ -0,0 +1,122 @@
+import time
+from datetime import timedelta
+from unittest.mock import patch
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from api.models import Cupid, Dater, Gig, GigEvent, Quest, User
+from api import dispatch
+from api import expiry
+
+
+class TestGigExpiry(APITestCase):
+    def setUp(self):
+        dispatch.availability_index.clear()
+        dater_user = User.objects.create(username='expiry_dater', phone_number='5550000900')
+        self.dater = Dater.objects.create(user=dater_user, location='41.7370 -111.8338')
+        # The second cupid is 25 miles away, outside their 20 mile range until it is widened
+        for number, location in enumerate(['41.7370 -111.8338', '42.0993 -111.8338']):
+            user = User.objects.create(username=f'expiry_cupid{number}', phone_number=f'555000091{number}')
+            Cupid.objects.create(user=user, location=location, accepting_gigs=True, status=Cupid.Status.AVAILABLE)
+        self.now = timezone.now()
+        self.scheduler = expiry.ExpiryScheduler(batch_size=2)
+
+    def tearDown(self):
+        dispatch.availability_index.clear()
+
+    def make_gig(self):
+        quest = Quest.objects.create(budget=10, items_requested='Flowers', pickup_location='41.7370 -111.8338',
+                                     pickup_latitude=41.7370, pickup_longitude=-111.8338)
+        gig = Gig.objects.create(dater=self.dater, quest=quest, status=Gig.Status.UNCLAIMED,
+                                 dropped_count=0, accepted_count=0)
+        dispatch.dispatch_gig(gig)
+        expiry.schedule(gig, self.now)
+        self.scheduler.add(gig.id, gig.expires_at)
+        return gig
+
+    def later(self, minutes):
+        return self.now + timedelta(minutes=minutes)
+
+    def test_good_test(self):
+        gig = self.make_gig()
+        assert self.scheduler.run_once(self.later(29)) == 0
+        assert self.scheduler.run_once(self.later(31)) == 1
+        gig.refresh_from_db()
+        assert (gig.status, gig.redispatch_count) == (Gig.Status.UNCLAIMED, 1)
+        assert list(gig.offers.order_by('rank').values_list('cupid__user__username', 'rank')) == [
+            ('expiry_cupid0', 0), ('expiry_cupid1', 1)]
+        # Nobody new to offer it to, and then it has been re-offered as often as it may be
+        assert self.scheduler.run_once(self.later(62)) == 1
+        assert self.scheduler.run_once(self.later(93)) == 1
+        gig.refresh_from_db()
+        assert (gig.status, gig.expires_at, gig.offers.count()) == (Gig.Status.EXPIRED, None, 2)
+        assert list(GigEvent.objects.filter(gig_id=gig.id).values_list('type', flat=True)) == [
+            'reoffered', 'reoffered', 'expired']
+        assert len(self.scheduler) == 0
+
+    def test_expire_policy(self):
+        gigs = [self.make_gig() for _ in range(3)]
+        Gig.objects.filter(id=gigs[0].id).update(status=Gig.Status.CLAIMED, expires_at=None)
+        with self.settings(GIG_EXPIRY_POLICY=expiry.EXPIRE):
+            # One batch at a time, and a single update per batch. The claimed gig is skipped.
+            with self.assertNumQueries(5):
+                assert self.scheduler.run_once(self.later(31)) == 2
+            assert self.scheduler.run_once(self.later(31)) == 1
+        statuses = dict(Gig.objects.filter(id__in=[gig.id for gig in gigs]).values_list('id', 'status'))
+        assert [statuses[gig.id] for gig in gigs] == [Gig.Status.CLAIMED, Gig.Status.EXPIRED, Gig.Status.EXPIRED]
+
+    def test_bad_test(self):
+        forgotten, moved = self.make_gig(), self.make_gig()
+        self.scheduler.discard(forgotten.id)
+        self.now = self.later(20)
+        expiry.schedule(moved, self.now)
+        self.scheduler.add(moved.id, moved.expires_at)
+        # The old deadline of the moved gig comes up, but only its new one counts
+        assert self.scheduler.run_once(self.later(15)) == 0
+        assert len(self.scheduler) == 1
+        assert Gig.objects.filter(id__in=[forgotten.id, moved.id], status=Gig.Status.UNCLAIMED,
+                                  redispatch_count=0).count() == 2
+
+
+class TestExpiryScheduler(APITestCase):
+    def wait_for(self, condition):
+        for _ in range(200):
+            if condition():
+                return True
+            time.sleep(0.01)
+        return False
+
+    def test_good_test(self):
+        scheduler = expiry.ExpiryScheduler(batch_size=2)
+        # Errors are logged and the scheduler reads the deadlines again after backing off
+        with patch.object(scheduler, 'load', side_effect=[RuntimeError('database is locked'), None, None]) as load, \
+                patch.object(scheduler, 'run_once', side_effect=[RuntimeError('database is locked'), 0]) as run_once, \
+                self.settings(GIG_EXPIRY_RETRY_SECONDS=0.01), self.assertLogs('api.expiry', 'ERROR') as logs:
+            scheduler.start()
+            assert self.wait_for(lambda: run_once.call_count == 2)
+            assert scheduler.running
+            scheduler.stop(timeout=1)
+        assert load.call_count == 3
+        assert len(logs.records) == 2
+        assert not scheduler.running
+
+    def test_restart(self):
+        scheduler = expiry.ExpiryScheduler(batch_size=2)
+        with patch.object(scheduler, 'load'), patch.object(scheduler, 'run_once', return_value=0):
+            scheduler.start()
+            first = scheduler._thread
+            scheduler.start()
+            assert scheduler._thread is first
+            # A scheduler that was told to stop can be started again straight away
+            with scheduler._condition:
+                scheduler._stop = True
+                scheduler._condition.notify()
+            scheduler.start()
+            assert not first.is_alive()
+            assert scheduler.running
+            scheduler.stop(timeout=1)
+        assert not scheduler.running
+
+    def test_error_backoff(self):
+        scheduler = expiry.ExpiryScheduler(batch_size=2)
+        with self.settings(GIG_EXPIRY_RETRY_SECONDS=5, GIG_EXPIRY_RELOAD_SECONDS=60):
+            assert [scheduler.error_backoff(failures) for failures in range(1, 6)] == [5, 10, 20, 40, 60]
@@ -0,0 +1,87 @@
+from io import StringIO
+from unittest.mock import patch
+from django.core.management import call_command
+from geopy.exc import GeocoderUnavailable
+from rest_framework.test import APITestCase
+from api.models import GeocodedAddress, Quest
+from api import geocoding
+
+
+class TestGeocode(APITestCase):
+    def setUp(self):
+        geocoding.memory_cache.clear()
+
+    @patch("api.geocoding.lookup_address")
+    def test_good_test(self, mock_lookup_address):
+        mock_lookup_address.return_value = (1.0, 2.0)
+        assert geocoding.geocode("10 Main St, Logan") == (1.0, 2.0)
+        assert geocoding.geocode("10  main st , logan") == (1.0, 2.0)
+        geocoding.memory_cache.clear()
+        assert geocoding.geocode("10 Main St, Logan") == (1.0, 2.0)
+        mock_lookup_address.assert_called_once()
+        assert GeocodedAddress.objects.filter(address="10 main st, logan").exists()
+
+    @patch("api.geocoding.lookup_address")
+    def test_bad_test(self, mock_lookup_address):
+        mock_lookup_address.return_value = (None, None)
+        assert geocoding.geocode("Nowhere") == (None, None)
+        # Misses aren't cached, so the address is looked up again
+        assert geocoding.geocode("Nowhere") == (None, None)
+        assert mock_lookup_address.call_count == 2
+        assert not GeocodedAddress.objects.exists()
+
+    @patch("api.geocoding.get_geolocator")
+    def test_geocoder_down(self, mock_get_geolocator):
+        mock_get_geolocator.return_value.geocode.side_effect = GeocoderUnavailable('down')
+        with self.assertLogs('api.geocoding', 'WARNING'):
+            assert geocoding.geocode("10 Main St, Logan") == (None, None)
+        assert not GeocodedAddress.objects.exists()
+        mock_get_geolocator.return_value.geocode.side_effect = None
+        mock_get_geolocator.return_value.geocode.return_value.latitude = 1.0
+        mock_get_geolocator.return_value.geocode.return_value.longitude = 2.0
+        assert geocoding.geocode("10 Main St, Logan") == (1.0, 2.0)
+
+
+class TestGeocodeMany(APITestCase):
+    def setUp(self):
+        geocoding.memory_cache.clear()
+
+    @patch("api.geocoding.lookup_address")
+    def test_good_test(self, mock_lookup_address):
+        mock_lookup_address.side_effect = lambda address: (len(address), 0.0)
+        GeocodedAddress.objects.create(address="1 known st", latitude=5.0, longitude=6.0)
+        result = geocoding.geocode_many(["1 Known St", "2 New St", "2 new st", "2 New St "])
+        assert result["1 Known St"] == (5.0, 6.0)
+        assert result["2 New St"] == result["2 new st"] == result["2 New St "]
+        mock_lookup_address.assert_called_once()
+
+    @patch("api.geocoding.lookup_address")
+    def test_bad_test(self, mock_lookup_address):
+        assert geocoding.geocode_many([]) == {}
+        mock_lookup_address.assert_not_called()
+        mock_lookup_address.return_value = (None, None)
+        assert geocoding.geocode_many(["Nowhere"]) == {"Nowhere": (None, None)}
+        assert not GeocodedAddress.objects.exists()
+
+
+class TestBackfillPickupCoordinates(APITestCase):
+    def setUp(self):
+        geocoding.memory_cache.clear()
+        self.quest = Quest.objects.create(budget=10, items_requested='Flowers', pickup_location='10 Main St, Logan')
+
+    @patch("api.geocoding.get_geolocator")
+    def test_geocoder_down(self, mock_get_geolocator):
+        mock_get_geolocator.return_value.geocode.side_effect = GeocoderUnavailable('down')
+        out = StringIO()
+        with self.assertLogs('api.geocoding', 'WARNING'):
+            call_command('backfill_pickup_coordinates', stdout=out)
+        assert '1 pickup locations could not be found' in out.getvalue()
+        self.quest.refresh_from_db()
+        assert self.quest.pickup_latitude is None
+        # Nothing was cached, so the next run geocodes it
+        mock_get_geolocator.return_value.geocode.side_effect = None
+        mock_get_geolocator.return_value.geocode.return_value.latitude = 1.0
+        mock_get_geolocator.return_value.geocode.return_value.longitude = 2.0
+        call_command('backfill_pickup_coordinates', stdout=out)
+        self.quest.refresh_from_db()
+        assert (self.quest.pickup_latitude, self.quest.pickup_longitude) == (1.0, 2.0)
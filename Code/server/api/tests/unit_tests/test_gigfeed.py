@@ -0,0 +1,162 @@
+import asyncio
+import threading
+from unittest.mock import patch
+from django.contrib.auth.models import AnonymousUser
+from django.core.signals import request_finished
+from django.db import close_old_connections, transaction
+from django.test import AsyncRequestFactory
+from rest_framework import status
+from rest_framework.test import APIRequestFactory, APITestCase, force_authenticate
+from api.models import Cupid, Dater, Gig, Quest, User
+from api.views import cancel_gig, gig_feed
+from api import gigfeed
+
+
+class TestGigFeed(APITestCase):
+    def setUp(self):
+        dater_user = User.objects.create(username='feed_dater', phone_number='5550001001')
+        self.dater = Dater.objects.create(user=dater_user, location='41.7370 -111.8338')
+
+    def make_gig(self, latitude, longitude):
+        quest = Quest.objects.create(budget=10, items_requested='Flowers', pickup_location='somewhere',
+                                     pickup_latitude=latitude, pickup_longitude=longitude)
+        return Gig.objects.create(dater=self.dater, quest=quest, status=Gig.Status.UNCLAIMED,
+                                  dropped_count=0, accepted_count=0)
+
+    def test_good_test(self):
+        index = gigfeed.SubscriptionIndex(0.25)
+        gig = self.make_gig(41.7371, -111.8339)
+        near = index.subscribe(41.7370, -111.8338, 5)
+        far = index.subscribe(40.7608, -111.8910, 5)
+        with patch.object(gigfeed, 'subscriptions', index), self.captureOnCommitCallbacks(execute=True):
+            gigfeed.publish_gig(gigfeed.CREATED, gig)
+            # nothing is pushed until the transaction commits
+            assert near.queue.qsize() == 0
+        received = near.queue.get_nowait()
+        assert received['gig']['id'] == gig.id
+        assert far.queue.qsize() == 0
+        assert gigfeed.format_event(received).startswith(f'event: gig.created\ndata: {{"id": {gig.id}')
+
+    def test_rolled_back(self):
+        index = gigfeed.SubscriptionIndex(0.25)
+        subscription = index.subscribe(41.7370, -111.8338, 5)
+        with patch.object(gigfeed, 'subscriptions', index), self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    gigfeed.publish_gig(gigfeed.CREATED, self.make_gig(41.7371, -111.8339))
+                    raise RuntimeError('rolled back')
+            except RuntimeError:
+                pass
+        assert subscription.queue.qsize() == 0
+
+    def test_cancelled(self):
+        gig = self.make_gig(41.7371, -111.8339)
+        gig_id = gig.id
+        index = gigfeed.SubscriptionIndex(0.25)
+        subscription = index.subscribe(41.7370, -111.8338, 5)
+        request = APIRequestFactory().post('/api/gig/cancel/', {'gig_id': gig_id}, format='json')
+        force_authenticate(request, user=self.dater.user)
+        with patch.object(gigfeed, 'subscriptions', index), self.captureOnCommitCallbacks(execute=True):
+            assert cancel_gig(request).status_code == status.HTTP_200_OK
+        # the gig is gone by the time the transaction commits, but the event still says which one it was
+        received = subscription.queue.get_nowait()
+        assert received['type'] == gigfeed.CANCELLED
+        assert received['gig']['id'] == gig_id
+
+    def test_stream(self):
+        index = gigfeed.SubscriptionIndex(0.25)
+        with patch.object(gigfeed, 'subscriptions', index), \
+                self.settings(GIG_FEED_HEARTBEAT_SECONDS=0.01, GIG_FEED_MAX_SECONDS=5):
+            stream = gigfeed.event_stream(41.7370, -111.8338, 5)
+            # nothing is subscribed until the stream is read
+            assert len(index) == 0
+            assert next(stream).startswith('retry: ')
+            assert len(index) == 1
+            # events published from another thread are written out as they arrive
+            publisher = threading.Thread(target=index.publish, args=(
+                {'type': gigfeed.CLAIMED, 'gig': {'id': 1}}, 41.7371, -111.8339))
+            publisher.start()
+            publisher.join()
+            chunks = [next(stream) for _ in range(2)]
+            assert 'event: gig.claimed\ndata: {"id": 1}\n\n' in chunks
+            # a disconnected client closes the generator, which unsubscribes
+            stream.close()
+        assert len(index) == 0
+
+    def test_async_stream(self):
+        index = gigfeed.SubscriptionIndex(0.25)
+
+        async def read():
+            stream = gigfeed.async_event_stream(41.7370, -111.8338, 5)
+            first = await anext(stream)
+            assert len(index) == 1
+            # published from a request thread, read on the event loop
+            publisher = threading.Thread(target=index.publish, args=(
+                {'type': gigfeed.CLAIMED, 'gig': {'id': 1}}, 41.7371, -111.8339))
+            publisher.start()
+            publisher.join()
+            chunks = [await anext(stream) for _ in range(2)]
+            await stream.aclose()
+            return first, chunks
+
+        with patch.object(gigfeed, 'subscriptions', index), \
+                self.settings(GIG_FEED_HEARTBEAT_SECONDS=0.01, GIG_FEED_MAX_SECONDS=5):
+            first, chunks = asyncio.run(read())
+        assert first.startswith('retry: ')
+        assert 'event: gig.claimed\ndata: {"id": 1}\n\n' in chunks
+        assert len(index) == 0
+
+    def test_stream_ends(self):
+        index = gigfeed.SubscriptionIndex(0.25)
+        with patch.object(gigfeed, 'subscriptions', index), \
+                self.settings(GIG_FEED_HEARTBEAT_SECONDS=0.01, GIG_FEED_MAX_SECONDS=0.05):
+            # open streams are closed after a while, so their WSGI threads are given back
+            assert len(list(gigfeed.event_stream(41.7370, -111.8338, 5))) >= 2
+        assert len(index) == 0
+
+    def test_stream_closes_when_behind(self):
+        index = gigfeed.SubscriptionIndex(0.25)
+        with patch.object(gigfeed, 'subscriptions', index), self.settings(GIG_FEED_QUEUE_SIZE=1):
+            stream = gigfeed.event_stream(41.7370, -111.8338, 5)
+            next(stream)
+            for number in range(2):
+                index.publish({'type': gigfeed.CREATED, 'gig': {'id': number}}, 41.7371, -111.8339)
+            # the reader fell behind, so the stream ends and the browser reconnects
+            assert list(stream) == []
+        assert len(index) == 0
+
+    def test_feed_view(self):
+        user = User.objects.create(username='feed_cupid', phone_number='5550001002', role=User.Role.CUPID)
+        Cupid.objects.create(user=user, location='41.7370 -111.8338', gig_range=5)
+        request = APIRequestFactory().get(f'/api/gig/feed/{user.id}/')
+        request.user = user
+        index = gigfeed.SubscriptionIndex(0.25)
+        with patch.object(gigfeed, 'subscriptions', index):
+            response = gig_feed(request, user.id)
+            assert response.status_code == status.HTTP_200_OK
+            assert response['Content-Type'] == 'text/event-stream'
+            assert next(iter(response)).startswith(b'retry: ')
+            assert len(index) == 1
+            # the WSGI server closes the response when the client goes away
+            request_finished.disconnect(close_old_connections)
+            try:
+                response.close()
+            finally:
+                request_finished.connect(close_old_connections)
+        assert len(index) == 0
+
+    def test_async_feed_view(self):
+        user = User.objects.create(username='feed_cupid', phone_number='5550001002', role=User.Role.CUPID)
+        Cupid.objects.create(user=user, location='41.7370 -111.8338', gig_range=5)
+        request = AsyncRequestFactory().get(f'/api/gig/feed/{user.id}/')
+        request.user = user
+        response = gig_feed(request, user.id)
+        assert response.status_code == status.HTTP_200_OK
+        # under ASGI the stream is async, so Django sends events as they arrive
+        assert response.is_async
+
+    def test_bad_test(self):
+        request = APIRequestFactory().get('/api/gig/feed/1/')
+        request.user = AnonymousUser()
+        response = gig_feed(request, 1)
+        assert response.status_code == status.HTTP_403_FORBIDDEN
@@ -0,0 +1,320 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from unittest.mock import patch
+from django.db import OperationalError, connection
+from django.test import TransactionTestCase
+from rest_framework import status
+from rest_framework.test import APIRequestFactory, force_authenticate, APITestCase
+from api.models import Cupid, Dater, Gig, GigEvent, Quest, User
+from api.views import accept_gig, create_gig, get_cupid_gigs, get_dater_gigs
+from api import gigfeed, helpers
+
+
+class TestGigsNear(APITestCase):
+    def setUp(self):
+        dater_user = User.objects.create(username='near_dater', email='near_dater@example.com',
+                                         first_name='Near', last_name='Dater', phone_number='5550000201')
+        self.dater = Dater.objects.create(user=dater_user, budget=100, location='41.7370 -111.8338')
+        self.near = self.make_gig(41.7371, -111.8339)
+        self.far = self.make_gig(40.7608, -111.8910)
+        self.unknown = self.make_gig(None, None)
+
+    def make_gig(self, latitude, longitude):
+        quest = Quest.objects.create(budget=10, items_requested='Flowers', pickup_location='somewhere',
+                                     pickup_latitude=latitude, pickup_longitude=longitude)
+        return Gig.objects.create(dater=self.dater, quest=quest, status=Gig.Status.UNCLAIMED,
+                                  dropped_count=0, accepted_count=0)
+
+    def test_good_test(self):
+        gigs = Gig.objects.filter(dater=self.dater).select_related('quest')
+        assert helpers.gigs_near(gigs, '41.7370 -111.8338', 5) == [self.near]
+        assert set(helpers.gigs_near(gigs, '41.7370 -111.8338', 100)) == {self.near, self.far}
+
+    def test_bad_test(self):
+        gigs = Gig.objects.filter(dater=self.dater)
+        assert helpers.gigs_near(gigs, 'not a location', 100) == []
+
+
+class TestCreateGig(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='create_dater', phone_number='5550000251')
+        Dater.objects.create(user=self.user, location='41.7370 -111.8338')
+
+    def post(self):
+        request = APIRequestFactory().post('/api/gig/create/', {
+            'budget': 10, 'items_requested': 'Flowers', 'pickup_location': '41.7371 -111.8339',
+        }, format='json')
+        force_authenticate(request, user=self.user)
+        return create_gig(request)
+
+    def test_good_test(self):
+        depth = len(connection.atomic_blocks)
+        geocoded_at = []
+        def geocode(pickup_location):
+            geocoded_at.append(len(connection.atomic_blocks))
+            return 41.7371, -111.8339
+        index = gigfeed.SubscriptionIndex(0.25)
+        subscription = index.subscribe(41.7370, -111.8338, 5)
+        with patch.object(helpers, 'get_pickup_coordinates', side_effect=geocode), \
+                patch.object(gigfeed, 'subscriptions', index), self.captureOnCommitCallbacks(execute=True):
+            response = self.post()
+            # The feed is only told once the gig is committed
+            assert subscription.queue.qsize() == 0
+        assert response.status_code == status.HTTP_201_CREATED
+        # Geocoding happens before the transaction that saves the gig is opened
+        assert geocoded_at == [depth]
+        assert subscription.queue.get_nowait()['gig']['id'] == response.data['id']
+        assert subscription.queue.qsize() == 0
+
+    def test_bad_test(self):
+        index = gigfeed.SubscriptionIndex(0.25)
+        subscription = index.subscribe(41.7370, -111.8338, 5)
+        with patch.object(helpers, 'get_pickup_coordinates', return_value=(41.7371, -111.8339)), \
+                patch.object(helpers.dispatch, 'dispatch_gig', side_effect=RuntimeError('dispatch down')), \
+                patch.object(gigfeed, 'subscriptions', index), self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError):
+                self.post()
+        # Nothing was saved, so nothing is pushed
+        assert not Gig.objects.filter(dater__user=self.user).exists()
+        assert subscription.queue.qsize() == 0
+
+
+class TestRetriedGigWrites(APITestCase):
+    def setUp(self):
+        self.dater_user = User.objects.create(username='retry_dater', phone_number='5550000261')
+        self.dater = Dater.objects.create(user=self.dater_user, location='41.7370 -111.8338')
+        self.cupid_user = User.objects.create(username='retry_cupid', phone_number='5550000262')
+        Cupid.objects.create(user=self.cupid_user, location='41.7370 -111.8338')
+        self.index = gigfeed.SubscriptionIndex(0.25)
+        self.subscription = self.index.subscribe(41.7370, -111.8338, 5)
+
+    def post(self, view, user, data):
+        request = APIRequestFactory().post('/api/gig/', data, format='json')
+        force_authenticate(request, user=user)
+        return view(request)
+
+    def locked_once(self):
+        """
+        Publishes and then fails the first try with a lock error, after everything else it does.
+        """
+        publish_gig = gigfeed.publish_gig
+        tries = []
+        def publish(event_type, gig):
+            publish_gig(event_type, gig)
+            tries.append(event_type)
+            if len(tries) == 1:
+                raise OperationalError('database is locked')
+        return patch.object(gigfeed, 'publish_gig', side_effect=publish)
+
+    def received(self):
+        events = []
+        while self.subscription.queue.qsize():
+            events.append(self.subscription.queue.get_nowait())
+        return events
+
+    @patch('api.retry.time.sleep')
+    @patch('api.retry.in_transaction', return_value=False)
+    def test_good_test(self, mock_in_transaction, mock_sleep):
+        with patch.object(helpers, 'get_pickup_coordinates', return_value=(41.7371, -111.8339)) as geocode, \
+                patch.object(gigfeed, 'subscriptions', self.index), self.locked_once(), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.post(create_gig, self.dater_user, {
+                'budget': 10, 'items_requested': 'Flowers', 'pickup_location': '41.7371 -111.8339',
+            })
+        assert response.status_code == status.HTTP_201_CREATED
+        # Only the database work was tried again
+        assert geocode.call_count == 1
+        assert mock_sleep.call_count == 1
+        assert Gig.objects.filter(dater=self.dater).count() == 1
+        assert [event['gig']['id'] for event in self.received()] == [response.data['id']]
+
+    @patch('api.retry.time.sleep')
+    @patch('api.retry.in_transaction', return_value=False)
+    def test_accept(self, mock_in_transaction, mock_sleep):
+        quest = Quest.objects.create(budget=10, items_requested='Flowers', pickup_location='somewhere',
+                                     pickup_latitude=41.7371, pickup_longitude=-111.8339)
+        gig = Gig.objects.create(dater=self.dater, quest=quest, status=Gig.Status.UNCLAIMED,
+                                 dropped_count=0, accepted_count=0)
+        with patch.object(gigfeed, 'subscriptions', self.index), self.locked_once(), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.post(accept_gig, self.cupid_user, {'gig_id': gig.id})
+        assert response.status_code == status.HTTP_200_OK
+        gig.refresh_from_db()
+        assert gig.accepted_count == 1
+        assert GigEvent.objects.filter(gig_id=gig.id, type=GigEvent.Type.CLAIMED).count() == 1
+        assert [event['type'] for event in self.received()] == [gigfeed.CLAIMED]
+
+
+class TestGetCupidGigs(APITestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = get_cupid_gigs
+        cupid_user = User.objects.create(username='listing_cupid', phone_number='5550000501')
+        self.cupid = Cupid.objects.create(user=cupid_user, location='41.7370 -111.8338')
+        for number in range(30):
+            user = User.objects.create(username=f'listing_dater{number}', first_name='Dater', last_name=str(number),
+                                       phone_number=f'55500006{number:02d}')
+            dater = Dater.objects.create(user=user, location='41.7370 -111.8338')
+            quest = Quest.objects.create(budget=10, items_requested='Flowers', pickup_location='41.7370 -111.8338')
+            Gig.objects.create(dater=dater, cupid=self.cupid, quest=quest, dropped_count=0, accepted_count=1,
+                               status=Gig.Status.COMPLETE if number % 3 else Gig.Status.CLAIMED)
+        self.cupid_user = cupid_user
+
+    def get(self, query):
+        request = self.factory.get(f'/api/cupid/gigs/{self.cupid_user.id}/', query)
+        force_authenticate(request, user=self.cupid_user)
+        return self.view(request, self.cupid_user.id)
+
+    def test_good_test(self):
+        with self.assertNumQueries(2):
+            response = self.get({'complete': 'true'})
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data) == 20
+        gig = response.data[0]
+        assert gig['dater'] == 'Dater 1'
+        assert gig['dater_id'] == User.objects.get(username='listing_dater1').id
+        assert gig['quest']['items_requested'] == 'Flowers'
+
+    def test_pagination(self):
+        with self.assertNumQueries(3):
+            response = self.get({'complete': 'false', 'limit': 4, 'offset': 4, 'ordering': '-id'})
+        assert response.data['count'] == 10
+        assert [gig['dater'] for gig in response.data['results']] == ['Dater 15', 'Dater 12', 'Dater 9', 'Dater 6']
+
+    def test_bad_test(self):
+        # unknown orderings fall back to id
+        response = self.get({'complete': 'false', 'ordering': 'dater__user__password'})
+        assert response.data[0]['dater'] == 'Dater 0'
+        request = self.factory.get('/api/cupid/gigs/0/', {'complete': 'true'})
+        force_authenticate(request, user=self.cupid_user)
+        assert self.view(request, 0).status_code == status.HTTP_404_NOT_FOUND
+
+
+class TestGetDaterGigs(APITestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = get_dater_gigs
+        self.user = User.objects.create(username='gigs_dater', phone_number='5550000701')
+        self.dater = Dater.objects.create(user=self.user, location='41.7370 -111.8338')
+        for number in range(5):
+            cupid_user = User.objects.create(username=f'gigs_cupid{number}', first_name='Cupid', last_name=str(number),
+                                             phone_number=f'555000071{number}')
+            Cupid.objects.create(user=cupid_user, location='41.7370 -111.8338')
+        for number in range(12):
+            quest = Quest.objects.create(budget=10, items_requested='Flowers', pickup_location='41.7370 -111.8338')
+            cupid = Cupid.objects.get(user__username=f'gigs_cupid{number % 5}') if number % 2 else None
+            Gig.objects.create(dater=self.dater, cupid=cupid, quest=quest, dropped_count=0, accepted_count=0,
+                               status=Gig.Status.CLAIMED if cupid else Gig.Status.UNCLAIMED)
+
+    def get(self, query, url=None):
+        request = self.factory.get(url or f'/api/dater/gigs/{self.user.id}/', query)
+        force_authenticate(request, user=self.user)
+        return self.view(request, self.user.id)
+
+    def test_good_test(self):
+        with self.assertNumQueries(2):
+            response = self.get({'page_size': 5})
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data['results']) == 5
+        seen = [gig['id'] for gig in response.data['results']]
+        while response.data['next']:
+            response = self.get({}, url=response.data['next'])
+            seen += [gig['id'] for gig in response.data['results']]
+        assert seen == sorted(seen, reverse=True)
+        assert len(set(seen)) == 12
+
+    def test_status_filter(self):
+        response = self.get({'status': '1'})
+        gigs = response.data['results']
+        assert len(gigs) == 6
+        assert all(gig['cupid'].startswith('Cupid ') for gig in gigs)
+        assert gigs[0]['cupid_id'] == User.objects.get(username=gigs[0]['cupid'].replace('Cupid ', 'gigs_cupid')).id
+        unclaimed = self.get({'status': '0'}).data['results']
+        assert all(gig['cupid'] == '' for gig in unclaimed)
+
+    def test_bad_test(self):
+        assert self.get({'status': 'claimed'}).status_code == status.HTTP_400_BAD_REQUEST
+
+
+class TestClaimGig(APITestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = accept_gig
+        dater_user = User.objects.create(username='claim_dater', phone_number='5550000801')
+        dater = Dater.objects.create(user=dater_user, location='41.7370 -111.8338')
+        quest = Quest.objects.create(budget=10, items_requested='Flowers', pickup_location='41.7370 -111.8338')
+        self.gig = Gig.objects.create(dater=dater, quest=quest, status=Gig.Status.UNCLAIMED,
+                                      dropped_count=0, accepted_count=0)
+        self.cupids = []
+        for number in range(2):
+            user = User.objects.create(username=f'claim_cupid{number}', phone_number=f'555000081{number}')
+            Cupid.objects.create(user=user, location='41.7370 -111.8338')
+            self.cupids.append(user)
+        self.dater_user = dater_user
+
+    def accept(self, user, gig_id=None):
+        request = self.factory.post('/api/gig/accept/', {'gig_id': self.gig.id if gig_id is None else gig_id},
+                                    format='json')
+        force_authenticate(request, user=user)
+        return self.view(request)
+
+    def test_good_test(self):
+        response = self.accept(self.cupids[0])
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['cupid'] == self.cupids[0].id
+        self.gig.refresh_from_db()
+        assert self.gig.status == Gig.Status.CLAIMED
+        assert self.gig.accepted_count == 1
+
+    def test_bad_test(self):
+        self.accept(self.cupids[0])
+        response = self.accept(self.cupids[1])
+        assert response.status_code == status.HTTP_409_CONFLICT
+        self.gig.refresh_from_db()
+        assert self.gig.cupid_id == self.cupids[0].id
+        assert self.gig.accepted_count == 1
+        assert self.accept(self.dater_user).status_code == status.HTTP_403_FORBIDDEN
+        assert self.accept(self.cupids[1], gig_id=0).status_code == status.HTTP_404_NOT_FOUND
+
+
+class TestClaimGigConcurrently(TransactionTestCase):
+    # Real transactions, so every thread's connection sees the same committed gig
+    CUPIDS = 200
+
+    def setUp(self):
+        # Each claim commits on its own, and the last of hundreds waits for the write lock longer than
+        # SQLite's 5 second default
+        patcher = mock.patch.dict(connection.settings_dict['OPTIONS'], timeout=30)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        dater_user = User.objects.create(username='race_dater', phone_number='5550000901')
+        dater = Dater.objects.create(user=dater_user, location='41.7370 -111.8338')
+        quest = Quest.objects.create(budget=10, items_requested='Flowers', pickup_location='41.7370 -111.8338')
+        self.gig = Gig.objects.create(dater=dater, quest=quest, status=Gig.Status.UNCLAIMED,
+                                      dropped_count=0, accepted_count=0)
+        self.cupids = []
+        for number in range(self.CUPIDS):
+            user = User.objects.create(username=f'race_cupid{number}', phone_number=f'556{number:07d}')
+            Cupid.objects.create(user=user, location='41.7370 -111.8338')
+            self.cupids.append(user)
+
+    def accept(self, user, start):
+        start.wait()
+        try:
+            request = APIRequestFactory().post('/api/gig/accept/', {'gig_id': self.gig.id}, format='json')
+            force_authenticate(request, user=user)
+            return accept_gig(request).status_code
+        finally:
+            connection.close()
+
+    def test_good_test(self):
+        start = threading.Barrier(self.CUPIDS)
+        with ThreadPoolExecutor(max_workers=self.CUPIDS) as executor:
+            codes = list(executor.map(lambda user: self.accept(user, start), self.cupids))
+        assert codes.count(status.HTTP_200_OK) == 1
+        assert codes.count(status.HTTP_409_CONFLICT) == self.CUPIDS - 1
+        self.gig.refresh_from_db()
+        assert self.gig.status == Gig.Status.CLAIMED
+        assert self.gig.accepted_count == 1
+        assert self.cupids[codes.index(status.HTTP_200_OK)].id == self.gig.cupid_id
@@ -0,0 +1,116 @@
+from unittest.mock import patch, MagicMock
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.http import HttpResponse
+from django.test import RequestFactory
+from rest_framework.test import APITestCase
+from api.models import Cupid, Dater, User
+from api.helpers import (get_location_from_ip_address, get_request_location, refresh_session_location,
+                         save_profile_location, update_user_location)
+from core.middleware import location_middleware
+
+
+class TestUpdateUserLocation(APITestCase):
+
+    @patch("api.helpers.get_location_string")
+    def test_good_test(self, mock_get_location_string):
+        mock_get_location_string.return_value = "1 2"
+        user = User.objects.get(username='dater1')
+        update_user_location(user, MagicMock())
+        # check that get_location_string is called
+        mock_get_location_string.assert_called_once()
+        # check that the dater's location is updated, and only when it changes
+        assert Dater.objects.get(user=user).location == "1 2"
+        assert save_profile_location(user, "1 2") is False
+
+    @patch("api.helpers.get_location_string")
+    def test_bad_test(self, mock_get_location_string):
+        mock_get_location_string.return_value = None
+        user = User.objects.get(username='dater1')
+        location = Dater.objects.get(user=user).location
+
+        update_user_location(user, MagicMock())
+        # check that the dater's location is not updated
+        assert Dater.objects.get(user=user).location == location
+
+
+class TestRefreshSessionLocation(APITestCase):
+
+    def make_request(self, user):
+        request = MagicMock()
+        request.session = SessionStore()
+        request.session.create()
+        request.user = user
+        request.META = {'REMOTE_ADDR': '8.8.8.8'}
+        return request
+
+    @patch("api.helpers.get_location_string")
+    def test_good_test(self, mock_get_location_string):
+        mock_get_location_string.return_value = "1 2"
+        user = User.objects.get(username='cupid1')
+        request = self.make_request(user)
+        assert refresh_session_location(request) == "1 2"
+        assert refresh_session_location(request) == "1 2"
+        # geolocated once per interval, and the profile written once
+        mock_get_location_string.assert_called_once()
+        assert Cupid.objects.get(user=user).location == "1 2"
+        with patch("api.helpers.save_profile_location") as mock_save_profile_location:
+            refresh_session_location(request)
+            mock_save_profile_location.assert_not_called()
+
+    @patch("api.helpers.get_location_string")
+    def test_bad_test(self, mock_get_location_string):
+        mock_get_location_string.return_value = None
+        user = User.objects.get(username='cupid1')
+        location = Cupid.objects.get(user=user).location
+        request = self.make_request(user)
+        with self.settings(LOCATION_REFRESH_SECONDS=0):
+            assert refresh_session_location(request) is None
+            assert refresh_session_location(request) is None
+        assert mock_get_location_string.call_count == 2
+        assert Cupid.objects.get(user=user).location == location
+
+
+class TestLocationMiddleware(APITestCase):
+
+    def setUp(self):
+        self.middleware = location_middleware(lambda request: HttpResponse())
+
+    def make_request(self, user, session):
+        request = RequestFactory().get('/api/chat/', REMOTE_ADDR='8.8.8.8')
+        request.user = user
+        request.session = session
+        return request
+
+    @patch("api.helpers.get_location_string", return_value="1 2")
+    def test_good_test(self, mock_get_location_string):
+        user = User.objects.get(username='cupid1')
+        session = SessionStore()
+        session.create()
+        request = self.make_request(user, session)
+        self.middleware(request)
+        assert request.location == "1 2"
+        assert Cupid.objects.get(user=user).location == "1 2"
+
+    @patch("api.helpers.get_location_string", return_value="1 2")
+    def test_bad_test(self, mock_get_location_string):
+        sessions = Session.objects.count()
+        request = self.make_request(AnonymousUser(), SessionStore())
+        self.middleware(request)
+        # anonymous requests aren't located, and get no session
+        assert not hasattr(request, 'location')
+        mock_get_location_string.assert_not_called()
+
+        # a BasicAuth user is located by the view, still without a session
+        user = User.objects.get(username='cupid1')
+        request = self.make_request(user, SessionStore())
+        assert get_request_location(request) == "1 2"
+        assert not request.session.modified
+        assert Session.objects.count() == sessions
+        assert Cupid.objects.get(user=user).location == "1 2"
+
+    def test_missing_geoip_database(self):
+        with patch("api.helpers.geoip2.database.Reader", side_effect=FileNotFoundError), \
+                self.assertLogs('api.helpers', 'WARNING'):
+            assert get_location_from_ip_address('8.8.8.8') == (None, None)
@@ -0,0 +1,30 @@
+from unittest.mock import patch
+from rest_framework.test import APITestCase
+from api import config
+from api import messaging
+
+
+class TestProviderClients(APITestCase):
+
+    def setUp(self):
+        self.clients = messaging.ProviderClients(timeout=5, pool_size=2)
+
+    def tearDown(self):
+        self.clients.close()
+
+    @patch("api.config.get_secrets")
+    def test_good_test(self, mock_get_secrets):
+        mock_get_secrets.return_value = config.Secrets(twilio_account_sid='AC1', twilio_auth_token='token')
+        twilio = self.clients.twilio()
+        assert self.clients.twilio() is twilio
+        assert twilio.http_client.timeout == 5
+        assert self.clients.sendgrid() is self.clients.sendgrid()
+
+    @patch("api.config.get_secrets")
+    def test_bad_test(self, mock_get_secrets):
+        mock_get_secrets.return_value = config.Secrets(twilio_account_sid='AC1', twilio_auth_token='token')
+        twilio = self.clients.twilio()
+        # rotated credentials get a new client
+        mock_get_secrets.return_value = config.Secrets(twilio_account_sid='AC1', twilio_auth_token='rotated')
+        assert self.clients.twilio() is not twilio
+        assert self.clients.twilio().password == 'rotated'
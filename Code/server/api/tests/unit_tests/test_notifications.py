@@ -0,0 +1,209 @@
+import threading
+from unittest.mock import patch
+from django.conf import settings
+from django.db import OperationalError
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIRequestFactory, force_authenticate, APITestCase
+from api.models import Dater, Notification, User
+from api.views import get_notification, notify
+from api import notifications
+
+
+class TestNotify(APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.urls = "notify"
+        self.views = notify
+        self.user = User.objects.create(username='notify_dater', email='notify_dater@example.com',
+                                        phone_number='5550000301')
+        self.dater = Dater.objects.create(user=self.user, location='41.7370 -111.8338')
+
+    @patch("api.messaging.send_text_message")
+    @patch("api.messaging.send_email_message")
+    def test_good_test(self, mock_send_email, mock_send_text):
+        request = self.factory.post(reverse(self.urls), {'user_id': self.user.id, 'message': 'hi'}, format='json')
+        force_authenticate(request, user=self.user)
+        response = self.views(request)
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        notification = Notification.objects.get(id=response.data['notification_id'])
+        assert notification.status == Notification.Status.PENDING
+        assert notification.channel == Notification.Channel.EMAIL
+        # nothing is sent inside the request
+        mock_send_email.assert_not_called()
+        mock_send_text.assert_not_called()
+
+    def test_bad_test(self):
+        self.dater.communication_preference = 5
+        self.dater.save()
+        request = self.factory.post(reverse(self.urls), {'user_id': self.user.id, 'message': 'hi'}, format='json')
+        force_authenticate(request, user=self.user)
+        response = self.views(request)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert Notification.objects.count() == 0
+
+
+
+class TestGetNotification(APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = User.objects.create(username='status_dater', phone_number='5550000303')
+        self.notification = Notification.objects.create(user=self.user, channel=Notification.Channel.EMAIL,
+                                                        message='hello')
+
+    def get(self, user):
+        request = self.factory.get(reverse('get_notification', args=[self.notification.id]))
+        force_authenticate(request, user=user)
+        return get_notification(request, self.notification.id)
+
+    def test_good_test(self):
+        assert self.get(self.user).status_code == status.HTTP_200_OK
+        staff = User.objects.create(username='status_manager', phone_number='5550000304',
+                                    role=User.Role.MANAGER, is_staff=True)
+        assert self.get(staff).data['status'] == Notification.Status.PENDING
+
+    def test_bad_test(self):
+        other = User.objects.create(username='status_other', phone_number='5550000305')
+        assert self.get(other).status_code == status.HTTP_403_FORBIDDEN
+        # the manager endpoints let staff in, not the manager role on its own
+        manager = User.objects.create(username='status_role_only', phone_number='5550000306',
+                                      role=User.Role.MANAGER)
+        assert self.get(manager).status_code == status.HTTP_403_FORBIDDEN
+
+class TestCoalesceNotifications(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='coalesce_user', email='coalesce_user@example.com',
+                                        phone_number='5550000303')
+        notifications.rate_limiters = notifications.build_rate_limiters(settings.NOTIFY_RATE_LIMITS)
+        notifications.stats.clear()
+
+    def test_good_test(self):
+        first = notifications.enqueue(self.user, Notification.Channel.TEXT, 'gig accepted')
+        second = notifications.enqueue(self.user, Notification.Channel.TEXT, 'gig completed')
+        assert second.id == first.id
+        assert second.message == 'gig accepted\ngig completed'
+        assert second.merged_count == 1
+        # a different channel is its own digest
+        email = notifications.enqueue(self.user, Notification.Channel.EMAIL, 'gig dropped')
+        assert email.id != first.id
+        assert notifications.get_stats() == {'queued': 2, 'merged': 1, 'suppressed': 0}
+
+    def test_bad_test(self):
+        limit = settings.NOTIFY_RATE_LIMITS['text']['capacity']
+        with self.settings(NOTIFY_COALESCE_WINDOW_SECONDS=0):
+            for number in range(limit):
+                assert notifications.enqueue(self.user, Notification.Channel.TEXT, f'message {number}') is not None
+                Notification.objects.update(attempts=1)
+            assert notifications.enqueue(self.user, Notification.Channel.TEXT, 'one too many') is None
+            # the email bucket is separate
+            assert notifications.enqueue(self.user, Notification.Channel.EMAIL, 'still fine') is not None
+        assert notifications.get_stats()['suppressed'] == 1
+
+    def test_rate_limiter_refills(self):
+        limiter = notifications.RateLimiter(capacity=2, per_seconds=10)
+        limiter.take('user', now=0)
+        limiter.take('user', now=0)
+        assert not limiter.available('user', now=0)
+        assert limiter.available('user', now=5)
+        limiter.prune(now=100)
+        assert len(limiter._buckets) == 0
+
+
+class TestDeliverNotification(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(username='deliver_user', email='deliver_user@example.com',
+                                        phone_number='5550000302')
+        self.workers = notifications.DeliveryWorkers(1, 0, {'email': 1, 'text': 1})
+
+    def add(self, channel=Notification.Channel.EMAIL):
+        return Notification.objects.create(user=self.user, channel=channel, message='hello')
+
+    @patch("api.messaging.send_email_message", return_value='message-id')
+    def test_good_test(self, mock_send_email):
+        notification = self.add()
+        assert self.workers.work_once() is True
+        notification.refresh_from_db()
+        assert notification.status == Notification.Status.SENT
+        assert notification.provider_id == 'message-id'
+        assert notification.attempts == 1
+        mock_send_email.assert_called_once_with('deliver_user@example.com', 'hello')
+        assert self.workers.work_once() is False
+
+    @patch("api.messaging.send_email_message", side_effect=RuntimeError('provider down'))
+    def test_bad_test(self, mock_send_email):
+        notification = self.add()
+        before = timezone.now()
+        self.workers.work_once()
+        notification.refresh_from_db()
+        assert notification.status == Notification.Status.PENDING
+        assert notification.last_error == 'provider down'
+        assert notification.next_attempt_at >= before + notifications.backoff(1)
+        # not due yet
+        assert self.workers.work_once() is False
+        Notification.objects.filter(id=notification.id).update(
+            next_attempt_at=timezone.now(), attempts=settings.NOTIFY_MAX_ATTEMPTS - 1)
+        self.workers.work_once()
+        notification.refresh_from_db()
+        assert notification.status == Notification.Status.FAILED
+
+    @patch("api.messaging.send_text_message", return_value='sid')
+    def test_channel_limit(self, mock_send_text):
+        text = self.add(Notification.Channel.TEXT)
+        email = self.add(Notification.Channel.EMAIL)
+        # every text slot is busy, so only the email can be claimed
+        self.workers.limits[Notification.Channel.TEXT].acquire()
+        with patch("api.messaging.send_email_message", return_value='id'):
+            assert self.workers.work_once() is True
+            assert self.workers.work_once() is False
+        self.workers.limits[Notification.Channel.TEXT].release()
+        assert self.workers.work_once() is True
+        assert set(Notification.objects.values_list('status', flat=True)) == {Notification.Status.SENT}
+        assert Notification.objects.get(id=text.id).provider_id == 'sid'
+        assert Notification.objects.get(id=email.id).provider_id == 'id'
+
+    @patch("api.messaging.send_email_message", return_value='late-id')
+    def test_lost_lease(self, mock_send_email):
+        self.add()
+        notification = notifications.claim_next([Notification.Channel.EMAIL])
+        # the lease runs out and another worker claims and sends it
+        Notification.objects.filter(id=notification.id).update(next_attempt_at=timezone.now())
+        reclaimed = notifications.claim_next([Notification.Channel.EMAIL])
+        Notification.objects.filter(id=reclaimed.id).update(status=Notification.Status.SENT, provider_id='id')
+        with self.assertLogs('api.notifications', 'WARNING'):
+            assert notifications.deliver(notification) is False
+        notification.refresh_from_db()
+        assert (notification.status, notification.provider_id) == (Notification.Status.SENT, 'id')
+
+    def test_worker_survives_errors(self):
+        calls = []
+
+        def work_once():
+            calls.append(1)
+            if len(calls) == 1:
+                raise OperationalError('database is locked')
+            self.workers._stop.set()
+            return True
+
+        with patch.object(self.workers, 'work_once', work_once), patch("api.notifications.connection"), \
+                self.assertLogs('api.notifications', 'ERROR'):
+            self.workers.run()
+        assert len(calls) == 2
+
+    def test_start_replaces_dead_workers(self):
+        workers = notifications.DeliveryWorkers(2, 60, {'email': 1, 'text': 1})
+        dead = threading.Thread(target=lambda: None, name='notification-worker-0')
+        dead.start()
+        dead.join()
+        alive = threading.Thread(target=workers._stop.wait, name='notification-worker-1', daemon=True)
+        alive.start()
+        workers._threads = [dead, alive]
+        with patch.object(workers, 'run', workers._stop.wait):
+            workers.start()
+        assert alive in workers._threads and dead not in workers._threads
+        assert len(workers._threads) == 2 and all(thread.is_alive() for thread in workers._threads)
+        workers.stop(timeout=5)
@@ -0,0 +1,118 @@
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from django.core.cache import cache
+from rest_framework.test import APITestCase
+from api.helpers import explore_categories
+from api import places
+
+
+class TestSearchYelp(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    @patch("api.places.fetch_from_yelp")
+    def test_good_test(self, mock_fetch_from_yelp):
+        mock_fetch_from_yelp.return_value = {'businesses': [{'name': 'Flower Shop'}]}
+        first = places.search_yelp(41.73701, -111.83381, 'stores')
+        second = places.search_yelp(41.73702, -111.83379, 'Stores')
+        assert first == second == {'businesses': [{'name': 'Flower Shop'}]}
+        mock_fetch_from_yelp.assert_called_once_with((41.74, -111.83), 'stores', 10)
+
+    @patch("api.places.refresh_in_background")
+    @patch("api.places.fetch_from_yelp")
+    def test_stale_results_are_refreshed(self, mock_fetch_from_yelp, mock_refresh_in_background):
+        mock_fetch_from_yelp.return_value = {'businesses': []}
+        places.search_yelp(41.7370, -111.8338, 'stores')
+        with self.settings(YELP_CACHE_TTL_SECONDS=-1):
+            assert places.search_yelp(41.7370, -111.8338, 'stores') == {'businesses': []}
+        mock_fetch_from_yelp.assert_called_once()
+        mock_refresh_in_background.assert_called_once()
+
+    @patch("api.places.fetch_from_yelp")
+    def test_bad_test(self, mock_fetch_from_yelp):
+        mock_fetch_from_yelp.return_value = None
+        assert places.search_yelp(41.7370, -111.8338, 'stores') is None
+        assert places.search_yelp(41.7370, -111.8338, 'stores') is None
+        assert mock_fetch_from_yelp.call_count == 2
+
+
+class TestExploreCategories(APITestCase):
+    def search(self, latitude, longitude, term, limit):
+        if term == 'events':
+            time.sleep(0.5)
+        if term == 'attractions':
+            return None
+        return {'businesses': [{'name': term}]}
+
+    @patch("api.places.search_yelp")
+    def test_good_test(self, mock_search_yelp):
+        mock_search_yelp.side_effect = self.search
+        started = time.monotonic()
+        results, errors = explore_categories(41.7370, -111.8338, ['stores', 'restaurants'])
+        assert time.monotonic() - started < 0.5
+        assert results == {'stores': {'businesses': [{'name': 'stores'}]},
+                           'restaurants': {'businesses': [{'name': 'restaurants'}]}}
+        assert errors == {}
+
+    @patch("api.places.search_yelp")
+    def test_bad_test(self, mock_search_yelp):
+        mock_search_yelp.side_effect = self.search
+        timeouts = {'stores': 0.1, 'activities': 0.1, 'events': 0.1, 'attractions': 0.1, 'restaurants': 0.1}
+        with self.settings(GEO_EXPLORE_TIMEOUT_SECONDS=timeouts):
+            results, errors = explore_categories(41.7370, -111.8338, ['stores', 'events', 'attractions'])
+        assert list(results) == ['stores']
+        assert errors == {'events': 'timed out', 'attractions': 'unavailable'}
+
+    @patch("api.places.search_yelp")
+    def test_timed_out_searches_are_cancelled(self, mock_search_yelp):
+        mock_search_yelp.side_effect = self.search
+        timeouts = {'stores': 0.1, 'activities': 0.1, 'events': 0.1, 'attractions': 0.1, 'restaurants': 0.1}
+        # With one thread, stores waits behind the slow events search and misses its deadline
+        with ThreadPoolExecutor(max_workers=1) as executor, patch("api.helpers.explore_executor", executor), \
+                self.settings(GEO_EXPLORE_TIMEOUT_SECONDS=timeouts):
+            results, errors = explore_categories(41.7370, -111.8338, ['events', 'stores'])
+        assert results == {}
+        assert errors == {'events': 'timed out', 'stores': 'timed out'}
+        # so it is dropped instead of taking the thread once events is done
+        assert [call.args[2] for call in mock_search_yelp.call_args_list] == ['events']
+
+
+class TestLocalPlacesProvider(APITestCase):
+    rows = [
+        {'id': '1', 'name': 'Bluebird Flowers', 'latitude': '41.7370', 'longitude': '-111.8338',
+         'categories': 'stores;florists', 'address': '19 N Main St', 'city': 'Logan', 'state': 'UT'},
+        {'id': '2', 'name': 'Center Street Pizza', 'latitude': '41.7310', 'longitude': '-111.8340',
+         'categories': 'restaurants;pizza'},
+        {'id': '3', 'name': 'Downtown Flowers', 'latitude': '40.7608', 'longitude': '-111.8910',
+         'categories': 'stores;florists'},
+    ]
+
+    def test_good_test(self):
+        provider = places.LocalPlacesProvider(self.rows, radius_miles=25, cell_size_degrees=0.1)
+        response = provider.search(41.7300, -111.8340, 'flower')
+        assert [business['name'] for business in response['businesses']] == ['Bluebird Flowers']
+        assert response['businesses'][0]['location']['display_address'] == ['19 N Main St', 'Logan, UT']
+        response = provider.search(41.7300, -111.8340, 'stores', limit=1)
+        assert response['total'] == 1
+        assert provider.search(41.7300, -111.8340, 'restaurants')['businesses'][0]['id'] == '2'
+
+    def test_from_file(self):
+        with tempfile.NamedTemporaryFile(suffix='.sqlite3') as file:
+            connection = sqlite3.connect(file.name)
+            connection.execute('CREATE TABLE places (id, name, latitude, longitude, categories)')
+            connection.executemany('INSERT INTO places VALUES (?, ?, ?, ?, ?)', [
+                (row['id'], row['name'], row['latitude'], row['longitude'], row['categories']) for row in self.rows
+            ])
+            connection.commit()
+            connection.close()
+            provider = places.LocalPlacesProvider.from_file(file.name, radius_miles=25, cell_size_degrees=0.1)
+        assert len(provider) == 3
+        assert provider.search(40.7608, -111.8910, 'florist')['businesses'][0]['id'] == '3'
+
+    def test_bad_test(self):
+        provider = places.LocalPlacesProvider(self.rows, radius_miles=25, cell_size_degrees=0.1)
+        assert provider.search(41.7300, -111.8340, 'bowling')['businesses'] == []
+        assert provider.search(0, 0, 'stores')['total'] == 0
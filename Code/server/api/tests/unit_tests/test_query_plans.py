@@ -0,0 +1,107 @@
+import re
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate, APITestCase
+from api.models import Cupid, Date, Dater, Feedback, Gig, Message, Quest, User
+from api.views import (
+    calendar, get_active_daters, get_cupid_gigs, get_dater_gigs, get_dater_ratings, get_gig_count, get_gig_drop_rate,
+    get_gigs, get_messages, sign_in,
+)
+
+
+# get_messages reads the main database here. Every shard has the same tables and indexes.
+@override_settings(CHAT_SHARDS=0)
+class TestQueryPlans(APITestCase):
+    """
+    Each endpoint's queries have to be answered from an index. A plan that scans a whole table
+    or sorts rows in a temporary b-tree gets slower as the table grows.
+
+    The queries are captured while calling the endpoints, so a change to what an endpoint asks
+    the database is checked too.
+    """
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.dater_user = User.objects.create(username='plan_dater', email='plan_dater@example.com',
+                                              phone_number='5550000701', role=User.Role.DATER)
+        self.dater_user.set_password('password')
+        self.dater_user.save()
+        self.dater = Dater.objects.create(user=self.dater_user, location='41.7370 -111.8338')
+        self.cupid_user = User.objects.create(username='plan_cupid', phone_number='5550000702', role=User.Role.CUPID)
+        self.cupid = Cupid.objects.create(user=self.cupid_user, location='41.7370 -111.8338', gig_range=5)
+        self.manager = User.objects.create(username='plan_manager', phone_number='5550000703',
+                                           role=User.Role.MANAGER, is_staff=True)
+        for number in range(3):
+            quest = Quest.objects.create(budget=10, items_requested='Flowers', pickup_location='41.7371 -111.8339',
+                                         pickup_latitude=41.7371, pickup_longitude=-111.8339)
+            gig = Gig.objects.create(dater=self.dater, cupid=self.cupid if number else None, quest=quest,
+                                     status=Gig.Status.CLAIMED if number else Gig.Status.UNCLAIMED,
+                                     dropped_count=0, accepted_count=0)
+        Message.objects.create(owner=self.dater_user, text='Hello', from_ai=False)
+        Feedback.objects.create(owner=self.cupid_user, target=self.dater_user, gig=gig, message='Great',
+                                star_rating=5, date_time=timezone.now())
+        Date.objects.create(dater=self.dater, date_time=timezone.now(), location='Park', description='Picnic',
+                            status=Date.Status.PLANNED, budget=20)
+        session = SessionStore()
+        session['_auth_user_id'] = str(self.dater_user.id)
+        session.create()
+
+    def get(self, view, user, *args, query=None):
+        request = self.factory.get('/api/', query)
+        force_authenticate(request, user=user)
+        return view(request, *args)
+
+    def plans(self, call):
+        """
+        Calls an endpoint and returns the EXPLAIN QUERY PLAN of every SELECT it ran, by its SQL.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = call()
+        assert response.status_code < 300, response.data
+        # Serializing a user sorts their few permissions by the Permission model's ordering, which is Django's own
+        selects = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('SELECT') and '"auth_permission"' not in query['sql']]
+        assert selects, 'the endpoint ran no queries'
+        with connection.cursor() as cursor:
+            return {
+                sql: '\n'.join(row[-1] for row in cursor.execute(f'EXPLAIN QUERY PLAN {sql}').fetchall())
+                for sql in selects
+            }
+
+    def assert_indexed(self, call):
+        for sql, plan in self.plans(call).items():
+            for line in plan.splitlines():
+                assert not re.search(r'\bSCAN\b|TEMP B-TREE', line), f'{sql}\n{plan}'
+
+    def test_good_test(self):
+        endpoints = {
+            # The bounding box gigs_near narrows the open gigs to
+            'get_gigs': lambda: self.get(get_gigs, self.cupid_user, self.cupid_user.id, 5),
+            'get_cupid_gigs': lambda: self.get(get_cupid_gigs, self.cupid_user, self.cupid_user.id,
+                                               query={'complete': 'false'}),
+            'get_dater_gigs': lambda: self.get(get_dater_gigs, self.dater_user, self.dater_user.id,
+                                               query={'limit': 50}),
+            'get_gig_drop_rate': lambda: self.get(get_gig_drop_rate, self.manager),
+            'get_messages': lambda: self.get(get_messages, self.dater_user, self.dater_user.id, 5),
+            'get_dater_ratings': lambda: self.get(get_dater_ratings, self.dater_user, self.dater_user.id),
+            'calendar': lambda: self.get(calendar, self.dater_user, self.dater_user.id),
+            'get_active_daters': lambda: self.get(get_active_daters, self.manager),
+            'sign_in': lambda: sign_in(self.signed_in_request()),
+        }
+        for endpoint, call in endpoints.items():
+            with self.subTest(endpoint):
+                self.assert_indexed(call)
+
+    def signed_in_request(self):
+        request = self.factory.post('/api/user/sign_in/', {'email': 'plan_dater@example.com', 'password': 'password'},
+                                    format='json')
+        request.session = SessionStore()
+        return request
+
+    def test_bad_test(self):
+        # Counting every gig has to read the whole table
+        with self.assertRaises(AssertionError):
+            self.assert_indexed(lambda: self.get(get_gig_count, self.manager))
@@ -0,0 +1,129 @@
+from unittest import skipUnless
+from unittest.mock import patch
+from django.conf import settings
+from rest_framework.test import APIRequestFactory, force_authenticate, APITestCase
+from api.models import Message, User
+from api.serializers import UserSerializer
+from api.views import get_messages
+from api import chat
+from api import shards
+
+
+class TestPlanShardMoves(APITestCase):
+    def test_good_test(self):
+        loads = {0: {1: 10, 2: 5, 3: 1}, 1: {}}
+        assert shards.plan_moves(loads) == [(1, 0, 1)]
+        assert loads == {0: {2: 5, 3: 1}, 1: {1: 10}}
+        loads = {0: {1: 4, 2: 4, 3: 4, 4: 4}, 1: {}, 2: {5: 1}}
+        assert shards.plan_moves(loads) == [(1, 0, 1), (2, 0, 2)]
+        assert [sum(users.values()) for users in loads.values()] == [8, 4, 5]
+
+    def test_nothing_to_move(self):
+        assert shards.plan_moves({0: {1: 3}, 1: {2: 3}}) == []
+        assert shards.plan_moves({0: {1: 10}, 1: {}}) == []
+
+    def test_shard_read_only(self):
+        user = User.objects.create(username='shard_client', phone_number='5550000567', chat_shard=0)
+        serializer = UserSerializer(user, data={'chat_shard': 1}, partial=True)
+        assert serializer.is_valid(), serializer.errors
+        serializer.save()
+        user.refresh_from_db()
+        assert user.chat_shard == 0
+
+
+@skipUnless(settings.CHAT_SHARDS >= 2, 'run with CHAT_SHARDS=2 or more to test the shards')
+class TestChatShards(APITestCase):
+    databases = set(shards.databases())
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.users = [User.objects.create(username=f'shard_dater{number}', phone_number=f'555000056{number}',
+                                          chat_shard=number) for number in range(2)]
+        self.unsharded = User.objects.create(username='shard_dater_old', phone_number='5550000569', chat_shard=None)
+        self.grace = self.settings(CHAT_SHARD_MOVE_GRACE_SECONDS=0)
+        self.grace.enable()
+        self.addCleanup(self.grace.disable)
+
+    def ids(self, using, user):
+        return list(Message.objects.using(using).filter(owner=user).order_by('id').values_list('id', flat=True))
+
+    def get(self, user, count):
+        request = self.factory.get('/api/chat/')
+        force_authenticate(request, user=user)
+        return get_messages(request, user.id, count)
+
+    def test_good_test(self):
+        chat.record_turn(self.users[0], 'Flowers?', 'Roses')
+        chat.record_turn(self.users[1], 'Dinner?', 'Tacos')
+        chat.record_turn(self.users[0], 'Colour?', 'Red')
+        first = self.ids('chat_0', self.users[0])
+        assert len(first) == 4 and self.ids('chat_1', self.users[0]) == [] and self.ids('default', self.users[0]) == []
+        assert all(message_id >= shards.ID_BASE and message_id % shards.ID_STRIDE == 0 for message_id in first)
+        assert all(message_id % shards.ID_STRIDE == 1 for message_id in self.ids('chat_1', self.users[1]))
+        assert [message['text'] for message in self.get(self.users[0], 10).data['messages']] == \
+            ['Red', 'Colour?', 'Roses', 'Flowers?']
+        assert [result['text'] for result in chat.search(self.users[0], 'roses', 10)] == ['Roses']
+        assert chat.search(self.users[1], 'roses', 10) == []
+
+    def test_write_behind(self):
+        buffer = chat.WriteBehindBuffer(interval=60, max_batch=500)
+        with self.settings(CHAT_PERSISTENCE=chat.WRITE_BEHIND), patch.object(chat, 'buffer', buffer), \
+                patch.object(buffer, 'start'):
+            for user in self.users + [self.unsharded]:
+                chat.record_turn(user, 'Hello', 'Hi')
+        assert buffer.flush() == 6
+        assert [len(self.ids(using, user)) for using, user in
+                [('chat_0', self.users[0]), ('chat_1', self.users[1]), ('default', self.unsharded)]] == [2, 2, 2]
+
+    def test_move(self):
+        chat.record_turn(self.users[0], 'Flowers?', 'Roses')
+        chat.record_turn(self.unsharded, 'Old', 'Message')
+        chat.record_turn(self.users[1], 'Dinner?', 'Tacos')
+        moved = self.ids('chat_0', self.users[0])
+        assert shards.move_user(self.users[0], 1) == 2
+        assert self.ids('chat_0', self.users[0]) == [] and self.ids('chat_1', self.users[0]) == moved
+        assert User.objects.get(id=self.users[0].id).chat_shard == 1
+        chat.record_turn(self.users[0], 'Colour?', 'Red')
+        # New ids come after the moved ones and can't be made by any other shard
+        newest = self.ids('chat_1', self.users[0])[2:]
+        assert newest[0] > moved[-1] and all(message_id % shards.ID_STRIDE == 1 for message_id in newest)
+        assert [result['text'] for result in chat.search(self.users[0], 'roses', 10)] == ['Roses']
+        # The unsharded user is moved off the main database onto the emptier shard
+        moves = shards.rebalance()
+        assert (self.unsharded.id, 'default', 'chat_0') in moves
+        assert len(self.ids('chat_0', self.unsharded)) == 2 and self.ids('default', self.unsharded) == []
+
+    def test_delete_user(self):
+        chat.record_turn(self.users[0], 'Flowers?', 'Roses')
+        self.users[0].delete()
+        assert Message.objects.using('chat_0').count() == 0
+
+    def test_ids_not_reused(self):
+        other = User.objects.create(username='shard_dater_other', phone_number='5550000568', chat_shard=0)
+        chat.record_turn(self.users[0], 'Flowers?', 'Roses')
+        chat.record_turn(other, 'Dinner?', 'Tacos')
+        taken = self.ids('chat_0', other)
+        shards.move_user(other, 1)
+        # The moved ids are gone from chat_0, but it doesn't make them again
+        chat.record_turn(self.users[0], 'Colour?', 'Red')
+        assert not set(self.ids('chat_0', self.users[0])) & set(taken)
+        assert shards.move_user(self.users[0], 1) == 4
+        assert len(self.ids('chat_1', self.users[0])) == 4
+
+    def test_failed_move(self):
+        chat.record_turn(self.users[0], 'Flowers?', 'Roses')
+        chat.record_turn(self.unsharded, 'Old', 'Message')
+        before = self.ids('chat_0', self.users[0])
+        copy_messages = shards.copy_messages
+        def fail_second(user_id, source, target, after_id):
+            if user_id == self.unsharded.id:
+                copy_messages(user_id, source, target, after_id)
+                raise RuntimeError('disk full')
+            return copy_messages(user_id, source, target, after_id)
+        with patch.object(shards, 'copy_messages', side_effect=fail_second), self.assertRaises(RuntimeError):
+            shards.move_users([(self.users[0], 1), (self.unsharded, 1)])
+        # Nobody moved, and the copies already made are gone
+        assert self.ids('chat_1', self.users[0]) == [] and self.ids('chat_1', self.unsharded) == []
+        assert self.ids('chat_0', self.users[0]) == before and len(self.ids('default', self.unsharded)) == 2
+        assert User.objects.get(id=self.users[0].id).chat_shard == 0
+        assert User.objects.get(id=self.unsharded.id).chat_shard is None
@@ -7,6 +7,7 @@ urlpatterns = [
     path('user/<int:pk>', views.get_user, name='get_user'),
     path('chat/', views.send_chat_message, name='send_chat_message'),
     path('chat/<int:pk>/<int:count>', views.get_messages, name='get_messages'),
+    path('chat/search/<int:pk>/', views.search_messages, name='search_messages'),
     path('dater/calendar/<int:pk>/', views.calendar, name='calendar'),
     path('dater/rate/', views.rate_dater, name='rate_dater'),
     path('dater/ratings/<int:pk>/', views.get_dater_ratings, name='get_dater_ratings'),
@@ -34,11 +35,13 @@ urlpatterns = [
     path('gig/drop/', views.drop_gig, name='drop_gig'),
     path('gig/cancel/', views.cancel_gig, name='cancel_gig'),
     path('gig/<int:pk>/<int:count>/', views.get_gigs, name='get_gigs'),
+    path('gig/feed/<int:pk>/', views.gig_feed, name='gig_feed'),
     path('geo/stores/<int:pk>/', views.get_stores, name='get_stores'),
     path('geo/activities/<int:pk>/', views.get_activities, name='get_activities'),
     path('geo/events/<int:pk>/', views.get_events, name='get_events'),
     path('geo/attractions/<int:pk>/', views.get_attractions, name='get_attractions'),
     path('geo/restaurants/<int:pk>/', views.get_restaurants, name='get_restaurants'),
+    path('geo/explore/<int:pk>/', views.explore_nearby, name='explore_nearby'),
     path('geo/user/<int:pk>/', views.get_user_location, name='get_user_location'),
     path('manager/cupids/', views.get_cupids, name='get_cupids'),
     path('manager/daters/', views.get_daters, name='get_daters'),
@@ -53,6 +56,12 @@ urlpatterns = [
     path('manager/suspend/', views.suspend, name='suspend'),
     path('manager/delete_user/<int:pk>/', views.delete_user, name='delete_user'),
     path('manager/unsuspend/', views.unsuspend, name='unsuspend'),
+    path('manager/broadcast/', views.broadcast, name='broadcast'),
+    path('manager/broadcast/<int:pk>/', views.get_broadcast, name='get_broadcast'),
     path('stt/', views.speech_to_text, name='speech_to_text'),
     path('notify/', views.notify, name='notify'),
+    path('notify/<int:pk>/', views.get_notification, name='get_notification'),
+    path('manager/notification_stats/', views.get_notification_stats, name='get_notification_stats'),
+    path('manager/gig_events/', views.get_gig_events, name='get_gig_events'),
+    path('manager/gig_activity/', views.get_gig_activity, name='get_gig_activity'),
 ]
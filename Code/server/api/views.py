@@ -1,10 +1,15 @@
 # Standard Library
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 
 # Django
+from django.conf import settings
 from django.contrib.auth import login, authenticate
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+from django.db.models import Count, F, Sum, Value
+from django.db.models.functions import Concat
+from django.http import JsonResponse, StreamingHttpResponse
 from django.utils.timezone import make_aware
 from django.shortcuts import get_object_or_404, get_list_or_404
 
@@ -36,9 +41,25 @@ from .serializers import (
     PaymentCardSerializer,
     BankAccountSerializer,
     QuestSerializer,
+    NotificationSerializer,
+    BroadcastSerializer,
+    GigEventSerializer,
+    CupidGigSerializer,
+    DaterGigSerializer,
 )
-from .models import (User, Dater, Cupid, Gig, Quest, Message, Date, Feedback, PaymentCard, BankAccount)
+from .models import (User, Dater, Cupid, Gig, Quest, Message, Date, Feedback, PaymentCard, BankAccount, Notification,
+                     Broadcast, GigEvent)
 from . import helpers
+from .spatial import parse_location
+from . import archive
+from . import broadcasts
+from . import chat
+from . import events
+from . import expiry
+from . import gigfeed
+from . import notifications
+from .pagination import DaterGigCursorPagination, GigLimitOffsetPagination, ordering_from
+from .retry import retry_on_locked
 
 # AI API (pytensor) https://pytensor.readthedocs.io/en/latest/
 # Location API (Geolocation) https://pypi.org/project/geolocation-python/
@@ -46,6 +67,9 @@ from . import helpers
 # Text and Email notifications API (Twilio) https://www.twilio.com/en-us
 # Nearby Shops API (yelpapi) https://pypi.org/project/yelpapi/
 
+# Fields the cupid gig list can be ordered by
+CUPID_GIG_ORDERING = ('id', 'date_time_of_request', 'date_time_of_claim', 'date_time_of_completion')
+
 
 @api_view(['POST'])
 def create_user(request):
@@ -81,7 +105,7 @@ def create_user(request):
     """
     # Prepare data input
     data = request.data
-    data['location'] = helpers.get_location_string(request.META['REMOTE_ADDR'])
+    data['location'] = helpers.get_request_location(request)
     data['role'] = data['role'].lower()
     # Create user
     user_serializer = UserSerializer(data=data)
@@ -115,7 +139,6 @@ def sign_in(request):
             Dater, Cupid, or Manager serialized
     """
     data = request.data
-    data['location'] = helpers.get_location_string(request.META['REMOTE_ADDR'])
     username = User.objects.get(email=data['email']).username
     user = authenticate(request, username=username, password=data['password'])
     if user is not None:
@@ -192,7 +215,8 @@ def delete_user(request, pk):
 def send_chat_message(request):
     """
     For a dater.
-    Stores the given message in the database, sends it to the AI, and returns the AI's response.
+    Stores the given message in the database holding the user's chat, sends it to the AI, and returns
+    the AI's response.
 
     Args (request.post):
         message(str): The message
@@ -202,24 +226,50 @@ def send_chat_message(request):
             message(str): The AI's response
     """
     data = request.data
-    data['location'] = helpers.get_location_string(request.META['REMOTE_ADDR'])
-    user_id = request.user.id
     message = data['message']
-    # save a message to database
-    serializer = MessageSerializer(data={'owner': user_id, 'text': message, 'from_ai': False})
-    if serializer.is_valid():
-        serializer.save()
-    else:
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    if not str(message).strip():
+        return Response({'error': 'message can not be blank'}, status=status.HTTP_400_BAD_REQUEST)
     # send a message to AI
     ai_response = helpers.get_ai_response(message)
-    # save AI's response to database
-    serializer = MessageSerializer(data={'owner': user_id, 'text': ai_response, 'from_ai': True})
-    if serializer.is_valid():
-        serializer.save()
-        return Response({'message': ai_response}, status=status.HTTP_200_OK)
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-    # return AI's response
+    # save the message and the AI's response to the database together
+    chat.record_turn(request.user, message, ai_response)
+    return Response({'message': ai_response}, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@authentication_classes([SessionAuthentication, BasicAuthentication])
+@permission_classes([IsAuthenticated])
+def search_messages(request, pk):
+    """
+    Full-text search over a user's chat history with the AI, best match first.
+
+    Args:
+        request: information about the request
+            request.query_params:
+                q(str): The words to search for. A word ending in * matches words starting with it.
+                limit(int): Optional. The most results to return, up to CHAT_SEARCH_MAX_RESULTS.
+        pk(int): the user_id as included in the URL
+    Returns:
+        Response:
+            {'results': [{'id', 'text', 'from_ai', 'snippet'}]} with a 200 status code. The snippet
+            is HTML with the matched words wrapped in <mark>.
+            A 400 status code if q has no words or limit is not a number.
+            A 403 status code if the messages belong to another user and the requester is not a manager.
+            A 404 status code if there is no such user.
+    """
+    # Managers are the staff users IsAdminUser lets through to the other manager endpoints
+    if pk != request.user.id and not request.user.is_staff:
+        return Response(status=status.HTTP_403_FORBIDDEN)
+    query = request.query_params.get('q', '')
+    if not query.strip():
+        return Response({'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limit = min(int(request.query_params.get('limit', settings.CHAT_SEARCH_MAX_RESULTS)),
+                    settings.CHAT_SEARCH_MAX_RESULTS)
+    except ValueError:
+        return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+    owner = request.user if pk == request.user.id else get_object_or_404(User, id=pk)
+    return Response({'results': chat.search(owner, query, max(limit, 1))}, status=status.HTTP_200_OK)
 
 
 @api_view(['GET'])
@@ -227,36 +277,37 @@ def send_chat_message(request):
 @permission_classes([IsAuthenticated])
 def get_messages(request, pk, count):
     """
-    Returns the five most recent messages between user and AI.
+    Returns a page of the chat history between the user and the AI, newest first. A page of recent messages
+    takes one query. Paging past the oldest message in the database reads on into the user's archived messages.
 
     Args:
         request: information about the request
+            request.query_params:
+                before_id(int): Optional. Return the messages older than this one.
+                after_id(int): Optional. Return the messages newer than this one.
         pk(int): the user_id as included in the URL
-        count(int): the number of messages to return. if count is 0, return all messages. if count is greater than the number of messages, return all messages. if count is less than the number of messages, that number of messages will be returned.
+        count(int): the number of messages to return, up to CHAT_PAGE_MAX_SIZE. 0 returns the most allowed.
     Returns:
         Response:
-            The five messages serialized
+            {'messages': [message], 'next_cursor': int or None} with a 200 status code. Pass next_cursor
+            back as the same parameter to read the next page. It is None when there are no more messages.
+            A 400 status code if before_id or after_id is not a number, or both are given.
+            A 403 status code if the messages belong to another user.
     """
     if pk != request.user.id:
         return Response(status=status.HTTP_403_FORBIDDEN)
-    user = get_object_or_404(User, id=pk)
-    if user is None:
-        return Response(status=status.HTTP_400_BAD_REQUEST)
     try:
-        messages = Message.objects.filter(owner=user).order_by('-id')
-        new_messages = []
-        if count == 0:
-            new_messages = messages
-        else:
-            for i in range(len(messages)):
-                m = messages[i]
-                new_messages.append(m)
-                if i == count - 1:
-                    break
-    except Message.DoesNotExist:
-        return Response(status=status.HTTP_400_BAD_REQUEST)
-    serializer = MessageSerializer(new_messages, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+        before_id, after_id = (
+            int(request.query_params[name]) if request.query_params.get(name) else None
+            for name in ('before_id', 'after_id')
+        )
+    except ValueError:
+        return Response({'error': 'before_id and after_id must be numbers'}, status=status.HTTP_400_BAD_REQUEST)
+    if before_id is not None and after_id is not None:
+        return Response({'error': 'give before_id or after_id, not both'}, status=status.HTTP_400_BAD_REQUEST)
+    limit = settings.CHAT_PAGE_MAX_SIZE if count == 0 else min(count, settings.CHAT_PAGE_MAX_SIZE)
+    messages, next_cursor = archive.read_page(request.user, limit, before_id, after_id)
+    return Response({'messages': messages, 'next_cursor': next_cursor}, status=status.HTTP_200_OK)
 
 
 @api_view(['GET', 'POST'])
@@ -311,7 +362,6 @@ def rate_dater(request):
             Saved Feedback serialized
     """
     data = request.data
-    helpers.update_user_location(request.user, request.META['REMOTE_ADDR'])
     owner = request.user.id
     target = data['dater_id']
     gig = data['gig_id']
@@ -399,7 +449,6 @@ def dater_transfer(request):
             OK
     """
     data = request.data
-    data['location'] = helpers.get_location_string(request.META['REMOTE_ADDR'])
     dater = get_object_or_404(Dater, user=request.user)
     card = get_object_or_404(PaymentCard, id=data['card_id'])
     if dater is None or card is None:
@@ -435,7 +484,6 @@ def save_card(request):
     """
 
     data = request.data
-    helpers.update_user_location(request.user, request.META['REMOTE_ADDR'])
     data['user'] = request.user.id
     serializer = PaymentCardSerializer(data=data)
     return helpers.save_serializer(serializer)
@@ -515,7 +563,7 @@ def set_dater_profile(request):
     """
     data = request.data
     data['user'] = request.user.id
-    data['location'] = helpers.get_location_string(request.META['REMOTE_ADDR'])
+    data['location'] = helpers.get_request_location(request)
     dater = get_object_or_404(Dater, user_id=request.user.id)
     serializer = DaterSerializer(dater, data=data)
     user_serializer = UserSerializer(request.user, data=data, partial=True)
@@ -546,7 +594,6 @@ def rate_cupid(request):
             Saved Feedback serialized
     """
     data = request.data
-    helpers.update_user_location(request.user, request.META['REMOTE_ADDR'])
     owner = request.user.id
     target = data['cupid_id']
     gig = get_object_or_404(Gig, id=data['gig_id'])
@@ -641,7 +688,6 @@ def cupid_transfer(request):
             If the transfer went through successfully, return a 200 status code.
             If the transfer failed, return a corresponding error status code (400 if on our end, 500 if on bank's end)
     """
-    helpers.update_user_location(request.user, request.META['REMOTE_ADDR'])
     cupid = get_object_or_404(Cupid, user_id=request.user.id)
     bank_account = get_object_or_404(BankAccount, user=cupid.user)
     amount = cupid.cupid_cash_balance
@@ -669,7 +715,6 @@ def save_bank_account(request):
 
     """
     data = request.data
-    helpers.update_user_location(request.user, request.META['REMOTE_ADDR'])
     data['user'] = request.user.id
     serializer = BankAccountSerializer(data=data)
     return helpers.save_serializer(serializer)
@@ -730,7 +775,7 @@ def set_cupid_profile(request):
             If the profile failed to be created or changed (insufficent permissions, bad data, or error), return a 400 status code.
     """
     data = request.data
-    data['location'] = helpers.get_location_string(request.META['REMOTE_ADDR'])
+    data['location'] = helpers.get_request_location(request)
     data['user'] = request.user.id
     cupid = get_object_or_404(Cupid, user_id=request.user.id)
     serializer = CupidSerializer(cupid, data=data)
@@ -761,53 +806,71 @@ def create_gig(request):
 
     Returns:
         Response:
-            If the gig was created correctly, return a 200 status code.
+            If the gig was created correctly, return the gig, the ids of the cupids it was offered to
+            (best match first) and a 201 status code.
             If the gig was failed to be created, return a 400 status code.
     """
     data = request.data
-    helpers.update_user_location(request.user, request.META['REMOTE_ADDR'])
     dater = get_object_or_404(Dater, user_id=request.user.id)
-    quest = Quest(budget=data['budget'], pickup_location=data['pickup_location'], items_requested=data['items_requested'])
-    quest.save()
-    gig = Gig(dater=dater, quest=quest, status=Gig.Status.UNCLAIMED, dropped_count=0, accepted_count=0)
-    gig.save()
-    return Response(GigSerializer(gig).data, status=status.HTTP_201_CREATED)
+    # Geocoding can wait on Nominatim, so it is done before the transaction takes the write lock
+    pickup_latitude, pickup_longitude = helpers.get_pickup_coordinates(data['pickup_location'])
+    gig, offers = helpers.save_new_gig(dater, {
+        'budget': data['budget'],
+        'pickup_location': data['pickup_location'],
+        'pickup_latitude': pickup_latitude,
+        'pickup_longitude': pickup_longitude,
+        'items_requested': data['items_requested'],
+    })
+    return_data = GigSerializer(gig).data
+    return_data['offers'] = [offer.cupid_id for offer in offers]
+    return Response(return_data, status=status.HTTP_201_CREATED)
 
 @api_view(['POST'])
 @authentication_classes([SessionAuthentication, BasicAuthentication])
 @permission_classes([IsAuthenticated])
+@retry_on_locked
+@transaction.atomic
 def accept_gig(request):
     """
     Modifies the gig to show that it has been accepted by a Cupid.
 
+    The gig is claimed with a single conditional update, so when several cupids accept the
+    same gig at once exactly one of them gets it.
+
     Args:
         request: Information about the request.
             request.post: The json data sent to the server.
                 gig_id (int): The id of the gig to accept.
     Returns:
         Response:
-            If the gig was successfully accepted, return a 200 status code.
-            If the gig could not be accepted or was already accepted, return a 400 status code.
+            If the gig was successfully accepted, return the gig with a 200 status code.
+            If the user is not a cupid, return a 403 status code.
+            If the gig was already claimed, return an error message and a 409 status code.
     """
     data = request.data
-    data['location'] = helpers.get_location_string(request.META['REMOTE_ADDR'])
-    gig = get_object_or_404(Gig, id=data['gig_id'])
-    serializer = GigSerializer(
-        gig,
-        data={
-            'status': Gig.Status.CLAIMED,
-            'cupid': request.user.id,
-            'accepted_count': gig.accepted_count + 1,
-            'date_time_of_claim': make_aware(datetime.now()),
-        },
-        partial=True,
+    if not Cupid.objects.filter(user_id=request.user.id).exists():
+        return Response(status=status.HTTP_403_FORBIDDEN)
+    claimed = Gig.objects.filter(id=data['gig_id'], status=Gig.Status.UNCLAIMED).update(
+        status=Gig.Status.CLAIMED,
+        cupid_id=request.user.id,
+        accepted_count=F('accepted_count') + 1,
+        date_time_of_claim=make_aware(datetime.now()),
+        expires_at=None,
     )
-    return helpers.retrieved_response(serializer)
+    gig = get_object_or_404(Gig.objects.select_related('quest'), id=data['gig_id'])
+    if not claimed:
+        return Response({'error': 'gig has already been claimed'}, status=status.HTTP_409_CONFLICT)
+    events.record(gig, GigEvent.Type.CLAIMED)
+    expiry.forget(gig.id)
+    gigfeed.publish_gig(gigfeed.CLAIMED, gig)
+    return Response(GigSerializer(gig).data, status=status.HTTP_200_OK)
 
 
 @api_view(['POST'])
 @authentication_classes([SessionAuthentication, BasicAuthentication])
 @permission_classes([IsAuthenticated])
+@retry_on_locked
+@transaction.atomic
 def complete_gig(request):
     """
     Modifies the gig to show that it has been completed.
@@ -822,7 +885,6 @@ def complete_gig(request):
             If the gig could not be completed or was already completed, return a 400 status code.
     """
     data = request.data
-    data['location'] = helpers.get_location_string(request.META['REMOTE_ADDR'])
     gig = get_object_or_404(Gig, id=data['gig_id'])
     serializer = GigSerializer(
         gig,
@@ -838,6 +900,7 @@ def complete_gig(request):
         gig.cupid.cupid_cash_balance += reward
         gig.cupid.gigs_completed += 1
         gig.cupid.save()
+        events.record(gig, GigEvent.Type.COMPLETED, reward=float(reward))
         return_data = serializer.data
         return_data['reward'] = reward
         return Response(return_data, status=status.HTTP_201_CREATED)
@@ -847,6 +910,8 @@ def complete_gig(request):
 @api_view(['POST'])
 @authentication_classes([SessionAuthentication, BasicAuthentication])
 @permission_classes([IsAuthenticated])
+@retry_on_locked
+@transaction.atomic
 def drop_gig(request):
     """
     Modifies the gig to show that it is no longer claimed by a Cupid. Cupid is no longer in charge of the gig.
@@ -861,11 +926,10 @@ def drop_gig(request):
             If the gig could not be dropped, was already dropped, or does not have a Cupid assigned, return a 400 status code.
     """
     data = request.data
-    # This doesn't do much, should update the cupid's location instead
-    data['location'] = helpers.get_location_string(request.META['REMOTE_ADDR'])
     gig = get_object_or_404(Gig, id=data['gig_id'])
     if gig.cupid != request.user.cupid:
         return Response(status=status.HTTP_403_FORBIDDEN)
+    cupid_id = gig.cupid_id
     serializer = GigSerializer(
         gig,
         data={
@@ -877,12 +941,20 @@ def drop_gig(request):
     )
     gig.cupid.gigs_failed += 1
     gig.cupid.save()
-    return helpers.retrieved_response(serializer)
+    response = helpers.retrieved_response(serializer)
+    if response.status_code == status.HTTP_200_OK:
+        # Back up for grabs
+        events.record(gig, GigEvent.Type.DROPPED, dropped_by=cupid_id)
+        expiry.schedule(gig)
+        gigfeed.publish_gig(gigfeed.DROPPED, gig)
+    return response
 
 
 @api_view(['POST'])
 @authentication_classes([SessionAuthentication, BasicAuthentication])
 @permission_classes([IsAuthenticated])
+@retry_on_locked
+@transaction.atomic
 def cancel_gig(request):
     """
     Deletes the gig.
@@ -900,6 +972,9 @@ def cancel_gig(request):
     gig = get_object_or_404(Gig, id=data['gig_id'])
     if gig.dater != request.user.dater:
         return Response(status=status.HTTP_403_FORBIDDEN)
+    events.record(gig, GigEvent.Type.CANCELLED)
+    expiry.forget(gig.id)
+    gigfeed.publish_gig(gigfeed.CANCELLED, gig)
     gig.delete()
     return Response(GigSerializer(gig).data, status=status.HTTP_200_OK)
 
@@ -917,24 +992,23 @@ def get_cupid_gigs(request, pk):
         pk (int): The id of the cupid
         query string:
             complete(bool): Should return cupid's completed or cupid's claimed
+            ordering(str): Optional. One of CUPID_GIG_ORDERING, '-' first for descending. Defaults to id.
+            limit(int), offset(int): Optional. Return a page of gigs instead of all of them.
     Returns:
         Response:
-            A list of gigs (JSON)
+            A list of gigs (JSON), or {'count', 'next', 'previous', 'results'} when paged
     """
     cupid = get_object_or_404(Cupid, user_id=pk)
-    helpers.update_user_location(cupid.user, request.META['REMOTE_ADDR'])
-    gigs = get_list_or_404(Gig, cupid=cupid)
     target = Gig.Status.COMPLETE if request.GET['complete'] == 'true' else Gig.Status.CLAIMED
-    current_gigs = []
-    for gig in gigs:
-        if gig.status == target:
-            current_gigs.append(gig)
-    serializer = GigSerializer(current_gigs, many=True)
-    for gig in serializer.data:
-        user = User.objects.get(id=gig['dater'])
-        gig['dater'] = f'{user.first_name} {user.last_name}'
-        gig['dater_id'] = user.id
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    ordering = ordering_from(request, CUPID_GIG_ORDERING, 'id')
+    gigs = Gig.objects.filter(cupid=cupid, status=target).select_related('quest').annotate(
+        dater_name=Concat('dater__user__first_name', Value(' '), 'dater__user__last_name'),
+    ).order_by(ordering)
+    paginator = GigLimitOffsetPagination()
+    page = paginator.paginate_queryset(gigs, request)
+    if page is not None:
+        return paginator.get_paginated_response(CupidGigSerializer(page, many=True).data)
+    return Response(CupidGigSerializer(gigs, many=True).data, status=status.HTTP_200_OK)
 
 
 @api_view(['GET'])
@@ -943,27 +1017,32 @@ def get_cupid_gigs(request, pk):
 def get_dater_gigs(request, pk):
     """
     For a dater.
-    Returns all gigs that the dater has created.
+    Returns the gigs that the dater has created, newest first, a page at a time.
 
     Args:
         request: Information about the request.
-        pk (int): The id of the cupid
+        pk (int): The id of the dater
+        query string:
+            status(str): Optional. Comma separated gig statuses to include, e.g. 0,1
+            cursor(str): Optional. The page to return, taken from a previous response's next or previous link.
+            page_size(int): Optional. How many gigs per page, up to 100.
     Returns:
         Response:
-            A list of gigs (JSON)
+            {'next', 'previous', 'results'} where results is a list of gigs (JSON)
+            If the status filter is invalid, return an error message and a 400 status code.
     """
     dater = get_object_or_404(Dater, user_id=pk)
-    helpers.update_user_location(dater.user, request.META['REMOTE_ADDR'])
-    gigs = get_list_or_404(Gig, dater=dater)
-    serializer = GigSerializer(gigs, many=True)
-    for gig in serializer.data:
+    gigs = Gig.objects.filter(dater=dater).select_related('quest', 'cupid__user')
+    if request.GET.get('status'):
         try:
-            user = User.objects.get(id=gig['cupid'])
-            gig['cupid'] = f'{user.first_name} {user.last_name}'
-            gig['cupid_id'] = user.id
-        except User.DoesNotExist:
-            gig['cupid'] = ''  # Leave blank for frontend code
-    return Response(serializer.data, status=status.HTTP_200_OK)
+            statuses = [int(value) for value in request.GET['status'].split(',')]
+        except ValueError:
+            return Response({'error': 'status must be a comma separated list of numbers'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        gigs = gigs.filter(status__in=statuses)
+    paginator = DaterGigCursorPagination()
+    page = paginator.paginate_queryset(gigs, request)
+    return paginator.get_paginated_response(DaterGigSerializer(page, many=True).data)
 
 
 @api_view(['GET'])
@@ -982,20 +1061,58 @@ def get_gigs(request, pk, count):
             A list of gigs (JSON)
     """
     cupid = get_object_or_404(Cupid, user_id=pk)
-    helpers.update_user_location(cupid.user, request.META['REMOTE_ADDR'])
-    gigs = Gig.objects.all()
-    near_gigs = []
-    for gig in gigs:
-        quest = gig.quest
-        if gig.status == Gig.Status.UNCLAIMED and (helpers.locations_are_near(
-            quest.pickup_location, cupid.location, cupid.gig_range) or count == 0):
-            near_gigs.append(gig)
-    if count != 0:
-        near_gigs = near_gigs[:count]
+    gigs = Gig.objects.filter(status=Gig.Status.UNCLAIMED).select_related('quest')
+    if count == 0:
+        near_gigs = list(gigs)
+    else:
+        near_gigs = helpers.gigs_near(gigs, cupid.location, cupid.gig_range)[:count]
     serializer = GigSerializer(near_gigs, many=True)
     return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+def gig_feed(request, pk):
+    """
+    For a cupid.
+    Streams gigs as server-sent events while the connection is open: gig.created and gig.dropped
+    when a gig near the cupid becomes available, gig.claimed and gig.cancelled when it stops being.
+
+    Args:
+        request: Information about the request.
+        pk (int): The id of the cupid
+        query string:
+            latitude(float), longitude(float): Optional. Where to watch from. Defaults to the cupid's location.
+            range(float): Optional. How many miles around that point to watch. Defaults to the cupid's gig range.
+    Returns:
+        StreamingHttpResponse:
+            A text/event-stream of gig events, each with the gig (JSON) as its data.
+            A 403 status code if the requester is not this cupid, a 404 if there is no such cupid,
+            and a 400 if no location is known.
+    """
+    user = request.user
+    if not user.is_authenticated or user.id != pk:
+        return JsonResponse({'error': 'forbidden'}, status=status.HTTP_403_FORBIDDEN)
+    cupid = Cupid.objects.filter(user_id=pk).first()
+    if cupid is None:
+        return JsonResponse({'error': 'cupid not found'}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        if 'latitude' in request.GET and 'longitude' in request.GET:
+            coordinates = float(request.GET['latitude']), float(request.GET['longitude'])
+        else:
+            coordinates = parse_location(cupid.location)
+        gig_range = float(request.GET.get('range', cupid.gig_range))
+    except ValueError:
+        coordinates = None
+    if coordinates is None:
+        return JsonResponse({'error': 'a location is required'}, status=status.HTTP_400_BAD_REQUEST)
+    # An ASGI server needs an async iterator to send events as they come
+    feed = gigfeed.async_event_stream if isinstance(request, ASGIRequest) else gigfeed.event_stream
+    stream = feed(coordinates[0], coordinates[1], gig_range)
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @api_view(['GET'])
 @authentication_classes([SessionAuthentication, BasicAuthentication])
 @permission_classes([IsAuthenticated])
@@ -1078,6 +1195,30 @@ def get_restaurants(request, pk):
     return helpers.get_response_from_yelp_api(pk, request, 'restaurants')
 
 
+@api_view(['GET'])
+@authentication_classes([SessionAuthentication, BasicAuthentication])
+@permission_classes([IsAuthenticated])
+def explore_nearby(request, pk):
+    """
+    Looks up several kinds of places near the dater at once (stores, activities, events, attractions
+    and restaurants). The lookups run concurrently, and a category that is too slow is left out
+    instead of holding up the rest.
+
+    Args:
+        request: Information about the request.
+            query string:
+                categories(str): Comma separated categories to look up. Defaults to all of them.
+        pk (int): The id of the dater.
+    Returns:
+        Response:
+            results: The places found for each category that answered in time.
+            errors: Why each missing category has no results.
+            If at least one category was retrieved, return a 200 status code.
+            If no category was retrieved or a category is unknown, return a 400 status code.
+    """
+    return helpers.get_explore_response(pk, request)
+
+
 @api_view(['GET'])
 @authentication_classes([SessionAuthentication, BasicAuthentication])
 @permission_classes([IsAuthenticated])
@@ -1266,11 +1407,8 @@ def get_gig_rate(request):
             If the rate of gigs per hour was not retrieved successfully, return an error message and a 400 status code.
     """
     try:
-        yesterday = datetime.now() - datetime.timedelta(days=1)
-        gigs_from_past_day = Gig.objects.filter(date_time_of_request__range=(yesterday, datetime.now()))
-        if gigs_from_past_day is None:
-            return Response(status=status.HTTP_400_BAD_REQUEST)
-        gig_rate = gigs_from_past_day.count() / 24
+        # Counted from the hourly activity the gig event log is projected into in the background
+        gig_rate = events.recent_activity(hours=24)[GigEvent.Type.CREATED] / 24
         return Response(data={"gig_rate": gig_rate}, status=status.HTTP_200_OK)
     except Exception as e:
         return Response({'error': e}, status=status.HTTP_400_BAD_REQUEST)
@@ -1314,13 +1452,10 @@ def get_gig_drop_rate(request):
             If the rate of gigs that are dropped was not retrieved successfully, return an error message and a 400 status code.
     """
     try:
-        number_of_drops = 0
-        yesterday = datetime.now() - datetime.timedelta(days=1)
-        gigs_from_past_day = Gig.objects.filter(date_time_of_request__range=(yesterday, datetime.now()))
-        if gigs_from_past_day is None:
-            return Response(status.HTTP_400_BAD_REQUEST)
-        for gig in gigs_from_past_day:
-            number_of_drops += gig.dropped_count
+        yesterday = make_aware(datetime.now()) - timedelta(days=1)
+        number_of_drops = Gig.objects.filter(date_time_of_request__gte=yesterday).aggregate(
+            drops=Sum('dropped_count'),
+        )['drops'] or 0
         drop_rate = number_of_drops / 24
         return Response(data={"drop_rate": drop_rate}, status=status.HTTP_200_OK)
 
@@ -1412,6 +1547,54 @@ def unsuspend(request):
     return helpers.retrieved_response(serializer)
 
 
+@api_view(['POST'])
+@authentication_classes([SessionAuthentication, BasicAuthentication])
+@permission_classes([IsAuthenticated, IsAdminUser])
+def broadcast(request):
+    """
+    Manager can send a message to every user matching a filter. The broadcast is sent in the background.
+
+    Args:
+        request: Information about the request.
+            request.post: The json data sent to the server.
+                message (str): The message to send.
+                filters (dict): Optional. Which users to send to: role ('dater' or 'cupid'),
+                    suspended (bool), region ({latitude, longitude, radius_miles}) and
+                    channel ('preferred', 'email' or 'text').
+    Returns:
+        Response:
+            The broadcast (JSON) with a 202 status code.
+            If the message or filters are invalid, return an error message and a 400 status code.
+    """
+    message = request.data.get('message')
+    filters = request.data.get('filters') or {}
+    if not message:
+        return Response({'error': 'message is required'}, status=status.HTTP_400_BAD_REQUEST)
+    error = broadcasts.validate_filters(filters)
+    if error is not None:
+        return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+    sent = broadcasts.start(request.user, message, filters)
+    return Response(BroadcastSerializer(sent).data, status=status.HTTP_202_ACCEPTED)
+
+
+@api_view(['GET'])
+@authentication_classes([SessionAuthentication, BasicAuthentication])
+@permission_classes([IsAuthenticated, IsAdminUser])
+def get_broadcast(request, pk):
+    """
+    Returns a broadcast and how far it has got.
+
+    Args:
+        request: Information about the request.
+        pk (int): The id of the broadcast.
+    Returns:
+        Response:
+            The broadcast (JSON) with a 200 status code.
+    """
+    sent = get_object_or_404(Broadcast, id=pk)
+    return Response(BroadcastSerializer(sent).data, status=status.HTTP_200_OK)
+
+
 @api_view(['POST'])
 @authentication_classes([SessionAuthentication, BasicAuthentication])
 @permission_classes([IsAuthenticated])
@@ -1464,6 +1647,7 @@ def speech_to_text(request):
 def notify(request):
     """
     Notify a user (any type) of something via a text or email depending on their communication preference.
+    The notification is queued and sent in the background.
 
     Args:
         request: Information about the request.
@@ -1472,17 +1656,105 @@ def notify(request):
                 message (str): The message to send to the user.
     Returns:
         Response:
-            If the message was sent successfully, return a 200 status code.
-            If the message was not sent successfully, return an error message and a 400 status code.
+            If the message was queued, return its id and status with a 202 status code. Messages sent
+            close together are merged into one notification, in which case `merged` is true.
+            If the user has no valid communication preference, return a 400 status code.
+            If the user has been sent too many notifications lately, return a 429 status code.
     """
     data = request.data
     dater = get_object_or_404(Dater, user_id=data['user_id'])
-    account_sid = helpers.get_twilio_account_sid()
-    auth_token = helpers.get_twilio_auth_token()
-    message = data['message']
-    if dater.communication_preference == 0:
-        return helpers.send_email(dater, message)
-    elif dater.communication_preference == 1:
-        return helpers.send_text(account_sid, auth_token, message)
-    else:
+    if dater.communication_preference not in Notification.Channel.values:
         return Response(status=status.HTTP_400_BAD_REQUEST)
+    notification = notifications.enqueue(dater.user, dater.communication_preference, data['message'])
+    if notification is None:
+        return Response({'error': 'too many notifications for this user'}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+    return Response(
+        {'notification_id': notification.id, 'status': notification.status, 'merged': notification.merged_count > 0},
+        status=status.HTTP_202_ACCEPTED,
+    )
+
+
+@api_view(['GET'])
+@authentication_classes([SessionAuthentication, BasicAuthentication])
+@permission_classes([IsAuthenticated])
+def get_notification(request, pk):
+    """
+    Returns the delivery status of a notification.
+
+    Args:
+        request: Information about the request.
+        pk (int): The id of the notification.
+    Returns:
+        Response:
+            The notification (JSON) with a 200 status code.
+            A 403 status code if it belongs to another user and the requester is not a manager.
+    """
+    notification = get_object_or_404(Notification, id=pk)
+    # Managers are the staff users IsAdminUser lets through to the other manager endpoints
+    if notification.user_id != request.user.id and not request.user.is_staff:
+        return Response(status=status.HTTP_403_FORBIDDEN)
+    return Response(NotificationSerializer(notification).data, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@authentication_classes([SessionAuthentication, BasicAuthentication])
+@permission_classes([IsAuthenticated, IsAdminUser])
+def get_notification_stats(request):
+    """
+    Returns how many notifications are in each delivery status, and how many this server
+    process has queued, merged and suppressed since it started.
+
+    Args:
+        request: Information about the request.
+    Returns:
+        Response:
+            {'statuses': {status: count}, 'queued': int, 'merged': int, 'suppressed': int} with a 200 status code.
+    """
+    statuses = dict(Notification.objects.values_list('status').annotate(count=Count('id')))
+    return Response({'statuses': statuses, **notifications.get_stats()}, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@authentication_classes([SessionAuthentication, BasicAuthentication])
+@permission_classes([IsAuthenticated, IsAdminUser])
+def get_gig_events(request):
+    """
+    Reads the gig event log in order, starting after an offset.
+
+    Args:
+        request: Information about the request.
+            request.query_params:
+                after (int): The offset to read after. Defaults to 0, the start of the log.
+                limit (int): The most events to return, up to GIG_EVENT_BATCH_SIZE.
+    Returns:
+        Response:
+            {'events': [event], 'next_offset': int} with a 200 status code. Pass next_offset as
+            `after` to read the events that follow.
+            A 400 status code if after or limit is not a number.
+    """
+    try:
+        after = int(request.query_params.get('after', 0))
+        limit = min(int(request.query_params.get('limit', settings.GIG_EVENT_BATCH_SIZE)), settings.GIG_EVENT_BATCH_SIZE)
+    except ValueError:
+        return Response({'error': 'after and limit must be numbers'}, status=status.HTTP_400_BAD_REQUEST)
+    page = events.read(after, max(limit, 1))
+    return Response(
+        {'events': GigEventSerializer(page, many=True).data, 'next_offset': page[-1].id if page else after},
+        status=status.HTTP_200_OK,
+    )
+
+
+@api_view(['GET'])
+@authentication_classes([SessionAuthentication, BasicAuthentication])
+@permission_classes([IsAuthenticated, IsAdminUser])
+def get_gig_activity(request):
+    """
+    Returns how many gigs were created, claimed, dropped, completed and cancelled over the last day.
+
+    Args:
+        request: Information about the request.
+    Returns:
+        Response:
+            {event type: count} with a 200 status code.
+    """
+    return Response(events.recent_activity(hours=24), status=status.HTTP_200_OK)
@@ -0,0 +1,130 @@
+"""
+Measures the per-message cost of sending texts and emails with a new Twilio/SendGrid client
+for every message (how send_text and send_email used to work) against the pooled clients in
+api.messaging.
+
+Both run against a local fake Twilio/SendGrid server. The server waits --connect-ms on every
+new connection to stand in for the TCP and TLS handshake a real provider needs, which is the
+cost the pooled clients avoid.
+
+Usage (from Code/server):
+    python benchmarks/notification_clients.py --messages 200 --connect-ms 30
+"""
+# Standard Library
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+os.environ.update({
+    'TWILIO_ACCOUNT_SID': 'AC00000000000000000000000000000000',
+    'TWILIO_AUTH_TOKEN': 'token',
+    'TWILIO_SENDER_PHONE_NUMBER': '+15550000000',
+    'TWILIO_RESERVE_PHONE_NUMBER': '+15550000001',
+    'TWILIO_SENDER_EMAIL': 'sender@example.com',
+    'GRID_API_KEY': 'key',
+})
+
+# Django
+import django
+
+django.setup()
+
+# Django
+from django.conf import settings
+
+# Miscellaneous Utils
+from sendgrid import SendGridAPIClient
+from sendgrid.helpers.mail import Mail
+from twilio.rest import Client
+
+# Local
+from api import messaging
+
+
+class FakeProviderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connect_delay = 0
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        # Answer in one packet instead of waiting on the client's delayed ACK
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        FakeProviderHandler.connections += 1
+        time.sleep(self.connect_delay)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path.startswith('/v3/mail/send'):
+            self.send_response(202)
+            self.send_header('X-Message-Id', 'fake-message-id')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = json.dumps({'sid': 'SM00000000000000000000000000000000', 'status': 'queued'}).encode()
+        self.send_response(201)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def send_text_unpooled(base_url):
+    client = Client(os.environ['TWILIO_ACCOUNT_SID'], os.environ['TWILIO_AUTH_TOKEN'])
+    client.api.base_url = base_url
+    return client.messages.create(from_='+15550000000', body='hello', to='+15550000001').sid
+
+
+def send_email_unpooled(base_url):
+    mail = Mail(from_email='sender@example.com', to_emails='dater@example.com',
+                subject='Notification from Cupid Code', html_content='hello')
+    return SendGridAPIClient(os.environ['GRID_API_KEY'], host=base_url).send(mail)
+
+
+def measure(name, send, messages):
+    FakeProviderHandler.connections = 0
+    start = time.perf_counter()
+    for _ in range(messages):
+        send()
+    elapsed = time.perf_counter() - start
+    print(f'{name:<18} {elapsed / messages * 1000:8.2f} ms/message '
+          f'{FakeProviderHandler.connections:6d} connections')
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--connect-ms', type=float, default=30.0)
+    args = parser.parse_args()
+
+    FakeProviderHandler.connect_delay = args.connect_ms / 1000
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeProviderHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    settings.TWILIO_API_BASE_URL = base_url
+    settings.SENDGRID_API_HOST = base_url
+    messaging.clients.close()
+
+    print(f'{args.messages} messages, {args.connect_ms:g} ms per new connection')
+    text_before = measure('text, new client', lambda: send_text_unpooled(base_url), args.messages)
+    text_after = measure('text, pooled', lambda: messaging.send_text_message('hello'), args.messages)
+    email_before = measure('email, new client', lambda: send_email_unpooled(base_url), args.messages)
+    email_after = measure('email, pooled',
+                          lambda: messaging.send_email_message('dater@example.com', 'hello'), args.messages)
+    print(f'text speedup {text_before / text_after:.1f}x, email speedup {email_before / email_after:.1f}x')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Measures chat read and write throughput with many connections using one SQLite file at once, under
+the 'development' database profile (stock SQLite) and the 'production' one (WAL, synchronous=NORMAL,
+a bigger cache, mmap and a longer busy timeout) from server/settings.py.
+
+Writer threads save chat turns, two messages in one IMMEDIATE transaction like chat.save_turn.
+Reader threads read pages of a user's history like get_messages. Every thread has its own
+connection, opened with the profile's options the way Django opens one.
+
+Usage (from Code/server):
+    python benchmarks/sqlite_concurrency.py --writers 4 --readers 8 --seconds 5
+"""
+# Standard Library
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
+
+# Django
+import django
+
+django.setup()
+
+# Django
+from django.conf import settings
+
+USERS = 200
+SCHEMA = [
+    'CREATE TABLE api_message (id integer NOT NULL PRIMARY KEY AUTOINCREMENT, text text NOT NULL, '
+    'from_ai bool NOT NULL, owner_id bigint NOT NULL, date_time_created datetime NOT NULL)',
+    'CREATE INDEX message_owner_newest_idx ON api_message (owner_id, id DESC)',
+]
+INSERT_SQL = "INSERT INTO api_message (text, from_ai, owner_id, date_time_created) VALUES (?, ?, ?, datetime('now'))"
+PAGE_SQL = 'SELECT id, text, from_ai FROM api_message WHERE owner_id = ? ORDER BY id DESC LIMIT 21'
+
+
+def connect(path, options):
+    # What django.db.backends.sqlite3 does with the OPTIONS of a database
+    connection = sqlite3.connect(path, timeout=options.get('timeout', 5), isolation_level=None, check_same_thread=False)
+    for command in options.get('init_command', '').split(';'):
+        if command.strip():
+            connection.execute(command)
+    return connection
+
+
+def create_database(path, options, messages):
+    connection = connect(path, options)
+    for statement in SCHEMA:
+        connection.execute(statement)
+    connection.execute('BEGIN')
+    connection.executemany(INSERT_SQL, (
+        (f'message {number}', number % 2, number % USERS + 1) for number in range(messages)
+    ))
+    connection.execute('COMMIT')
+    connection.close()
+
+
+class Counter:
+    def __init__(self):
+        self.done = 0
+        self.locked = 0
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        with self._lock:
+            self.done += 1
+            self.latencies.append(latency)
+
+    def record_locked(self):
+        with self._lock:
+            self.locked += 1
+
+    def percentile(self, fraction):
+        if not self.latencies:
+            return 0
+        latencies = sorted(self.latencies)
+        return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] * 1000
+
+
+def write_turns(connection, counter, stop):
+    while not stop.is_set():
+        owner_id = random.randint(1, USERS)
+        start = time.perf_counter()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany(INSERT_SQL, [('Hello', False, owner_id), ('Hi there', True, owner_id)])
+            connection.execute('COMMIT')
+        except sqlite3.OperationalError:
+            # "database is locked" after the busy timeout
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            counter.record_locked()
+            continue
+        counter.record(time.perf_counter() - start)
+
+
+def read_pages(connection, counter, stop):
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            connection.execute(PAGE_SQL, (random.randint(1, USERS),)).fetchall()
+        except sqlite3.OperationalError:
+            counter.record_locked()
+            continue
+        counter.record(time.perf_counter() - start)
+
+
+def measure(profile, args):
+    options = settings.SQLITE_PROFILES[profile]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.sqlite3')
+        create_database(path, options, args.messages)
+        writes, reads = Counter(), Counter()
+        stop = threading.Event()
+        workers = [
+            (work, counter, connect(path, options))
+            for work, counter, count in ((write_turns, writes, args.writers), (read_pages, reads, args.readers))
+            for _ in range(count)
+        ]
+        threads = [threading.Thread(target=work, args=(connection, counter, stop)) for work, counter, connection in workers]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        for _, _, connection in workers:
+            connection.close()
+    print(f'{profile:<12} {writes.done / args.seconds:9.0f} turns/s  p95 {writes.percentile(0.95):7.1f} ms  '
+          f'{writes.locked:5d} locked  | {reads.done / args.seconds:9.0f} pages/s  '
+          f'p95 {reads.percentile(0.95):7.1f} ms  {reads.locked:5d} locked')
+    return writes.done, reads.done
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--messages', type=int, default=100000, help='Messages in the table before the run')
+    args = parser.parse_args()
+
+    print(f'{args.writers} writers, {args.readers} readers, {args.seconds:g} s, {args.messages} messages to start')
+    writes_before, reads_before = measure('development', args)
+    writes_after, reads_after = measure('production', args)
+    print(f'writes {writes_after / max(writes_before, 1):.1f}x, reads {reads_after / max(reads_before, 1):.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,8 @@ import requests
 import os
 from django.http import StreamingHttpResponse
 
+from api.helpers import refresh_session_location
+
 
 def asset_proxy_middleware(next):
     def middleware(request):
@@ -24,3 +26,16 @@ def asset_proxy_middleware(next):
         return next(request)
 
     return middleware
+
+
+def location_middleware(next):
+    def middleware(request):
+        # Only API requests from signed in sessions need to know where the user is. Anonymous and
+        # BasicAuth requests are located by the views that need it, without starting a session.
+        if request.path.startswith('/api/') and request.user.is_authenticated:
+            request.location = refresh_session_location(request)
+
+        # call next middleware
+        return next(request)
+
+    return middleware
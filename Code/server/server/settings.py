@@ -60,6 +60,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.location_middleware',
 ]
 
 INTERNAL_IPS = [
@@ -93,13 +94,74 @@ WSGI_APPLICATION = 'server.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
+# 'development' is stock SQLite. 'production' switches to write-ahead logging, so reads don't wait
+# on writes, and tunes SQLite for many concurrent requests. Choose with the DATABASE_PROFILE variable.
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'development')
+SQLITE_PROFILES = {
+    'development': {},
+    'production': {
+        # How many seconds to wait for another connection's write lock before "database is locked"
+        'timeout': 20,
+        'init_command': ';'.join([
+            # Readers keep reading the last commit while a writer appends to the log
+            'PRAGMA journal_mode=WAL',
+            # Syncs at checkpoints only. With WAL a power cut can lose the last commits but not corrupt the file.
+            'PRAGMA synchronous=NORMAL',
+            # 64 MiB of page cache per connection (negative sizes are in KiB)
+            'PRAGMA cache_size=-65536',
+            # Reads the first 256 MiB of the file through a memory map instead of read() calls
+            'PRAGMA mmap_size=268435456',
+            # Sorts and temporary indexes stay in memory
+            'PRAGMA temp_store=MEMORY',
+        ]),
+    },
+}
+SQLITE_OPTIONS = {
+    # Gig transitions read and then write in one transaction. Taking the write lock when the
+    # transaction starts makes concurrent ones wait their turn instead of failing with
+    # "database is locked" when they try to upgrade a read lock. Chat shards also work out
+    # new message ids inside the insert's transaction.
+    'transaction_mode': 'IMMEDIATE',
+    **SQLITE_PROFILES[DATABASE_PROFILE],
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': dict(SQLITE_OPTIONS),
+        # A file rather than the in-memory default, so tests that use several threads get
+        # SQLite's normal locking instead of "table is locked" errors from the shared cache
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Write transactions that still find the database locked are run again this many times,
+# waiting the base time doubled after each try up to the max (see api/retry.py)
+SQLITE_LOCKED_RETRIES = 4
+SQLITE_LOCKED_BACKOFF_BASE_SECONDS = 0.05
+SQLITE_LOCKED_BACKOFF_MAX_SECONDS = 1
+
+# Chat messages are spread by owner over this many more databases, chat_0.sqlite3 and up, so chats
+# don't queue behind one another for SQLite's write lock (see api/shards.py). 0 keeps them in the
+# main database. Migrate each one with `python manage.py migrate --database chat_<n>`, and move
+# users onto new shards with `python manage.py rebalance_chat_shards`. Shards can be added but not removed.
+CHAT_SHARDS = int(os.environ.get('CHAT_SHARDS', 0))
+for chat_shard in range(CHAT_SHARDS):
+    DATABASES[f'chat_{chat_shard}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'chat_{chat_shard}.sqlite3',
+        'OPTIONS': dict(SQLITE_OPTIONS),
+        'TEST': {
+            'NAME': BASE_DIR / f'test_chat_{chat_shard}.sqlite3',
+        },
+    }
+DATABASE_ROUTERS = ['api.shards.MessageShardRouter']
+# How long moving a user to another shard waits for chats that started before the move to be written
+CHAT_SHARD_MOVE_GRACE_SECONDS = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -149,3 +211,195 @@ STATIC_URL = 'static/' if not DEBUG else '__UNUSED__/'
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Chat
+
+# The most chat messages returned in one page
+CHAT_PAGE_MAX_SIZE = 100
+# The most results a chat search returns
+CHAT_SEARCH_MAX_RESULTS = 50
+# How chat messages are saved: 'transaction' writes each message and its reply together before
+# responding, 'write_behind' buffers them and writes a batch from every user at once
+CHAT_PERSISTENCE = os.environ.get('CHAT_PERSISTENCE', 'transaction')
+# How often the write-behind buffer is written, and how many messages make it write early
+CHAT_WRITE_BEHIND_SECONDS = 0.5
+CHAT_WRITE_BEHIND_MAX_BATCH = 500
+# The most messages the write-behind buffer holds. Chats past it are written straight away.
+CHAT_WRITE_BEHIND_MAX_SIZE = 10000
+# Messages older than this many days are moved out of the database by the archive_messages command.
+# Archived messages still page in the chat history but are no longer found by chat search.
+CHAT_ARCHIVE_AFTER_DAYS = 90
+CHAT_ARCHIVE_DIR = Path(os.environ.get('CHAT_ARCHIVE_DIR', BASE_DIR / 'chat_archive'))
+# The most messages in one archive file
+CHAT_ARCHIVE_SEGMENT_SIZE = 1000
+# How many decompressed archive files each process keeps in memory
+CHAT_ARCHIVE_CACHED_SEGMENTS = 32
+
+
+# Gig dispatch
+
+# How many cupids a new gig is offered to
+DISPATCH_MAX_OFFERS = 10
+# How many miles of distance one star of rating is worth when ranking cupids
+DISPATCH_RATING_WEIGHT = 2.0
+# Size of the cells in the availability index. About 17 miles of latitude.
+DISPATCH_CELL_SIZE_DEGREES = 0.25
+
+
+# Gig feed
+
+# Size of the cells in the index of open feed connections
+GIG_FEED_CELL_SIZE_DEGREES = 0.25
+# Events a connection can fall behind by before it is closed
+GIG_FEED_QUEUE_SIZE = 100
+# How often an idle connection is sent a comment so proxies don't close it
+GIG_FEED_HEARTBEAT_SECONDS = 15
+# How long a connection stays open before the browser has to reconnect. Under WSGI each open
+# connection holds one of the server's threads.
+GIG_FEED_MAX_SECONDS = 5 * 60
+# How long the browser waits before reconnecting
+GIG_FEED_RETRY_MILLISECONDS = 3000
+
+
+# Gig events
+
+# The most gig events read from the log at a time
+GIG_EVENT_BATCH_SIZE = 500
+# How often new gig events are counted into the hourly activity the manager dashboard reads
+GIG_ACTIVITY_CATCH_UP_SECONDS = 60
+# Count gig activity inside the web process. Turn off when running `manage.py rebuild_gig_activity --follow` instead.
+GIG_ACTIVITY_IN_PROCESS = os.environ.get('GIG_ACTIVITY_IN_PROCESS', 'true').lower() == 'true'
+
+
+# Gig expiry
+
+# Seconds a gig can go unclaimed before the expiry policy acts on it
+GIG_EXPIRY_SECONDS = 30 * 60
+# What happens to a gig nobody claims in time: 'expire' marks it expired, 'reoffer' offers it to
+# the next best cupids, and 'widen' also multiplies the cupids' ranges by GIG_EXPIRY_RANGE_MULTIPLIER
+# each round. A gig that has been offered again GIG_EXPIRY_MAX_REDISPATCHES times expires.
+GIG_EXPIRY_POLICY = os.environ.get('GIG_EXPIRY_POLICY', 'widen')
+GIG_EXPIRY_MAX_REDISPATCHES = 2
+GIG_EXPIRY_RANGE_MULTIPLIER = 1.5
+# How many due gigs are updated at a time
+GIG_EXPIRY_BATCH_SIZE = 500
+# Run the scheduler inside the web process. Turn off when running `manage.py expire_gigs` instead.
+GIG_EXPIRY_IN_PROCESS = os.environ.get('GIG_EXPIRY_IN_PROCESS', 'true').lower() == 'true'
+# How often `manage.py expire_gigs` reads new deadlines from the database
+GIG_EXPIRY_RELOAD_SECONDS = 60
+# How long the scheduler waits after an error before trying again. Doubles with each error in a
+# row, up to GIG_EXPIRY_RELOAD_SECONDS.
+GIG_EXPIRY_RETRY_SECONDS = 5
+
+
+# Location
+
+# How often each session's location is looked up again from its IP address
+LOCATION_REFRESH_SECONDS = 5 * 60
+
+
+# Geocoding
+
+# How many geocoded addresses each process keeps in memory in front of the GeocodedAddress table
+GEOCODE_MEMORY_CACHE_SIZE = 4096
+
+
+# Places
+
+# Where geo searches are answered from: 'yelp', or 'local' for the points of interest file below
+PLACES_PROVIDER = os.environ.get('PLACES_PROVIDER', 'yelp')
+# CSV file or SQLite database of points of interest used by the 'local' provider
+PLACES_LOCAL_PATH = os.environ.get('PLACES_LOCAL_PATH', BASE_DIR / 'api' / 'geodata' / 'places.csv')
+# How far from the dater the 'local' provider looks
+PLACES_LOCAL_RADIUS_MILES = 25
+PLACES_LOCAL_CELL_SIZE_DEGREES = 0.1
+# Threads shared by explore requests for their concurrent searches
+GEO_EXPLORE_MAX_WORKERS = 20
+# How long an explore request waits for each category before returning without it
+GEO_EXPLORE_TIMEOUT_SECONDS = {
+    'stores': 3.0,
+    'activities': 3.0,
+    'events': 3.0,
+    'attractions': 3.0,
+    'restaurants': 3.0,
+}
+
+
+# Yelp
+
+# Seconds to wait for Yelp before giving up on a search
+YELP_TIMEOUT_SECONDS = 5.0
+# How many Yelp clients (and their HTTP connections) each process keeps open
+YELP_CLIENT_POOL_SIZE = 8
+# Searches are cached per cell of this many decimal places of latitude and longitude. 2 is about a kilometer.
+YELP_CACHE_CELL_DECIMALS = 2
+# How long cached results are fresh
+YELP_CACHE_TTL_SECONDS = 15 * 60
+# How long stale results are still served while they are refreshed in the background
+YELP_CACHE_STALE_SECONDS = 60 * 60
+# Which entry of CACHES holds the results
+YELP_CACHE_ALIAS = 'default'
+
+
+# Secrets
+
+# File the API keys are read from. Each key can also be set with an environment variable (see api/config.py).
+SECRETS_FILE = os.environ.get('SECRETS_FILE', 'yelp_api_key.txt')
+# How often the secrets file is checked for changes
+SECRETS_RELOAD_CHECK_SECONDS = 1.0
+
+
+# Notifications
+
+# Delivery worker threads draining the notification outbox
+NOTIFY_WORKERS = 4
+# Start the workers inside the web process. Turn off when running `manage.py deliver_notifications` instead.
+NOTIFY_WORKERS_IN_PROCESS = os.environ.get('NOTIFY_WORKERS_IN_PROCESS', 'true').lower() == 'true'
+# How often idle workers look for due notifications (new ones wake them straight away)
+NOTIFY_POLL_SECONDS = 5
+# How many notifications of each channel can be sent at once
+NOTIFY_CHANNEL_CONCURRENCY = {'email': 4, 'text': 2}
+# Tries before a notification is marked failed
+NOTIFY_MAX_ATTEMPTS = 5
+# Wait before retrying, doubled after each failed try up to the max
+NOTIFY_BACKOFF_BASE_SECONDS = 10
+NOTIFY_BACKOFF_MAX_SECONDS = 60 * 60
+# How long a worker may take to send before the notification is handed to another worker
+NOTIFY_SENDING_TIMEOUT_SECONDS = 5 * 60
+# New notifications wait this long so anything else for the same user and channel is sent with them
+NOTIFY_COALESCE_WINDOW_SECONDS = 30
+# Token buckets: each user can be sent `capacity` notifications, refilled over `per_seconds`,
+# and no more than the channel's limit of those by email or text
+NOTIFY_RATE_LIMITS = {
+    'user': {'capacity': 20, 'per_seconds': 60 * 60},
+    'email': {'capacity': 20, 'per_seconds': 60 * 60},
+    'text': {'capacity': 5, 'per_seconds': 60 * 60},
+}
+
+
+# Messaging
+
+# Seconds to wait for Twilio or SendGrid before giving up on a message
+MESSAGING_TIMEOUT_SECONDS = 10.0
+# How many connections to each provider each process keeps open for reuse
+MESSAGING_POOL_SIZE = 10
+TWILIO_API_BASE_URL = os.environ.get('TWILIO_API_BASE_URL', 'https://api.twilio.com')
+SENDGRID_API_HOST = os.environ.get('SENDGRID_API_HOST', 'https://api.sendgrid.com')
+# Trial Twilio accounts can only text verified numbers, so every text goes to the reserve number
+TWILIO_VERIFIED_NUMBERS_ONLY = os.environ.get('TWILIO_VERIFIED_NUMBERS_ONLY', 'true').lower() == 'true'
+
+
+# Broadcasts
+
+# How many recipients are read from the database at a time
+BROADCAST_CHUNK_SIZE = 2000
+# Recipients per SendGrid request. SendGrid allows up to 1000 personalizations per request.
+BROADCAST_EMAIL_BATCH_SIZE = 1000
+# How many texts a broadcast sends at once
+BROADCAST_SMS_CONCURRENCY = 16
+# How long a sending broadcast stays claimed without saving progress. After that its sender is
+# taken to have died and another process resumes it.
+BROADCAST_LEASE_SECONDS = 5 * 60
+# How often each process looks for broadcasts that are waiting for a sender
+BROADCAST_RECOVERY_SECONDS = 60
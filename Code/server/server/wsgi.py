@@ -14,3 +14,12 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server.settings')
 
 application = get_wsgi_application()
+
+# Starts the background threads that run inside the web process straight away, so the gig deadlines,
+# notifications, gig events and broadcasts left waiting when the last process stopped are picked up
+from api import broadcasts, events, expiry, notifications
+
+expiry.start_scheduler()
+notifications.wake_workers()
+events.start_projector()
+broadcasts.start_recovery()